@@ -0,0 +1,203 @@
+"""
+Measure the throughput of the data pipeline on synthetic slides and write the results as JSON, so runs on different
+commits can be compared.
+
+    python -m benchmark.run --output results.json
+    python -m benchmark.run --compare before.json --output after.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Callable
+
+import h5py
+import numpy as np
+from shapely.prepared import prep
+
+from src.data_access import LabelIterator, DataIterator, Hdf5Iterator
+from src.data_preparation.write_labels_to_hdf5 import rasterize_tile, classify_tile, BOUNDARY
+from src.pre_proccessing import PatchIterator
+from src.util import PatchCoordinateIterator, LabelEnum
+from .synthetic import FakeVsiIterator, make_dataset, make_slide, make_roi
+
+SIZE = 256
+STRIDE = 128
+BATCH_SIZE = 32
+WIDTH = 4096
+HEIGHT = 3072
+NUM_IMAGES = 2
+REPEATS = 3
+
+
+def measure(name: str, run: Callable[[], tuple[int, int]], repeats: int = REPEATS) -> dict:
+    """
+    Time a benchmark and keep the fastest of repeats runs.
+    :param run: A function that returns the number of patches and the number of bytes it produced
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        patches, num_bytes = run()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    result = {
+        'name': name,
+        'patches': patches,
+        'seconds': best,
+        'patches_per_second': patches / best,
+        'mb_per_second': num_bytes / best / 1e6,
+    }
+    print(f"{name:50} {result['patches_per_second']:10.1f} patches/s {result['mb_per_second']:8.1f} MB/s")
+    return result
+
+
+def count_batches(iterator) -> tuple[int, int]:
+    patches, num_bytes = 0, 0
+    for batch in iterator:
+        if isinstance(batch, tuple):
+            patches += len(batch[0])
+            num_bytes += sum(part.nbytes for part in batch if part is not None)
+        else:
+            patches += len(batch)
+            num_bytes += batch.nbytes
+    return patches, num_bytes
+
+
+def bench_coordinates(width: int, height: int) -> tuple[int, int]:
+    patch_it = PatchCoordinateIterator(width, height, SIZE, STRIDE)
+    patches = 0
+    while len(coords := patch_it.next_batch(BATCH_SIZE)):
+        patches += len(coords)
+    return patches, patches * 2 * 8
+
+
+def bench_vsi(image: np.ndarray, buffered: bool) -> tuple[int, int]:
+    slide_it = FakeVsiIterator(image, SIZE, STRIDE, BATCH_SIZE, buffered=buffered)
+    slide_it.open()
+    try:
+        return count_batches(iter(slide_it))
+    finally:
+        slide_it.close()
+
+
+def bench_hdf5(image_group: h5py.Group, buffered: bool) -> tuple[int, int]:
+    slide_it = Hdf5Iterator(image_group['full'], SIZE, STRIDE, BATCH_SIZE, buffered=buffered)
+    slide_it.open()
+    try:
+        return count_batches(iter(slide_it))
+    finally:
+        slide_it.close()
+
+
+def bench_labels(labels: h5py.Dataset, label_type: LabelEnum, buffered: bool, use_integral: bool) -> tuple[int, int]:
+    label_it = LabelIterator(labels, SIZE, STRIDE, BATCH_SIZE, label_type, buffered=buffered, use_integral=use_integral)
+    return count_batches(label_it)
+
+
+def bench_data(data_group: h5py.Group, buffered: bool, raw: bool = False) -> tuple[int, int]:
+    data_it = DataIterator(data_group, SIZE, STRIDE, BATCH_SIZE, LabelEnum.CLASS_MIDDLE, buffered=buffered, raw=raw,
+                           ring_size=4 if raw else 0)
+    data_it.open()
+    try:
+        return count_batches(iter(data_it))
+    finally:
+        data_it.close()
+
+
+def bench_patch_iterator(tiff_path: str) -> tuple[int, int]:
+    patch_it = PatchIterator(tiff_path, SIZE, STRIDE)
+    out = np.empty((BATCH_SIZE, SIZE, SIZE, 3), dtype=np.uint8)
+    patches, num_bytes = 0, 0
+    while patch_it.has_next():
+        batch, _ = patch_it.get_batch(BATCH_SIZE, out)
+        patches += len(batch)
+        num_bytes += batch.nbytes
+    return patches, num_bytes
+
+
+def bench_rasterize(width: int, height: int) -> tuple[int, int]:
+    roi = make_roi(width, height)
+    prepared_roi = prep(roi)
+    patches = 0
+    for top, left in PatchCoordinateIterator(width, height, SIZE, SIZE):
+        if classify_tile(prepared_roi, left, top, SIZE) == BOUNDARY:
+            rasterize_tile(roi, left, top, SIZE)
+        patches += 1
+    return patches, patches * SIZE * SIZE
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_all(directory: str, width: int, height: int, num_images: int) -> list[dict]:
+    hdf5_path, partition, tiff_paths = make_dataset(directory, width, height, num_images)
+    image = make_slide(width, height)
+    results = [measure('patch_coordinate_iterator', lambda: bench_coordinates(width * 8, height * 8))]
+    for buffered in [False, True]:
+        results.append(measure(f'vsi_iterator buffered={buffered}', lambda: bench_vsi(image, buffered)))
+    with h5py.File(hdf5_path, 'r') as file:
+        image_group = file[partition]['slide_0']
+        for buffered in [False, True]:
+            results.append(measure(f'hdf5_iterator buffered={buffered}', lambda: bench_hdf5(image_group, buffered)))
+        for label_type in [LabelEnum.CLASS_MIDDLE, LabelEnum.CLASS_AVG, LabelEnum.PIXEL]:
+            for buffered, use_integral in [(False, False), (True, False), (False, True)]:
+                if use_integral and label_type == LabelEnum.PIXEL:
+                    continue
+                name = f'label_iterator {label_type.name} buffered={buffered} integral={use_integral}'
+                results.append(measure(
+                    name,
+                    lambda: bench_labels(image_group['labels'], label_type, buffered, use_integral),
+                ))
+        for buffered in [False, True]:
+            results.append(measure(f'data_iterator buffered={buffered}', lambda: bench_data(file[partition], buffered)))
+        results.append(measure('data_iterator buffered=True raw', lambda: bench_data(file[partition], True, True)))
+    results.append(measure('patch_iterator', lambda: bench_patch_iterator(tiff_paths[0])))
+    results.append(measure('label_rasterization', lambda: bench_rasterize(width * 4, height * 4)))
+    return results
+
+
+def compare(previous: list[dict], results: list[dict]):
+    before = {result['name']: result['patches_per_second'] for result in previous}
+    for result in results:
+        if result['name'] in before:
+            change = result['patches_per_second'] / before[result['name']] - 1
+            print(f"{result['name']:50} {change:+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the data pipeline on synthetic slides.')
+    parser.add_argument('--output', default='benchmark.json', help='The JSON file that the results are written to')
+    parser.add_argument('--compare', help='A JSON file of an earlier run to compare with')
+    parser.add_argument('--width', type=int, default=WIDTH, help='The width of the synthetic slides')
+    parser.add_argument('--height', type=int, default=HEIGHT, help='The height of the synthetic slides')
+    parser.add_argument('--images', type=int, default=NUM_IMAGES, help='The number of synthetic slides')
+    parser.add_argument('--directory', help='Where the synthetic slides are written, a temporary directory if not '
+                                            'given')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        results = run_all(args.directory or temporary, args.width, args.height, args.images)
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Synthetic slides for the benchmarks, so they run without the slide drive or a JVM.
+"""
+import os
+
+import h5py
+import numpy as np
+import pyvips as pv
+from rasterio.features import rasterize
+from shapely.geometry import Point
+from shapely.geometry.base import BaseGeometry
+
+from src.data_access import VsiIterator, BioformatsReader
+from src.data_access.integral_labels import write_integral_labels
+from src.data_access.read_vsi import FULL_INDEX, DOWNSAMPLE_INDEX
+
+DOWNSAMPLE_FACTOR = 32
+
+
+def make_roi(width: int, height: int) -> BaseGeometry:
+    """
+    A disk of 'grey matter' in the middle of the slide.
+    """
+    return Point(width / 2, height / 2).buffer(min(width, height) / 3)
+
+
+def make_slide(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """
+    An (height, width, 3) uint8 RGB image of a stained tissue disk with noise on a white background.
+    """
+    rng = np.random.default_rng(seed)
+    rows, columns = np.ogrid[:height, :width]
+    distance = np.hypot(rows - height / 2, columns - width / 2) / (min(width, height) / 2)
+    tissue = (distance < 0.9)[:, :, None]
+    stain = np.array([170, 90, 140], dtype=np.int16)
+    noise = rng.integers(-20, 20, (height, width, 3), dtype=np.int16)
+    image = np.where(tissue, stain + noise, 240 + noise // 4)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def make_labels(roi: BaseGeometry, width: int, height: int) -> np.ndarray:
+    labels = np.zeros((height, width), dtype=np.uint8)
+    rasterize([roi], out=labels, default_value=1)
+    return labels.astype(bool)
+
+
+def write_tiff(path: str, image: np.ndarray):
+    """
+    Write an image as a tiled pyramidal TIFF, like the slides that the pre_proccessing package reads.
+    """
+    pv.Image.new_from_array(image).tiffsave(path, tile=True, pyramid=True, compression='lzw')
+
+
+def write_hdf5(path: str, images: dict[str, np.ndarray], partition: str = 'benchmark') -> str:
+    """
+    Write a data file with the layout that DataIterator reads: one group per image with the 'full' and 'downsample'
+    image datasets, the 'labels' with their integral, and a 'vsi_path'.
+    :return: The partition group name
+    """
+    with h5py.File(path, 'w') as file:
+        group = file.create_group(partition)
+        for name, image in images.items():
+            height, width, _ = image.shape
+            image_group = group.create_group(name)
+            image_group.create_dataset('full', data=image, chunks=(128, 128, 3), compression='lzf')
+            image_group.create_dataset('downsample', data=image[::DOWNSAMPLE_FACTOR, ::DOWNSAMPLE_FACTOR])
+            labels = image_group.create_dataset(
+                'labels',
+                data=make_labels(make_roi(width, height), width, height),
+                chunks=True,
+                compression='lzf',
+            )
+            write_integral_labels(labels)
+            image_group['vsi_path'] = f'{name}.vsi'
+    return partition
+
+
+class FakeRdr:
+    """
+    The part of the Bio-Formats reader interface that the BioformatsReader uses, backed by an in-memory image.
+    """
+    def __init__(self, image: np.ndarray):
+        self.series = {FULL_INDEX: image, DOWNSAMPLE_INDEX: image[::DOWNSAMPLE_FACTOR, ::DOWNSAMPLE_FACTOR]}
+        self.current = FULL_INDEX
+
+    def setSeries(self, index: int):
+        self.current = index
+
+    def getSizeX(self) -> int:
+        return self.series[self.current].shape[1]
+
+    def getSizeY(self) -> int:
+        return self.series[self.current].shape[0]
+
+    def openBytesXYWH(self, plane: int, x: int, y: int, width: int, height: int) -> np.ndarray:
+        # Bio-Formats returns a flat copy of the interleaved bytes
+        return self.series[self.current][y:y + height, x:x + width].reshape(-1).copy()
+
+
+class FakeReader:
+    def __init__(self, image: np.ndarray):
+        self.rdr = FakeRdr(image)
+
+    def read(self, rescale: bool = True) -> np.ndarray:
+        image = self.rdr.series[self.rdr.current]
+        return image / 255.0 if rescale else image
+
+    def close(self):
+        pass
+
+
+class FakeBioformatsReader(BioformatsReader):
+    """
+    A BioformatsReader that opens an in-memory image through FakeReader instead of Bio-Formats.
+    """
+    def __init__(self, image: np.ndarray):
+        super().__init__('fake.vsi')
+        self.image = image
+
+    def open(self):
+        self.reader = FakeReader(self.image)
+        self.reader.rdr.setSeries(self.series[0])
+
+
+class FakeVsiIterator(VsiIterator):
+    """
+    A VsiIterator that reads an in-memory image through FakeBioformatsReader, so no JVM is needed.
+    """
+    def __init__(self, image: np.ndarray, *args, **kwargs):
+        super().__init__('fake.vsi', *args, **kwargs)
+        self.reader = FakeBioformatsReader(image)
+
+
+def make_dataset(directory: str, width: int, height: int, num_images: int) -> tuple[str, str, list[str]]:
+    """
+    Write num_images synthetic slides as TIFFs and as one hdf5 data file.
+    :return: The path of the data file, its partition and the paths of the TIFFs
+    """
+    os.makedirs(directory, exist_ok=True)
+    images = {f'slide_{i}': make_slide(width, height, seed=i) for i in range(num_images)}
+    tiff_paths = []
+    for name, image in images.items():
+        tiff_paths.append(os.path.join(directory, f'{name}.tif'))
+        write_tiff(tiff_paths[-1], image)
+    hdf5_path = os.path.join(directory, 'data.hdf5')
+    partition = write_hdf5(hdf5_path, images)
+    return hdf5_path, partition, tiff_paths
@@ -1,3 +1,10 @@
-from .read_vsi import VsiIterator
+from .read_slide import SlideReader, SlideIterator
+from .read_vsi import VsiIterator, BioformatsReader
+from .read_hdf5 import Hdf5Iterator, Hdf5Reader
+from .read_tiff import TiffIterator, TiffReader
 from .read_labels import LabelIterator
-from .read_data import ImageIterator, DataIterator, rec_read
\ No newline at end of file
+from .read_data import ImageIterator, DataIterator, rec_read
+from .class_index import BalancedSampler, get_class_index
+from .prefetch import PrefetchIterator
+from .patch_index import PatchIndex, PatchReader
+from .batch_ring import BatchRing
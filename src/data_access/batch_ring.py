@@ -0,0 +1,41 @@
+import numpy as np
+
+RING_SIZE = 4
+
+
+class BatchRing:
+    """
+    A fixed number of preallocated batch buffers that are handed out in turn, so reading a batch allocates nothing. A
+    buffer is handed out again num_buffers batches later and then overwritten, so num_buffers must be larger than the
+    number of batches that are in use at once: the batches in the queue of a PrefetchIterator, the batch that is being
+    read, the batch that is being trained on and a batch whose asynchronous copy to the GPU may still be running.
+    """
+    def __init__(self, shape: tuple[int, ...], dtype: np.dtype, num_buffers: int = RING_SIZE, pin_memory: bool = False):
+        """
+        Constructor for the BatchRing
+        :param shape: The shape of a full batch, smaller batches use the first rows of a buffer
+        :param pin_memory: Allocate the buffers in page-locked memory, so they are copied to the GPU faster and
+        asynchronously. This needs torch with CUDA.
+        """
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        if pin_memory:
+            # only pinned buffers need torch
+            import torch
+
+            torch_dtype = torch.from_numpy(np.empty(0, self.dtype)).dtype
+            self.buffers = [torch.empty(shape, dtype=torch_dtype, pin_memory=True).numpy() for _ in range(num_buffers)]
+        else:
+            self.buffers = [np.empty(shape, self.dtype) for _ in range(num_buffers)]
+        self.index = 0
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def next(self) -> np.ndarray:
+        """
+        Get the next buffer of the ring.
+        """
+        buffer = self.buffers[self.index]
+        self.index = (self.index + 1) % len(self.buffers)
+        return buffer
@@ -0,0 +1,171 @@
+from typing import Optional
+
+import h5py
+import numpy as np
+
+from src.util import PatchGrid, LabelEnum, LruCache
+from .integral_labels import get_labels_mtime
+from .read_labels import LabelIterator
+from .read_data import get_slide_iterator
+
+CLASS_INDEX_NAME = 'class_index'
+NUM_CLASSES = 2
+INDEX_BATCH_SIZE = 4096
+MAX_OPEN_SLIDES = 8
+
+
+def get_index_name(size: int, stride: int, label_type: LabelEnum) -> str:
+    return f'{label_type.name.lower()}_{size}_{stride}'
+
+
+def compute_class_index(
+        labels: h5py.Dataset,
+        size: int,
+        stride: int,
+        label_type: LabelEnum = LabelEnum.CLASS_MIDDLE,
+) -> list[np.ndarray]:
+    """
+    Compute the flat grid indices of the patches of every class of an image. The labels are read with a buffered
+    LabelIterator, which uses the summed-area table of the labels when it exists. With CLASS_MIDDLE a patch belongs to
+    the class of its centre pixel, as in get_patch_class, and with CLASS_AVG to class 1 when at least half of its
+    pixels are labelled.
+    :param labels: The boolean label dataset of an image
+    :param label_type: CLASS_MIDDLE or CLASS_AVG
+    :return: One sorted array of flat indices into the PatchGrid of the image per class
+    """
+    if label_type not in [LabelEnum.CLASS_MIDDLE, LabelEnum.CLASS_AVG]:
+        raise ValueError(f"A class index needs a class label type, got {label_type}")
+    label_it = LabelIterator(labels, size, stride, INDEX_BATCH_SIZE, label_type, buffered=True)
+    classes = np.concatenate(list(label_it)) >= 0.5
+    return [np.flatnonzero(classes == c) for c in range(NUM_CLASSES)]
+
+
+def get_class_index(
+        image_group: h5py.Group,
+        size: int,
+        stride: int,
+        label_type: LabelEnum = LabelEnum.CLASS_MIDDLE,
+) -> list[np.ndarray]:
+    """
+    Get the per-class flat grid indices of an image, see compute_class_index. The index is computed once and cached in
+    the 'class_index' group of the image when the hdf5 file is writable. The cache is keyed on the shape of the labels
+    and the time they were written, see touch_labels, so it is recomputed after the labels are rewritten.
+    """
+    name = get_index_name(size, stride, label_type)
+    labels = image_group['labels']
+    mtime = get_labels_mtime(labels)
+    stale = False
+    if CLASS_INDEX_NAME in image_group and name in image_group[CLASS_INDEX_NAME]:
+        group = image_group[CLASS_INDEX_NAME][name]
+        if tuple(group.attrs.get('labels_shape', ())) == labels.shape and group.attrs.get('labels_mtime') == mtime:
+            return [group[str(c)][()] for c in range(NUM_CLASSES)]
+        stale = True
+    index = compute_class_index(labels, size, stride, label_type)
+    if image_group.file.mode == 'r+':
+        if stale:
+            del image_group[CLASS_INDEX_NAME][name]
+        group = image_group.require_group(CLASS_INDEX_NAME).create_group(name)
+        group.attrs['labels_shape'] = labels.shape
+        group.attrs['labels_mtime'] = mtime
+        for c, indices in enumerate(index):
+            group.create_dataset(str(c), data=indices, compression='lzf', chunks=True if len(indices) else None)
+    return index
+
+
+class BalancedSampler:
+    """
+    An endless iterator over batches of (patches, labels) drawn from all images of a data group at a fixed class ratio.
+    The patches are drawn uniformly from the class index of every class, see get_class_index, so no patches are read
+    and discarded.
+    """
+    def __init__(
+            self,
+            data_group: h5py.Group,
+            size: int,
+            stride: int,
+            batch_size: int,
+            label_type: LabelEnum = LabelEnum.CLASS_MIDDLE,
+            ratio: float = 0.5,
+            seed: Optional[int] = None,
+            max_open: int = MAX_OPEN_SLIDES,
+    ):
+        """
+        Constructor for the BalancedSampler
+        :param ratio: The fraction of class 1 patches in every batch
+        :param seed: The seed of the random patches, random if None
+        :param max_open: The maximum number of slides that are kept open at once
+        """
+        self.data_group = data_group
+        self.size = size
+        self.stride = stride
+        self.batch_size = batch_size
+        self.label_type = label_type
+        self.ratio = ratio
+        self.rng = np.random.default_rng(seed)
+
+        self.image_list = [key for key in data_group.keys()]
+        self.grids = []
+        image_ids = [[] for _ in range(NUM_CLASSES)]
+        indices = [[] for _ in range(NUM_CLASSES)]
+        for image_id, name in enumerate(self.image_list):
+            image_group = data_group[name]
+            height, width = image_group['labels'].shape
+            self.grids.append(PatchGrid(width, height, size, stride))
+            for c, class_indices in enumerate(get_class_index(image_group, size, stride, label_type)):
+                image_ids[c].append(np.full(len(class_indices), image_id, dtype=np.int64))
+                indices[c].append(class_indices)
+        self.image_ids = [np.concatenate(ids) for ids in image_ids]
+        self.indices = [np.concatenate(i) for i in indices]
+
+        self.slides = LruCache(max_open, close=lambda slide_it: slide_it.close())
+
+    def class_counts(self) -> list[int]:
+        return [len(indices) for indices in self.indices]
+
+    def open_slide(self, image_id: int):
+        slide_it = get_slide_iterator(self.data_group[self.image_list[image_id]], self.size, self.stride, 1)
+        slide_it.open()
+        return slide_it
+
+    def sample(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Draw the patches of one batch without reading them.
+        :return: The image id, the (top, left) coordinates and the class of every patch, sorted by image
+        """
+        num_positive = int(round(self.batch_size * self.ratio))
+        counts = [self.batch_size - num_positive, num_positive]
+        image_ids, coords, labels = [], [], []
+        for c, count in enumerate(counts):
+            if count == 0:
+                continue
+            if len(self.indices[c]) == 0:
+                raise ValueError(f"No patches of class {c} in the data group")
+            picks = self.rng.integers(len(self.indices[c]), size=count)
+            ids = self.image_ids[c][picks]
+            image_ids.append(ids)
+            coords.append(np.stack([self.grids[i][int(j)] for i, j in zip(ids, self.indices[c][picks])]))
+            labels.append(np.full(count, c, dtype=np.float32))
+        image_ids, coords, labels = np.concatenate(image_ids), np.concatenate(coords), np.concatenate(labels)
+        # read the patches of one slide together
+        order = np.argsort(image_ids, kind='stable')
+        return image_ids[order], coords[order], labels[order]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> tuple[np.ndarray, np.ndarray]:
+        image_ids, coords, labels = self.sample()
+        batch = np.zeros((len(coords), 3, self.size, self.size), dtype=np.float32)
+        for i, (image_id, (top, left)) in enumerate(zip(image_ids, coords)):
+            slide_it = self.slides.get(int(image_id), lambda: self.open_slide(int(image_id)))
+            batch[i] = slide_it.read_patch(top, left)
+        return batch, labels
+
+    def close(self):
+        self.slides.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,140 @@
+import time
+
+import h5py
+import numpy as np
+
+INTEGRAL_NAME = 'labels_integral'
+SAMPLE_NAME = 'labels_sample'
+INTEGRAL_BLOCK = 32
+WRITE_ROWS = 64
+LABELS_MTIME = 'mtime'
+
+
+def write_integral_labels(labels: h5py.Dataset, block: int = INTEGRAL_BLOCK):
+    """
+    Precompute a summed-area table and a point sample of a label dataset and store them next to it. The table holds
+    the exact sum of labels[:i * block, :j * block] at position (i, j), so the sum of any patch whose edges lie on
+    multiples of block is found with four lookups. The sample holds labels[::block, ::block]. Both are computed one
+    band of block rows at a time, so the labels are never loaded into memory at once.
+    :param labels: The boolean label dataset of an image
+    :param block: The spacing of the table in pixels. Patch size and stride should be multiples of it.
+    """
+    group = labels.parent
+    for name in [INTEGRAL_NAME, SAMPLE_NAME]:
+        if name in group:
+            del group[name]
+    height, width = labels.shape
+    num_bands = -(-height // block)
+    num_columns = -(-width // block)
+    integral = group.create_dataset(
+        INTEGRAL_NAME,
+        (height // block + 1, width // block + 1),
+        dtype=np.uint64,
+        compression='lzf',
+        chunks=True,
+    )
+    sample = group.create_dataset(SAMPLE_NAME, (num_bands, num_columns), dtype=bool, compression='lzf', chunks=True)
+    integral.attrs['block'] = block
+    sample.attrs['block'] = block
+
+    column_prefix = np.zeros(width + 1, dtype=np.uint64)
+    row = np.zeros(integral.shape[1], dtype=np.uint64)
+    rows, samples = [row.copy()], []
+    rows_written, samples_written = 0, 0
+    for i in range(num_bands):
+        band = labels[i * block:(i + 1) * block, :]
+        samples.append(band[0, ::block])
+        if len(band) == block:
+            np.cumsum(band.sum(axis=0, dtype=np.uint64), out=column_prefix[1:])
+            row += column_prefix[::block][:len(row)]
+            rows.append(row.copy())
+        last = i == num_bands - 1
+        if rows and (len(rows) == WRITE_ROWS or last):
+            integral[rows_written:rows_written + len(rows)] = np.stack(rows)
+            rows_written += len(rows)
+            rows = []
+        if len(samples) == WRITE_ROWS or last:
+            sample[samples_written:samples_written + len(samples)] = np.stack(samples)
+            samples_written += len(samples)
+            samples = []
+
+
+def has_integral_labels(labels: h5py.Dataset) -> bool:
+    return INTEGRAL_NAME in labels.parent and SAMPLE_NAME in labels.parent
+
+
+def touch_labels(labels: h5py.Dataset):
+    """
+    Record that a label dataset was (re)written, so data derived from it, such as a class index, is recomputed.
+    """
+    labels.attrs[LABELS_MTIME] = time.time()
+
+
+def get_labels_mtime(labels: h5py.Dataset) -> float:
+    """
+    Get the time that touch_labels recorded, 0 for labels that were written without it.
+    """
+    return float(labels.attrs.get(LABELS_MTIME, 0))
+
+
+class IntegralLabels:
+    """
+    Per-patch class labels from the precomputed summed-area table and point sample of a label dataset. Patches whose
+    edges or centre do not lie on the table's block spacing, such as the patches clamped to the edge of the image, fall
+    back to reading the label dataset.
+    """
+    def __init__(self, labels: h5py.Dataset):
+        self.labels = labels
+        self.integral = labels.parent[INTEGRAL_NAME]
+        self.sample = labels.parent[SAMPLE_NAME]
+        self.block = int(self.integral.attrs['block'])
+
+    def read_rows(self, dataset: h5py.Dataset, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Read the given rows of a dataset with a single fancy-indexed read.
+        :return: The data of the unique rows and, for every requested row, its index in that data
+        """
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        return dataset[unique_rows.tolist()], inverse.reshape(rows.shape)
+
+    def class_avg(self, coords: np.ndarray, size: int) -> np.ndarray:
+        """
+        Get the fraction of labelled pixels of each patch.
+        :param coords: An (N, 2) array of (top, left) coordinates
+        :param size: Width and height of the patches
+        :return: An (N,) float64 array, equal to the mean of each label patch
+        """
+        result = np.zeros(len(coords), dtype=np.float64)
+        aligned = np.all(coords % self.block == 0, axis=1) & (size % self.block == 0)
+        if aligned.any():
+            top, left = (coords[aligned] // self.block).T
+            bottom, right = top + size // self.block, left + size // self.block
+            data, inverse = self.read_rows(self.integral, np.stack([top, bottom]))
+            # uint64 wraps around on the intermediate subtraction, the final sum is exact
+            sums = (
+                data[inverse[1], right] - data[inverse[0], right] - data[inverse[1], left] + data[inverse[0], left]
+            )
+            result[aligned] = sums.astype(np.int64) / (size * size)
+        for i in np.flatnonzero(~aligned):
+            top, left = coords[i]
+            result[i] = self.labels[top:top + size, left:left + size].mean()
+        return result
+
+    def class_middle(self, coords: np.ndarray, size: int) -> np.ndarray:
+        """
+        Get the label of the centre pixel of each patch.
+        :param coords: An (N, 2) array of (top, left) coordinates
+        :param size: Width and height of the patches
+        :return: An (N,) boolean array
+        """
+        result = np.zeros(len(coords), dtype=bool)
+        centres = coords + int(size / 2)
+        aligned = np.all(centres % self.block == 0, axis=1)
+        if aligned.any():
+            rows, columns = (centres[aligned] // self.block).T
+            data, inverse = self.read_rows(self.sample, rows)
+            result[aligned] = data[inverse, columns]
+        for i in np.flatnonzero(~aligned):
+            row, column = centres[i]
+            result[i] = self.labels[row, column]
+        return result
@@ -0,0 +1,159 @@
+from typing import Optional
+
+import h5py
+import numpy as np
+
+from src.util import PatchGrid, LabelEnum, LruCache
+from .read_labels import LabelIterator, get_label_shape, get_label_dtype
+from .read_data import get_slide_iterator
+from .tissue_mask import get_tissue_mask, get_tissue_fractions
+from .class_index import MAX_OPEN_SLIDES
+
+PATCH_DTYPE = np.dtype([('image_id', np.int32), ('row', np.int32), ('col', np.int32)])
+
+
+def get_image_entries(image_id: int, grid: PatchGrid, keep: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Get the index entries of the patches of one image, in raster order.
+    :param keep: A boolean array with one entry per patch of the grid, all patches are used if None
+    """
+    indices = np.arange(len(grid)) if keep is None else np.flatnonzero(keep)
+    entries = np.empty(len(indices), dtype=PATCH_DTYPE)
+    entries['image_id'] = image_id
+    entries['row'], entries['col'] = np.divmod(indices, grid.shape[1])
+    return entries
+
+
+class PatchIndex:
+    """
+    A global, random-access index of the patches of all images of a data group. Every patch is one (image_id, row, col)
+    entry of a structured array, where row and col are its position in the PatchGrid of the image, so the index takes
+    12 bytes per patch and building it reads no pixels.
+    """
+    def __init__(
+            self,
+            data_group: h5py.Group,
+            size: int,
+            stride: int,
+            tissue_threshold: Optional[float] = None,
+    ):
+        """
+        Constructor for the PatchIndex
+        :param data_group: A partition of the data file, such as 'train'
+        :param tissue_threshold: Leave out patches whose fraction of tissue is below this threshold, see
+        ImageIterator. The tissue mask is read from the data file, or computed from the downsampled image.
+        """
+        self.size = size
+        self.stride = stride
+        self.tissue_threshold = tissue_threshold
+
+        self.image_list = [key for key in data_group.keys()]
+        self.grids = []
+        entries = []
+        for image_id, name in enumerate(self.image_list):
+            image_group = data_group[name]
+            height, width = image_group['labels'].shape
+            grid = PatchGrid(width, height, size, stride)
+            self.grids.append(grid)
+            keep = None
+            if tissue_threshold is not None:
+                keep = get_tissue_fractions(self.get_tissue_mask(image_group), grid) >= tissue_threshold
+            entries.append(get_image_entries(image_id, grid, keep))
+        self.entries = np.concatenate(entries) if entries else np.empty(0, dtype=PATCH_DTYPE)
+
+    def get_tissue_mask(self, image_group: h5py.Group) -> np.ndarray:
+        slide_it = None
+
+        def get_thumbnail():
+            nonlocal slide_it
+            slide_it = get_slide_iterator(image_group, self.size, self.stride, 1)
+            slide_it.open()
+            return slide_it.get_thumbnail()
+
+        try:
+            return get_tissue_mask(image_group, get_thumbnail)
+        finally:
+            if slide_it is not None:
+                slide_it.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_coords(self, indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Look up patches in the index.
+        :param indices: An array of indices into the index
+        :return: The image id and the (top, left) pixel coordinates of every patch
+        """
+        entries = self.entries[indices]
+        coords = np.empty((len(entries), 2), dtype=np.int64)
+        for image_id in np.unique(entries['image_id']):
+            part = entries['image_id'] == image_id
+            grid = self.grids[image_id]
+            coords[part, 0] = grid.row_pixels[entries['row'][part]]
+            coords[part, 1] = grid.column_pixels[entries['col'][part]]
+        return entries['image_id'], coords
+
+
+class PatchReader:
+    """
+    Reads the patches and labels of arbitrary entries of a PatchIndex. The slides of the most recently used images are
+    kept open, so random access does not reopen a slide for every patch.
+    """
+    def __init__(
+            self,
+            data_group: h5py.Group,
+            index: PatchIndex,
+            label_type: LabelEnum,
+            backend: Optional[str] = None,
+            max_open: int = MAX_OPEN_SLIDES,
+            raw: bool = False,
+    ):
+        """
+        Constructor for the PatchReader
+        :param backend: The slide backend of all images, see get_slide_reader
+        :param max_open: The maximum number of slides that are kept open at once
+        :param raw: Return uint8 patches and labels, see ImageIterator
+        """
+        self.data_group = data_group
+        self.index = index
+        self.label_type = label_type
+        self.backend = backend
+        self.raw = raw
+
+        self.slides = LruCache(max_open, close=lambda image: image[0].close())
+
+    def open_image(self, image_id: int) -> tuple:
+        image_group = self.data_group[self.index.image_list[image_id]]
+        size, stride = self.index.size, self.index.stride
+        slide_it = get_slide_iterator(image_group, size, stride, 1, backend=self.backend, raw=self.raw)
+        slide_it.open()
+        label_it = LabelIterator(image_group['labels'], size, stride, 1, self.label_type, raw=self.raw)
+        return slide_it, label_it
+
+    def read(self, indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Read the patches and labels of entries of the index. The entries of one image are read together, with one label
+        lookup per image.
+        :return: The (N, 3, size, size) float32 patches and the float32 labels, or uint8 if raw, in the order of indices
+        """
+        image_ids, coords = self.index.get_coords(np.asarray(indices))
+        size = self.index.size
+        patches = np.empty((len(coords), 3, size, size), dtype=np.uint8 if self.raw else np.float32)
+        label_shape = get_label_shape(self.label_type, len(coords), size)
+        labels = np.empty(label_shape, dtype=get_label_dtype(self.label_type, self.raw))
+        for image_id in np.unique(image_ids):
+            part = np.flatnonzero(image_ids == image_id)
+            slide_it, label_it = self.slides.get(int(image_id), lambda: self.open_image(int(image_id)))
+            patches[part] = slide_it.read_patches(coords[part])
+            labels[part] = label_it.read_labels(coords[part])
+        return patches, labels
+
+    def close(self):
+        self.slides.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
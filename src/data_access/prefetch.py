@@ -0,0 +1,146 @@
+import queue
+import threading
+
+from src.util.jvm import is_jvm_started
+
+PREFETCH_DEPTH = 2
+
+_ITEM = 0
+_STOP = 1
+_ERROR = 2
+
+
+class PrefetchIterator:
+    """
+    A wrapper around a batch iterator such as DataIterator or ImageIterator that reads the next batches on a background
+    thread while the caller works on the current one. At most depth batches are held in memory.
+
+    The state_dict of a source that has one is recorded with every batch, so state_dict returns the position after the
+    last batch that the caller received, not after the batches that were read ahead.
+    """
+    def __init__(self, source, depth: int = PREFETCH_DEPTH, attach_jvm: bool = True, timeout: float = 0.1):
+        """
+        Constructor for the PrefetchIterator
+        :param source: The iterator to prefetch from, it should have open and close methods
+        :param depth: The maximum number of batches that are read ahead
+        :param attach_jvm: Attach the background thread to the javabridge VM, needed when source reads vsi images
+        :param timeout: How often in seconds the background thread checks whether it should stop while the queue is full
+        """
+        self.source = source
+        self.depth = depth
+        self.attach_jvm = attach_jvm
+        self.timeout = timeout
+
+        self.queue = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.done = False
+        self.track_state = hasattr(source, 'state_dict')
+        self.state = None
+
+    def __enter__(self):
+        self.source.open()
+        return self
+
+    def open(self):
+        return self.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        self.source.close()
+
+    def close(self):
+        self.__exit__(None, None, None)
+
+    def __iter__(self):
+        self.stop()
+        self.stop_event.clear()
+        self.done = False
+        if self.track_state and self.state is None:
+            self.state = self.source.state_dict()
+        self.queue = queue.Queue(maxsize=self.depth)
+        self.thread = threading.Thread(target=self.produce, name='prefetch', daemon=True)
+        self.thread.start()
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        if self.thread is None:
+            self.__iter__()
+        kind, value = self.queue.get()
+        if kind == _ITEM:
+            batch, self.state = value
+            return batch
+        self.done = True
+        self.thread.join()
+        self.thread = None
+        if kind == _ERROR:
+            raise value
+        raise StopIteration
+
+    def put(self, item) -> bool:
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=self.timeout)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(self):
+        try:
+            if self.attach_jvm and is_jvm_started():
+                import javabridge
+                javabridge.attach()
+            iterator = iter(self.source)
+            while not self.stop_event.is_set():
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    self.put((_STOP, None))
+                    return
+                state = self.source.state_dict() if self.track_state else None
+                if not self.put((_ITEM, (batch, state))):
+                    return
+        except Exception as e:
+            self.put((_ERROR, e))
+        finally:
+            # a JVM that was started later, by the first vsi image that this thread opened, attached this thread as well
+            if self.attach_jvm and is_jvm_started():
+                import javabridge
+                if javabridge.get_env() is not None:
+                    javabridge.detach()
+
+    def state_dict(self) -> dict:
+        """
+        Get the state of the source after the last batch that was returned.
+        """
+        if self.state is None:
+            return self.source.state_dict()
+        return self.state
+
+    def load_state_dict(self, state: dict):
+        """
+        Discard the batches that were read ahead and move the source to state. The next iteration continues from there.
+        """
+        self.stop()
+        self.source.load_state_dict(state)
+        self.state = state
+        self.done = False
+
+    def set_epoch(self, epoch: int):
+        self.stop()
+        self.source.set_epoch(epoch)
+        self.state = None
+        self.done = False
+
+    def stop(self):
+        """
+        Stop the background thread and discard the batches that were read ahead. The source is left open.
+        """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
@@ -1,8 +1,18 @@
 import os
+from typing import Callable, Optional
+
 import h5py
+import numpy as np
 
-from src.data_access import VsiIterator, LabelIterator
-from src.util import LabelEnum
+from src.data_access import LabelIterator
+from src.data_access.read_labels import get_label_shape, get_label_dtype
+from src.data_access.read_slide import SlideReader, SlideIterator
+from src.data_access.batch_ring import BatchRing
+from src.data_access.read_vsi import BioformatsReader
+from src.data_access.read_hdf5 import Hdf5Reader, FULL_NAME
+from src.data_access.read_tiff import TiffReader
+from src.data_access.tissue_mask import get_tissue_mask, get_tissue_fractions
+from src.util import LabelEnum, profiling
 
 
 def rec_read(group, lvl=0):
@@ -13,120 +23,402 @@ def rec_read(group, lvl=0):
         rec_read(group[sub_name], lvl + 1)
 
 
+TIFF_NAME = 'tiff_path'
+VSI_NAME = 'vsi_path'
+
+
+def get_slide_path(image_group: h5py.Group, name: str) -> str:
+    """
+    Get the path of a slide file that is stored relative to the data file in a dataset of the image group.
+    """
+    root = os.path.dirname(image_group.file.filename)
+    return os.path.join(root, image_group[name].asstr()[()])
+
+
+def get_vsi_path(image_group: h5py.Group) -> str:
+    return get_slide_path(image_group, VSI_NAME)
+
+
+BACKENDS: dict[str, Callable[[h5py.Group], SlideReader]] = {
+    'hdf5': lambda image_group: Hdf5Reader(image_group[FULL_NAME]),
+    'tiff': lambda image_group: TiffReader(get_slide_path(image_group, TIFF_NAME)),
+    'bioformats': lambda image_group: BioformatsReader(get_vsi_path(image_group)),
+}
+
+
+def get_backend(image_group: h5py.Group) -> str:
+    """
+    Get the fastest backend that can read an image: the 'full' dataset in the data file, see write_full_img, a
+    pyramidal TIFF in 'tiff_path', or the vsi image in 'vsi_path' with Bio-Formats.
+    """
+    if FULL_NAME in image_group:
+        return 'hdf5'
+    elif TIFF_NAME in image_group:
+        return 'tiff'
+    return 'bioformats'
+
+
+def get_slide_reader(image_group: h5py.Group, backend: Optional[str] = None) -> SlideReader:
+    """
+    Get the reader of an image.
+    :param backend: A key of BACKENDS, selected per image with get_backend if None
+    """
+    if backend is None:
+        backend = get_backend(image_group)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown slide backend {backend}, expected one of {list(BACKENDS)}")
+    return BACKENDS[backend](image_group)
+
+
+def get_slide_iterator(
+        image_group: h5py.Group,
+        size: int,
+        stride: int,
+        batch_size: int,
+        buffered: bool = False,
+        backend: Optional[str] = None,
+        raw: bool = False,
+        ring: Optional[BatchRing] = None,
+) -> SlideIterator:
+    """
+    Get the patch iterator of an image, read with the backend of get_slide_reader.
+    """
+    return SlideIterator(get_slide_reader(image_group, backend), size, stride, batch_size, buffered=buffered, raw=raw,
+                         ring=ring)
+
+
+def get_batch_rings(
+        size: int,
+        batch_size: int,
+        label_type: LabelEnum,
+        raw: bool,
+        num_buffers: int,
+        pin_memory: bool = False,
+) -> tuple[BatchRing, BatchRing]:
+    """
+    Get the BatchRings of the patches and the labels of an ImageIterator.
+    """
+    patch_ring = BatchRing((batch_size, 3, size, size), np.uint8 if raw else np.float32, num_buffers, pin_memory)
+    label_ring = BatchRing(get_label_shape(label_type, batch_size, size), get_label_dtype(label_type, raw), num_buffers,
+                           pin_memory)
+    return patch_ring, label_ring
+
+
 class ImageIterator:
-    def __init__(self, image_group: h5py.Group, size: int, stride: int, batch_size: int, label_type: LabelEnum):
+    def __init__(
+            self,
+            image_group: h5py.Group,
+            size: int,
+            stride: int,
+            batch_size: int,
+            label_type: LabelEnum,
+            buffered: bool = False,
+            tissue_threshold: Optional[float] = None,
+            backend: Optional[str] = None,
+            raw: bool = False,
+            rings: Optional[tuple[BatchRing, BatchRing]] = None,
+    ):
+        """
+        Iterator over batches of (patches, labels) of one image.
+        The patches are read by get_slide_iterator.
+        :param buffered: Read overlapping patches and labels in bands, see SlideIterator and LabelIterator
+        :param tissue_threshold: Skip patches whose fraction of tissue is below this threshold. The tissue is detected
+        on the downsampled series of the image, see get_tissue_mask. All patches are used if None.
+        :param backend: The slide backend, see get_slide_reader
+        :param raw: Return uint8 patches and labels, see SlideIterator and LabelIterator
+        :param rings: The BatchRings of the patches and the labels, see get_batch_rings. New arrays are returned for
+        every batch if None.
+        """
         self.image_group = image_group
         self.size = size
         self.stride = stride
         self.batch_size = batch_size
         self.label_type = label_type
+        self.buffered = buffered
+        self.tissue_threshold = tissue_threshold
+        self.backend = backend
+
+        self.raw = raw
+        patch_ring, label_ring = (None, None) if rings is None else rings
 
-        self.label_it = LabelIterator(image_group['labels'], size, stride, batch_size, label_type)
-        self.vsi_it = VsiIterator(self.get_vsi_path(), size, stride, batch_size)
+        self.label_it = LabelIterator(image_group['labels'], size, stride, batch_size, label_type, buffered=buffered,
+                                      raw=raw, ring=label_ring)
+        self.slide_it = get_slide_iterator(image_group, size, stride, batch_size, buffered, backend, raw, patch_ring)
+
+        self.skip_mask = None
+        self.pending_state = None
+        self.resume = False
 
     def get_vsi_path(self):
-        root = os.path.dirname(self.image_group.file.filename)
-        return os.path.join(root, self.image_group['vsi_path'].asstr()[()])
+        return get_vsi_path(self.image_group)
 
     def __enter__(self):
-        self.vsi_it.open()
+        self.slide_it.open()
+        if self.pending_state is not None:
+            self.apply_state(self.pending_state)
+        elif self.tissue_threshold is not None:
+            self.select_tissue()
         return self
 
+    def select_tissue(self):
+        mask = get_tissue_mask(self.image_group, self.slide_it.get_thumbnail)
+        keep = get_tissue_fractions(mask, self.slide_it.patch_it.grid) >= self.tissue_threshold
+        self.select_patches(keep)
+
+    def select_patches(self, keep: Optional[np.ndarray]):
+        """
+        Only iterate over the patches for which keep is True, or over all patches if None.
+        """
+        self.slide_it.select_patches(keep)
+        self.label_it.select_patches(keep)
+        self.skip_mask = None if keep is None else np.packbits(~keep).tobytes()
+
     def open(self):
         return self.__enter__()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.vsi_it.close()
+        self.slide_it.close()
 
     def close(self):
         self.__exit__(None, None, None)
 
     def __iter__(self):
-        self.vsi_it = self.vsi_it.__iter__()
+        if self.resume:
+            # continue from the restored position instead of the first patch
+            self.resume = False
+            return self
+        self.slide_it = self.slide_it.__iter__()
         self.label_it = self.label_it.__iter__()
         return self
 
     def __next__(self):
-        patch = self.vsi_it.__next__()
+        patch = self.slide_it.__next__()
         label = self.label_it.__next__()
         return patch, label
 
     def set_current_patch(self, row: int, column: int):
-        self.vsi_it.set_current_patch(row, column)
+        self.slide_it.set_current_patch(row, column)
         self.label_it.set_current_patch(row, column)
 
     def get_current_patch_coords(self):
-        vsi_coords = self.vsi_it.get_current_patch_coords()
+        slide_coords = self.slide_it.get_current_patch_coords()
         label_coords = self.label_it.get_current_patch_coords()
-        if vsi_coords != label_coords:
-            raise ValueError(f"Patch iterators are out of sync: vsi {vsi_coords}, label {label_coords}")
-        return vsi_coords
+        if slide_coords != label_coords:
+            raise ValueError(f"Patch iterators are out of sync: slide {slide_coords}, label {label_coords}")
+        return slide_coords
+
+    def state_dict(self) -> dict:
+        """
+        Get the position of the iterator: the index of the next patch among the selected patches, and the packed mask
+        of the patches that are skipped, None if no patches are skipped or the tissue was not detected yet. The iterator
+        does not need to be opened.
+        """
+        if self.pending_state is not None:
+            return self.pending_state
+        # the label iterator knows its grid before it is opened, the slide iterator only after
+        return {
+            'num_patches': len(self.label_it.patch_it.grid),
+            'patch_index': self.label_it.patch_it.index,
+            'skip_mask': self.skip_mask,
+        }
+
+    def load_state_dict(self, state: dict):
+        """
+        Move the iterator to a position of state_dict. The stored skip mask is used instead of detecting the tissue
+        again, so restoring does not read the image. If the iterator is not opened yet, the state is applied by open.
+        The next iteration continues from this position.
+        """
+        if self.slide_it.patch_it is None:
+            self.pending_state = state
+        else:
+            self.apply_state(state)
+
+    def apply_state(self, state: dict):
+        num_patches = len(self.slide_it.patch_it.grid)
+        if state['num_patches'] != num_patches:
+            raise ValueError(f"The state is for {state['num_patches']} patches, but {self.image_group.name} has "
+                             f"{num_patches} patches")
+        if state['skip_mask'] is not None:
+            skip = np.unpackbits(np.frombuffer(state['skip_mask'], dtype=np.uint8), count=num_patches)
+            self.select_patches(~skip.astype(bool))
+        elif self.tissue_threshold is not None:
+            # saved before the tissue was detected, such as by an iterator that was not opened
+            self.select_tissue()
+        else:
+            self.select_patches(None)
+        self.slide_it.patch_it.index = state['patch_index']
+        self.label_it.patch_it.index = state['patch_index']
+        self.pending_state = None
+        self.resume = True
 
 
 class DataIterator:
-    def __init__(self, data_group: h5py.Group, size: int, stride: int, batch_size: int, label_type: LabelEnum):
+    def __init__(
+            self,
+            data_group: h5py.Group,
+            size: int,
+            stride: int,
+            batch_size: int,
+            label_type: LabelEnum,
+            buffered: bool = False,
+            tissue_threshold: Optional[float] = None,
+            backend: Optional[str] = None,
+            seed: Optional[int] = None,
+            raw: bool = False,
+            ring_size: int = 0,
+            pin_memory: bool = False,
+    ):
+        """
+        Iterator over batches of (patches, labels) of all images of a data group, see ImageIterator.
+        :param backend: The slide backend of all images, see BACKENDS. It is selected per image if None.
+        :param seed: The seed of the image order, which then only depends on the seed and the epoch, see set_epoch. The
+        images are read in the order of the data group if None.
+        :param raw: Return uint8 patches and labels, see ImageIterator
+        :param ring_size: Read all batches into a ring of this many preallocated buffers, see BatchRing. New arrays are
+        returned for every batch if 0.
+        :param pin_memory: Allocate the ring in page-locked memory for fast copies to the GPU
+        """
         self.data_group = data_group
         self.size = size
         self.stride = stride
         self.batch_size = batch_size
         self.label_type = label_type
+        self.buffered = buffered
+        self.tissue_threshold = tissue_threshold
+        self.backend = backend
+        self.seed = seed
+        self.raw = raw
+        self.rings = None
+        if ring_size:
+            self.rings = get_batch_rings(size, batch_size, label_type, raw, ring_size, pin_memory)
 
         self.image_list = [key for key in data_group.keys()]
         self.num_images = len(self.image_list)
+        self.epoch = 0
+        self.order = self.get_order()
         self.current_image_index = 0
         self.image_it = self.init_image_it()
+        self.opened = False
+
+    def get_order(self) -> np.ndarray:
+        if self.seed is None:
+            return np.arange(self.num_images)
+        return np.random.default_rng([self.seed, self.epoch]).permutation(self.num_images)
+
+    def get_image_name(self, index: int) -> str:
+        return self.image_list[self.order[index]]
 
     def init_image_it(self):
         return ImageIterator(
-            self.data_group[self.image_list[self.current_image_index]],
+            self.data_group[self.get_image_name(self.current_image_index)],
             self.size,
             self.stride,
             self.batch_size,
             self.label_type,
+            buffered=self.buffered,
+            tissue_threshold=self.tissue_threshold,
+            backend=self.backend,
+            raw=self.raw,
+            rings=self.rings,
         )
 
     def __enter__(self):
-        self.image_it.__enter__()
+        if self.current_image_index < self.num_images:
+            self.image_it.__enter__()
+        self.opened = True
         return self
 
     def open(self):
         return self.__enter__()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.image_it.close()
+        # the last image is already closed when the iterator is exhausted
+        if self.current_image_index < self.num_images:
+            self.image_it.close()
+        self.opened = False
 
     def close(self):
         self.__exit__(None, None, None)
 
     def __iter__(self):
-        self.image_it = self.image_it.__iter__()
+        if self.current_image_index < self.num_images:
+            self.image_it = self.image_it.__iter__()
         return self
 
     def __next__(self):
-        try:
-            return self.image_it.__next__()
-        except StopIteration:
-            self.next_image()
-            return self.image_it.__next__()
+        with profiling.stage('data.batch'):
+            while True:
+                if self.current_image_index == self.num_images:
+                    raise StopIteration
+                try:
+                    return self.image_it.__next__()
+                except StopIteration:
+                    # images without any selected patches are skipped entirely
+                    self.next_image()
 
     def next_image(self):
         self.image_it.close()
         self.current_image_index += 1
         if self.current_image_index == self.num_images:
             raise StopIteration
+        with profiling.stage('data.open_image'):
+            self.image_it = self.init_image_it()
+            self.image_it.open()
+            self.image_it = self.image_it.__iter__()
+
+    def seek_image(self, index: int, image_state: Optional[dict] = None):
+        """
+        Move to the start of the image at position index of the image order, or to the position image_state in it. An
+        index of num_images moves to the end. The image is opened if the iterator is opened.
+        """
+        if self.opened and self.current_image_index < self.num_images:
+            self.image_it.close()
+        self.current_image_index = index
+        if index == self.num_images:
+            return
         self.image_it = self.init_image_it()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        if image_state is not None:
+            self.image_it.load_state_dict(image_state)
+        if self.opened:
+            self.image_it.open()
+
+    def set_epoch(self, epoch: int):
+        """
+        Start an epoch: reorder the images if there is a seed and move to the first image.
+        """
+        self.epoch = epoch
+        self.order = self.get_order()
+        self.seek_image(0)
+
+    def state_dict(self) -> dict:
+        """
+        Get the position of the iterator after the last returned batch, to save with a checkpoint. The state only holds
+        the epoch and seed of the image order, the position in the order and the state of the current image, see
+        ImageIterator.state_dict, so it is small and can be restored without reading any image before it.
+        """
+        exhausted = self.current_image_index == self.num_images
+        return {
+            'seed': self.seed,
+            'epoch': self.epoch,
+            'num_images': self.num_images,
+            'image_index': self.current_image_index,
+            'image_name': None if exhausted else self.get_image_name(self.current_image_index),
+            'image': None if exhausted else self.image_it.state_dict(),
+        }
+
+    def load_state_dict(self, state: dict):
+        """
+        Move the iterator to a position of state_dict. Only the image at that position is opened, and the next
+        iteration continues from the patch after the last batch that was returned before the state was saved.
+        """
+        if state['num_images'] != self.num_images:
+            raise ValueError(f"The state is for {state['num_images']} images, but {self.data_group.name} has "
+                             f"{self.num_images} images")
+        self.seed = state['seed']
+        self.epoch = state['epoch']
+        self.order = self.get_order()
+        index = state['image_index']
+        if index < self.num_images and self.get_image_name(index) != state['image_name']:
+            raise ValueError(f"The state is at image {state['image_name']}, but image {index} of "
+                             f"{self.data_group.name} is {self.get_image_name(index)}")
+        self.seek_image(index, state['image'])
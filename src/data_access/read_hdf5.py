@@ -0,0 +1,85 @@
+from typing import Optional, Union
+
+import h5py
+import numpy as np
+
+from .read_slide import SlideReader, SlideIterator, BAND_PATCHES
+
+try:
+    # registers the Blosc filter with h5py, only needed for images written with the blosc codec
+    import hdf5plugin  # noqa: F401
+except ImportError:
+    hdf5plugin = None
+
+FULL_NAME = 'full'
+DOWNSAMPLE_NAME = 'downsample'
+
+
+class Hdf5Reader(SlideReader):
+    """
+    Reads an image that was converted to hdf5 with write_full_img, without a JVM. The levels are the full resolution
+    dataset and the 'downsample' dataset next to it, when it exists. An in-memory image, such as a thumbnail, can be
+    read from a numpy array instead, it has a single level.
+    """
+    def __init__(self, data: Union[h5py.Dataset, np.ndarray]):
+        """
+        :param data: The (height, width, 3) uint8 dataset or array of the full resolution image
+        """
+        self.data = data
+        self.levels = [data]
+        if isinstance(data, h5py.Dataset) and DOWNSAMPLE_NAME in data.parent:
+            self.levels.append(data.parent[DOWNSAMPLE_NAME])
+
+    def get_level_sizes(self) -> list[tuple[int, int]]:
+        return [(level.shape[1], level.shape[0]) for level in self.levels]
+
+    def read_thumbnail(self) -> np.ndarray:
+        # without a downsampled level the thumbnail would be the whole full resolution image
+        if isinstance(self.data, h5py.Dataset) and len(self.levels) == 1:
+            raise KeyError(f"{self.data.parent.name} has no '{DOWNSAMPLE_NAME}' dataset to read the thumbnail from, "
+                           f"see write_downsample_img")
+        return super().read_thumbnail()
+
+    def read_region(
+            self,
+            left: int,
+            top: int,
+            width: int,
+            height: int,
+            level: int = 0,
+            out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        selection = np.s_[top:top + height, left:left + width]
+        data = self.levels[level]
+        if isinstance(data, np.ndarray):
+            # a copy, so the caller never writes into the image
+            if out is None:
+                return data[selection].copy()
+            out[...] = data[selection]
+            return out
+        if out is None:
+            return data[selection]
+        data.read_direct(out, source_sel=selection)
+        return out
+
+
+class Hdf5Iterator(SlideIterator):
+    """
+    Iterator over batches of patches of an image that was converted to hdf5 with write_full_img. It returns the same
+    batches as VsiIterator without a JVM. Reads are cheapest when the chunks of the dataset line up with the stride.
+    """
+    def __init__(
+            self,
+            data: h5py.Dataset,
+            size: int,
+            stride: int,
+            batch_size: int,
+            buffered: bool = False,
+            band_patches: int = BAND_PATCHES,
+    ):
+        """
+        :param data: The (height, width, 3) uint8 dataset of the full resolution image
+        """
+        super().__init__(Hdf5Reader(data), size, stride, batch_size, buffered, band_patches)
+        self.path = data.name
+        self.data = data
@@ -1,7 +1,11 @@
+from typing import Optional
+
 import h5py
 import numpy as np
 
-from src.util import PatchCoordinateIterator, LabelEnum
+from src.util import PatchCoordinateIterator, LabelEnum, BandCache, profiling
+from .integral_labels import IntegralLabels, has_integral_labels
+from .batch_ring import BatchRing
 
 def get_patch(
         file: h5py.File,
@@ -35,23 +39,77 @@ def get_vsi_path(
     return file[name]['vsi_path'][()]
 
 
+def get_label_shape(label_type: LabelEnum, batch_size: int, size: int) -> tuple[int, ...]:
+    if label_type == LabelEnum.PIXEL:
+        return batch_size, size, size
+    return batch_size,
+
+
+def get_label_dtype(label_type: LabelEnum, raw: bool = False) -> np.dtype:
+    """
+    Get the dtype of label batches: float32, or uint8 for raw labels. The fraction of CLASS_AVG stays float32.
+    """
+    if raw and label_type != LabelEnum.CLASS_AVG:
+        return np.dtype(np.uint8)
+    return np.dtype(np.float32)
+
+
 class LabelIterator:
-    def __init__(self, data: h5py.Dataset, size: int, stride: int, batch_size: int, label_type: LabelEnum):
+    def __init__(
+            self,
+            data: h5py.Dataset,
+            size: int,
+            stride: int,
+            batch_size: int,
+            label_type: LabelEnum,
+            buffered: bool = False,
+            band_patches: Optional[int] = None,
+            use_integral: bool = True,
+            raw: bool = False,
+            ring: Optional[BatchRing] = None,
+    ):
+        """
+        Iterator over batches of labels of the patches of an image.
+        :param buffered: Read a band of size rows of the label dataset at once and compute the labels of all patches in
+        that band from memory, instead of reading every patch separately. Both modes return identical batches.
+        :param band_patches: The number of patches in one band when buffered, the full width of the image if None
+        :param use_integral: Compute class labels from the precomputed summed-area table of the labels when it exists,
+        see write_integral_labels. This returns identical batches without reading the label patches.
+        :param raw: Return the labels as uint8 0 or 1 instead of float32, see get_label_dtype
+        :param ring: Read the batches into the buffers of this ring instead of new arrays, see BatchRing
+        """
         self.data = data
         self.size = size
         self.stride = stride
         self.batch_size = batch_size
         self.label_type = label_type
+        self.buffered = buffered
+        self.raw = raw
+        self.ring = ring
+        self.dtype = get_label_dtype(label_type, raw)
 
         height, width = self.data.shape
         self.patch_it = PatchCoordinateIterator(width, height, self.size, self.stride)
 
+        self.band = None
+        self.band_sums = None
+        if buffered:
+            band_width = width if band_patches is None else (band_patches - 1) * stride + size
+            self.band = BandCache(self.read_band, width, size, band_width)
+
+        self.integral = None
+        if use_integral and label_type != LabelEnum.PIXEL and has_integral_labels(data):
+            self.integral = IntegralLabels(data)
+
     def __iter__(self):
         self.patch_it = self.patch_it.__iter__()
         return self
 
     def next_label(self):
         top, left = self.patch_it.__next__()
+        return self.get_label(top, left)
+
+    def get_label(self, top: int, left: int):
         patch = self.data[top:top + self.size, left:left + self.size]
         if self.label_type == LabelEnum.PIXEL:
             return patch
@@ -61,21 +119,64 @@ class LabelIterator:
         elif self.label_type == LabelEnum.CLASS_AVG:
             return patch.mean()
 
+    def read_band(self, top: int, left: int, width: int):
+        band = self.data[top:top + self.size, left:left + width]
+        if self.label_type == LabelEnum.CLASS_AVG:
+            # prefix sums over the column sums give the sum of any patch in the band with two lookups
+            self.band_sums = np.zeros(width + 1, dtype=np.int64)
+            np.cumsum(band.sum(axis=0, dtype=np.int64), out=self.band_sums[1:])
+        return band
+
+    def get_band_labels(self, coords: np.ndarray, batch: np.ndarray):
+        for part, windows in self.band.patches(coords):
+            if self.label_type == LabelEnum.PIXEL:
+                batch[part] = windows
+            elif self.label_type == LabelEnum.CLASS_MIDDLE:
+                i = int(self.size / 2)
+                batch[part] = windows[:, i, i]
+            elif self.label_type == LabelEnum.CLASS_AVG:
+                offsets = coords[part, 1] - self.band.left
+                sums = self.band_sums[offsets + self.size] - self.band_sums[offsets]
+                batch[part] = sums / (self.size * self.size)
+
     def __next__(self):
-        if self.label_type == LabelEnum.PIXEL:
-            batch = np.zeros((self.batch_size, self.size, self.size), dtype=np.float32)
-        elif self.label_type == LabelEnum.CLASS_MIDDLE or self.label_type == LabelEnum.CLASS_AVG:
-            batch = np.zeros((self.batch_size,), dtype=np.float32)
-        for i in range(self.batch_size):
-            try:
-                batch[i] = self.next_label()
-            except StopIteration:
-                return batch[:i]
+        coords = self.patch_it.next_batch(self.batch_size)
+        if len(coords) == 0:
+            raise StopIteration
+        with profiling.stage('labels.read') as stage:
+            batch = self.read_labels(coords, None if self.ring is None else self.ring.next())
+            stage.add_bytes(batch.nbytes)
+        return batch
+
+    def read_labels(self, coords: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Read the labels of the patches at an (N, 2) array of (top, left) coordinates.
+        :param out: An array of at least N labels of the dtype of the iterator to read into, a new array if None
+        """
+        if out is None:
+            batch = np.empty(get_label_shape(self.label_type, len(coords), self.size), dtype=self.dtype)
+        else:
+            batch = out[:len(coords)]
+        if self.integral is not None and self.label_type == LabelEnum.CLASS_MIDDLE:
+            batch[:] = self.integral.class_middle(coords, self.size)
+        elif self.integral is not None and self.label_type == LabelEnum.CLASS_AVG:
+            batch[:] = self.integral.class_avg(coords, self.size)
+        elif self.buffered:
+            self.get_band_labels(coords, batch)
+        else:
+            for i, (top, left) in enumerate(coords):
+                batch[i] = self.get_label(top, left)
         return batch
 
     def set_current_patch(self, row: int, column: int):
-        self.patch_it.row = row
-        self.patch_it.column = column
+        self.patch_it.seek(row, column)
+
+    def select_patches(self, keep: np.ndarray):
+        """
+        Only iterate over the patches for which keep is True.
+        :param keep: A boolean array with one entry per patch of the grid, in iteration order
+        """
+        self.patch_it.select(keep)
 
     def get_current_patch_coords(self):
         return self.patch_it.row, self.patch_it.column
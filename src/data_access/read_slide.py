@@ -0,0 +1,194 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import numpy as np
+
+from src.util import PatchCoordinateIterator, BandCache, profiling
+from .batch_ring import BatchRing
+
+BAND_PATCHES = 64
+
+
+class SlideReader(ABC):
+    """
+    The interface of the slide formats. A slide has one or more levels, level 0 is the full resolution image and the
+    last level is the thumbnail. Regions are returned as (height, width, 3) uint8 RGB arrays.
+    """
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @abstractmethod
+    def get_level_sizes(self) -> list[tuple[int, int]]:
+        """
+        Get the (width, height) of every level, from the full resolution to the thumbnail.
+        """
+
+    @abstractmethod
+    def read_region(
+            self,
+            left: int,
+            top: int,
+            width: int,
+            height: int,
+            level: int = 0,
+            out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Read a region of a level.
+        :param out: A (height, width, 3) uint8 array to read the region into, a new array is returned if None
+        """
+
+    def read_thumbnail(self) -> np.ndarray:
+        width, height = self.get_level_sizes()[-1]
+        return self.read_region(0, 0, width, height, level=-1)
+
+
+class SlideIterator:
+    def __init__(
+            self,
+            reader: SlideReader,
+            size: int,
+            stride: int,
+            batch_size: int,
+            buffered: bool = False,
+            band_patches: int = BAND_PATCHES,
+            raw: bool = False,
+            ring: Optional[BatchRing] = None,
+    ):
+        """
+        Iterator over batches of patches of the full resolution level of a slide.
+        :param reader: The reader of the slide, it is opened and closed with the iterator
+        :param buffered: Read a band of band_patches overlapping patches per call to the reader and cut the patches out
+        of it, instead of reading every patch separately. Both modes return identical batches.
+        :param band_patches: The number of patches in one band when buffered
+        :param raw: Return the uint8 pixels instead of float32 values in [0, 1], see Uint8Normalize
+        :param ring: Read the batches into the buffers of this ring instead of new arrays, see BatchRing
+        """
+        self.reader = reader
+        self.size = size
+        self.stride = stride
+        self.batch_size = batch_size
+        self.buffered = buffered
+        self.band_patches = band_patches
+        self.raw = raw
+        self.ring = ring
+        self.dtype = np.uint8 if raw else np.float32
+
+        self.patch_it = None
+        self.band = None
+
+    def open_reader(self) -> tuple[int, int]:
+        """
+        Open the slide and return the width and height of the full resolution level.
+        """
+        self.reader.open()
+        return self.reader.get_level_sizes()[0]
+
+    def close_reader(self):
+        self.reader.close()
+
+    def __enter__(self):
+        width, height = self.open_reader()
+        self.patch_it = PatchCoordinateIterator(width, height, self.size, self.stride)
+        if self.buffered:
+            band_width = (self.band_patches - 1) * self.stride + self.size
+            self.band = BandCache(self.read_band, width, self.size, band_width)
+        return self
+
+    def open(self):
+        self.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_reader()
+        self.band = None
+
+    def close(self):
+        self.__exit__(None, None, None)
+
+    def __iter__(self):
+        self.patch_it = self.patch_it.__iter__()
+        return self
+
+    def next_patch(self):
+        top, left = self.patch_it.__next__()
+        return self.read_patch(top, left)
+
+    def read_patch(self, top: int, left: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Read one patch.
+        :param out: A (3, size, size) array of the dtype of the iterator to read into, a new array is returned if None
+        """
+        with profiling.stage('slide.read') as stage:
+            region = self.reader.read_region(int(left), int(top), self.size, self.size)
+            stage.add_bytes(region.nbytes)
+        if out is None:
+            out = np.empty((3, self.size, self.size), self.dtype)
+        self.convert(np.transpose(region, (2, 0, 1)), out)
+        return out
+
+    def convert(self, pixels: np.ndarray, out: np.ndarray):
+        """
+        Write channel first uint8 pixels into out, scaled to [0, 1] unless raw.
+        """
+        with profiling.stage('slide.normalize'):
+            if self.raw:
+                out[...] = pixels
+            else:
+                # divides in float64 like pixels / 255.0, without the float64 temporary
+                np.divide(pixels, 255.0, out=out, casting='same_kind')
+
+    def read_band(self, top: int, left: int, width: int):
+        with profiling.stage('slide.read') as stage:
+            band = self.reader.read_region(int(left), int(top), width, self.size)
+            stage.add_bytes(band.nbytes)
+        return band
+
+    def get_thumbnail(self):
+        return self.reader.read_thumbnail()
+
+    def __next__(self):
+        coords = self.patch_it.next_batch(self.batch_size)
+        if len(coords) == 0:
+            raise StopIteration
+        return self.read_patches(coords, None if self.ring is None else self.ring.next())
+
+    def read_patches(self, coords: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Read the patches at an (N, 2) array of (top, left) coordinates, from the band cache when buffered.
+        :param out: An array of at least N patches of the dtype of the iterator to read into, a new array if None
+        :return: An (N, 3, size, size) float32 array, or uint8 if raw
+        """
+        if out is None:
+            batch = np.empty((len(coords), 3, self.size, self.size), self.dtype)
+        else:
+            batch = out[:len(coords)]
+        if self.buffered:
+            for part, windows in self.band.patches(coords):
+                self.convert(np.transpose(windows, (0, 2, 1, 3)), batch[part])
+        else:
+            for i, (top, left) in enumerate(coords):
+                self.read_patch(top, left, batch[i])
+        return batch
+
+    def set_current_patch(self, row: int, column: int):
+        self.patch_it.seek(row, column)
+
+    def select_patches(self, keep: np.ndarray):
+        """
+        Only iterate over the patches for which keep is True.
+        :param keep: A boolean array with one entry per patch of the grid, in iteration order
+        """
+        self.patch_it.select(keep)
+
+    def get_current_patch_coords(self):
+        return self.patch_it.row, self.patch_it.column
@@ -0,0 +1,66 @@
+from typing import Optional
+
+import numpy as np
+import pyvips as pv
+
+from .read_slide import SlideReader, SlideIterator, BAND_PATCHES
+
+
+class TiffReader(SlideReader):
+    """
+    Reads a tiled pyramidal TIFF with pyvips, without a JVM. Every page of the pyramid is a level. Regions are fetched
+    through one reusable pyvips Region per level, see RegionReader.
+    """
+    def __init__(self, image_path: str):
+        self.path = image_path
+        self.levels = None
+
+    def open(self):
+        from src.pre_proccessing.region_reader import RegionReader
+
+        image = pv.Image.new_from_file(self.path, access='random')
+        num_pages = image.get('n-pages') if image.get_typeof('n-pages') else 1
+        pages = [image]
+        for i in range(1, num_pages):
+            page = pv.Image.new_from_file(self.path, page=i, access='random')
+            # other pages of a TIFF, such as a label image, are only levels if they are smaller than the last level
+            if page.width < pages[-1].width:
+                pages.append(page)
+        self.levels = [RegionReader(page) for page in pages]
+
+    def close(self):
+        self.levels = None
+
+    def get_level_sizes(self) -> list[tuple[int, int]]:
+        return [(level.image.width, level.image.height) for level in self.levels]
+
+    def read_region(
+            self,
+            left: int,
+            top: int,
+            width: int,
+            height: int,
+            level: int = 0,
+            out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        if out is None:
+            out = np.empty((height, width, 3), dtype=np.uint8)
+        self.levels[level].fetch(left, top, width, height, out)
+        return out
+
+
+class TiffIterator(SlideIterator):
+    def __init__(
+            self,
+            image_path: str,
+            size: int,
+            stride: int,
+            batch_size: int,
+            buffered: bool = False,
+            band_patches: int = BAND_PATCHES,
+    ):
+        """
+        Iterator over batches of patches of the full resolution level of a pyramidal TIFF, see SlideIterator.
+        """
+        super().__init__(TiffReader(image_path), size, stride, batch_size, buffered, band_patches)
+        self.path = image_path
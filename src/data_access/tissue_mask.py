@@ -0,0 +1,87 @@
+from typing import Callable
+
+import h5py
+import numpy as np
+
+from src.util import PatchGrid
+
+TISSUE_MASK_NAME = 'tissue_mask'
+
+
+def otsu_threshold(values: np.ndarray) -> int:
+    """
+    Find the threshold that maximises the between-class variance of a uint8 array.
+    :param values: A uint8 array
+    :return: The threshold, values above it belong to the upper class
+    """
+    histogram = np.bincount(values.ravel(), minlength=256).astype(np.float64)
+    weight_low = np.cumsum(histogram)
+    weight_high = weight_low[-1] - weight_low
+    cumulative_mean = np.cumsum(histogram * np.arange(256))
+    mean_low = cumulative_mean / np.maximum(weight_low, 1)
+    mean_high = (cumulative_mean[-1] - cumulative_mean) / np.maximum(weight_high, 1)
+    variance = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return int(np.argmax(variance))
+
+
+def get_saturation(image: np.ndarray) -> np.ndarray:
+    """
+    Get the HSV saturation of an RGB image as uint8. Glass is grey or white and has a low saturation, stained tissue a
+    high one.
+    :param image: An (H, W, 3) RGB image, uint8 or float in [0, 1]
+    """
+    if image.dtype != np.uint8:
+        image = np.round(image * 255).astype(np.uint8)
+    high = image.max(axis=2).astype(np.float32)
+    low = image.min(axis=2).astype(np.float32)
+    saturation = (high - low) / np.maximum(high, 1)
+    return np.round(saturation * 255).astype(np.uint8)
+
+
+def compute_tissue_mask(thumbnail: np.ndarray) -> np.ndarray:
+    """
+    Detect tissue in a low resolution RGB image with an Otsu threshold on the saturation.
+    :return: A boolean array with the height and width of the thumbnail that is True on tissue
+    """
+    saturation = get_saturation(thumbnail)
+    return saturation > otsu_threshold(saturation)
+
+
+def get_tissue_mask(image_group: h5py.Group, get_thumbnail: Callable[[], np.ndarray]) -> np.ndarray:
+    """
+    Get the tissue mask of a slide. The mask is computed from the downsampled image and cached in the image group when
+    the hdf5 file is writable.
+    :param image_group: The hdf5 group of the image
+    :param get_thumbnail: A function that reads the downsampled image, such as SlideIterator.get_thumbnail
+    """
+    if TISSUE_MASK_NAME in image_group:
+        return image_group[TISSUE_MASK_NAME][()]
+    mask = compute_tissue_mask(get_thumbnail())
+    if image_group.file.mode == 'r+':
+        image_group.create_dataset(TISSUE_MASK_NAME, data=mask, compression='lzf')
+    return mask
+
+
+def get_tissue_fractions(mask: np.ndarray, grid: PatchGrid) -> np.ndarray:
+    """
+    Get the fraction of tissue in every patch of a grid. The mask may have a lower resolution than the grid, every patch
+    is mapped to the mask pixels it overlaps.
+    :param mask: A boolean tissue mask of the slide
+    :param grid: The patch grid at full resolution
+    :return: A float array with one fraction per patch of the grid
+    """
+    scale_y = mask.shape[0] / grid.height
+    scale_x = mask.shape[1] / grid.width
+    integral = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int64)
+    integral[1:, 1:] = mask.cumsum(axis=0, dtype=np.int64).cumsum(axis=1)
+
+    top = np.floor(grid.coords[:, 0] * scale_y).astype(np.int64)
+    left = np.floor(grid.coords[:, 1] * scale_x).astype(np.int64)
+    bottom = np.maximum(np.ceil((grid.coords[:, 0] + grid.patch_size) * scale_y).astype(np.int64), top + 1)
+    right = np.maximum(np.ceil((grid.coords[:, 1] + grid.patch_size) * scale_x).astype(np.int64), left + 1)
+    bottom = np.minimum(bottom, mask.shape[0])
+    right = np.minimum(right, mask.shape[1])
+
+    sums = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+    area = np.maximum((bottom - top) * (right - left), 1)
+    return sums / area
@@ -1,3 +1,4 @@
+import argparse
 import os
 
 import h5py
@@ -5,39 +6,45 @@ import h5py
 from src.util import Name
 
 DATA_PATH = 'F:/segmentation-labels.hdf5'
-TEST_PATH = 'F:/hdf5/test.hdf5'
-
-def create_data():
-    file = h5py.File(TEST_PATH, 'w')
-    for i in range(5):
-        file.create_group(str(i))
-    #
-    # data = 'this sentence'
-    # file['string'] = data
-    file.close()
-
-def read_data():
-    file = h5py.File(DATA_PATH, 'r')
-    for group_name in file:
-        group = file[group_name]
-        try:
-            print(group_name, '->', group['vsi_path'].asstr()[()])
-        except KeyError:
-            print(group_name, '->', 'no path')
-    # item = file['string'].asstr()[()]
-    # print(item)
-    file.close()
+IMAGE_DIR = 'Abeta images 100+'
+
+
+def read_data(data_path: str = DATA_PATH):
+    with h5py.File(data_path, 'r') as file:
+        for group_name in file:
+            group = file[group_name]
+            try:
+                print(group_name, '->', group['vsi_path'].asstr()[()])
+            except KeyError:
+                print(group_name, '->', 'no path')
+
+
+def add_vsi_paths(data_path: str = DATA_PATH, image_dir: str = IMAGE_DIR):
+    """
+    Store the path of the vsi image of every image group, relative to the directory of the data file.
+    """
+    with h5py.File(data_path, 'a') as file:
+        for group_name in file:
+            group = file[group_name]
+            path = os.path.join(image_dir, Name(group_name).to_vsi())
+            if 'vsi_path' in group:
+                del group['vsi_path']
+            group['vsi_path'] = path
+
 
 def main():
-    file = h5py.File(DATA_PATH, 'a')
-    for group_name in file:
-        group = file[group_name]
-        path = os.path.join('Abeta images 100+', Name(group_name).to_vsi())
-        group['vsi_path'] = path
-    file.close()
-
-
-read_data()
-main()
-print('')
-read_data()
+    parser = argparse.ArgumentParser(description='Add the relative vsi path to every image group of an hdf5 file.')
+    parser.add_argument('data_path', nargs='?', default=DATA_PATH, help='The hdf5 file with one group per image')
+    parser.add_argument('--image-dir', default=IMAGE_DIR, help='The vsi directory, relative to the hdf5 file')
+    parser.add_argument('--show', action='store_true', help='Only print the current paths')
+    args = parser.parse_args()
+
+    read_data(args.data_path)
+    if not args.show:
+        add_vsi_paths(args.data_path, args.image_dir)
+        print('')
+        read_data(args.data_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Convert vsi images to hdf5 in parallel.
+
+Every slide is converted by one worker process with its own JVM, which is also the only writer of that slide's output
+file. A slide is first written to '<name>.hdf5.part' and renamed to '<name>.hdf5' once it is complete, so an
+interrupted run can be restarted with the same arguments and only converts the slides that are not finished yet.
+
+    python -m src.data_preparation.convert_vsi OUTPUT_DIR SLIDE.vsi [SLIDE.vsi ...] --workers 8
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+from src.data_preparation.write_img_to_hdf5 import write_full_img, write_downsample_img, CHUNK_SIZE, CODEC
+from src.util import from_vsi_path
+from src.util.jvm import start_worker_jvm
+
+PART_SUFFIX = '.part'
+
+
+def get_target_path(vsi_path: str, output_dir: str) -> str:
+    return os.path.join(output_dir, f'{from_vsi_path(vsi_path).base}.hdf5')
+
+
+def is_converted(vsi_path: str, output_dir: str) -> bool:
+    return os.path.exists(get_target_path(vsi_path, output_dir))
+
+
+def get_todo(vsi_paths: list[str], output_dir: str) -> list[str]:
+    """
+    Get the vsi images whose hdf5 file is not complete yet. Left over '.part' files do not count as converted.
+    """
+    return [path for path in vsi_paths if not is_converted(path, output_dir)]
+
+
+def convert_slide(vsi_path: str, output_dir: str, chunk_size: int = CHUNK_SIZE, codec: str = CODEC) -> float:
+    """
+    Convert one vsi image to an hdf5 file with a 'full' and a 'downsample' dataset.
+    :return: The conversion time in seconds
+    """
+    start = time.time()
+    target = get_target_path(vsi_path, output_dir)
+    part = target + PART_SUFFIX
+    if os.path.exists(part):
+        os.remove(part)
+    write_full_img(vsi_path, part, chunk_size=chunk_size, codec=codec, verbose=False)
+    write_downsample_img(vsi_path, part)
+    os.replace(part, target)
+    return time.time() - start
+
+
+def _convert(args: tuple) -> tuple[str, float]:
+    vsi_path = args[0]
+    return vsi_path, convert_slide(*args)
+
+
+def convert_all(
+        vsi_paths: list[str],
+        output_dir: str,
+        workers: int = 1,
+        chunk_size: int = CHUNK_SIZE,
+        codec: str = CODEC,
+):
+    """
+    Convert all vsi images that have not been converted yet with a pool of worker processes.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    todo = get_todo(vsi_paths, output_dir)
+    print(len(vsi_paths) - len(todo), 'of', len(vsi_paths), 'slides already converted')
+    tasks = [(path, output_dir, chunk_size, codec) for path in todo]
+    # spawn, so the workers do not inherit any JVM state of this process
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=start_worker_jvm) as pool:
+        for i, (path, seconds) in enumerate(pool.imap_unordered(_convert, tasks)):
+            print(f'{i + 1}/{len(todo)}', os.path.basename(path), f'{seconds:.0f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert vsi images to hdf5 in parallel, resuming unfinished runs.')
+    parser.add_argument('output_dir', help='The directory that the hdf5 files are written to')
+    parser.add_argument('vsi_paths', nargs='*', help='The vsi images to convert')
+    parser.add_argument('--from-file', help='A text file with one vsi path per line, in addition to vsi_paths')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='The number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='The chunk width and height in pixels')
+    parser.add_argument('--codec', default=CODEC, choices=['lzf', 'gzip', 'blosc'], help='The compression codec')
+    args = parser.parse_args()
+
+    vsi_paths = list(args.vsi_paths)
+    if args.from_file:
+        with open(args.from_file) as file:
+            vsi_paths += [line.strip() for line in file if line.strip()]
+    convert_all(vsi_paths, args.output_dir, args.workers, args.chunk_size, args.codec)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,42 @@
-import os
+import argparse
 
 import h5py
 
 from src.util import from_qupath, is_qupath
 
 DATA_PATH = 'F:/segmentation-labels.hdf5'
-TEST_PATH = 'F:/hdf5/test.hdf5'
 
-def create_test_hdf5():
-    with h5py.File(TEST_PATH, 'a') as file:
-        for i in range(5):
-            file.create_group(str(i))
 
-def read_group_names():
-    file = h5py.File(TEST_PATH, 'r')
-    for group_name in file:
-        print(group_name)
-    file.close()
+def read_group_names(data_path: str = DATA_PATH):
+    with h5py.File(data_path, 'r') as file:
+        for group_name in file:
+            print(group_name)
+
+
+def fix_group_names(data_path: str = DATA_PATH):
+    """
+    Rename the image groups that are named after the QuPath image name to the base name of the image.
+    """
+    with h5py.File(data_path, 'a') as file:
+        for group_name in list(file):
+            if is_qupath(group_name):
+                new_name = from_qupath(group_name).base
+                file.move(group_name, new_name)
+                print(group_name, 'changed to', new_name)
+            else:
+                print(group_name, 'skipped')
+
 
 def main():
-    file = h5py.File(DATA_PATH, 'a')
-    for group_name in file:
-        if is_qupath(group_name):
-            new_name = from_qupath(group_name).base
-            file.move(group_name, new_name)
-            print(group_name, 'changed to', new_name)
-        else:
-            print(group_name, 'skipped')
-            continue
-
-    file.close()
-
-
-# create_test_hdf5()
-read_group_names()
-print('')
-main()
-read_group_names()
+    parser = argparse.ArgumentParser(description='Rename QuPath image groups of an hdf5 file to their base name.')
+    parser.add_argument('data_path', nargs='?', default=DATA_PATH, help='The hdf5 file with one group per image')
+    args = parser.parse_args()
+
+    read_group_names(args.data_path)
+    print('')
+    fix_group_names(args.data_path)
+    read_group_names(args.data_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
-import paquo.projects
-from paquo.images import QuPathProjectImageEntry
+if TYPE_CHECKING:
+    import paquo.projects
+    from paquo.images import QuPathProjectImageEntry
 
 
 def get_image_name_from_path(path: str):
@@ -11,26 +12,29 @@ def get_image_name_from_path(path: str):
 
 class Project:
 
-    PROJECT: paquo.projects.QuPathProject = None
+    PROJECT: 'paquo.projects.QuPathProject' = None
     PROJECT_PATH = "F:/QuPath Abeta images 100+/Qupath data/project.qpproj"
+    INDEX: dict[str, 'QuPathProjectImageEntry'] = None
 
     @classmethod
-    def get_project(cls) -> paquo.projects.QuPathProject:
+    def get_project(cls) -> 'paquo.projects.QuPathProject':
         if not cls.PROJECT:
+            # imported here, so users of the roi cache never start QuPath
+            import paquo.projects
             cls.PROJECT = paquo.projects.QuPathProject(cls.PROJECT_PATH)
         return cls.PROJECT
 
     @classmethod
-    def get_image(cls, name: str) -> Optional[QuPathProjectImageEntry]:
-        project = cls.get_project()
-        try:
-            return next((entry for entry in project.images if entry.image_name == name))
-        except StopIteration:
-            return None
+    def get_index(cls) -> dict[str, 'QuPathProjectImageEntry']:
+        if cls.INDEX is None:
+            cls.INDEX = {entry.image_name: entry for entry in cls.get_project().images}
+        return cls.INDEX
 
     @classmethod
-    def get_image_from_path(cls, path: str) -> Optional[QuPathProjectImageEntry]:
+    def get_image(cls, name: str) -> Optional['QuPathProjectImageEntry']:
+        return cls.get_index().get(name)
+
+    @classmethod
+    def get_image_from_path(cls, path: str) -> Optional['QuPathProjectImageEntry']:
         name = get_image_name_from_path(path)
         return cls.get_image(name)
-
-
@@ -0,0 +1,89 @@
+import glob
+import os
+from typing import Optional
+
+import h5py
+import numpy as np
+from shapely import wkb
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import prep, PreparedGeometry
+
+from src.data_preparation.project import Project, get_image_name_from_path
+
+MTIME_ATTR = 'project_mtime'
+
+
+def get_project_mtime(project_path: str) -> Optional[float]:
+    """
+    Get the last modification time of a QuPath project, including the annotation data of its images.
+    :return: The modification time, or None if the project does not exist on this machine
+    """
+    if not os.path.exists(project_path):
+        return None
+    data_files = glob.glob(os.path.join(os.path.dirname(project_path), 'data', '*', 'data.qpdata'))
+    return max(os.path.getmtime(path) for path in [project_path] + data_files)
+
+
+class RoiCache:
+    """
+    A persistent cache of the grey matter ROI of every image in the QuPath project. The ROIs are stored as WKB in an
+    hdf5 file next to the project and are rebuilt when the project changes. When the project is not available, such as
+    on a training machine, the cache is used as it is, so the QuPath project is never opened.
+    """
+
+    CACHE_PATH = "F:/QuPath Abeta images 100+/roi_cache.hdf5"
+    ROIS: dict[str, BaseGeometry] = None
+    PREPARED: dict[str, PreparedGeometry] = {}
+
+    @classmethod
+    def get_rois(cls) -> dict[str, BaseGeometry]:
+        if cls.ROIS is None:
+            cls.ROIS = cls.load()
+        return cls.ROIS
+
+    @classmethod
+    def get_roi(cls, name: str) -> Optional[BaseGeometry]:
+        return cls.get_rois().get(name)
+
+    @classmethod
+    def get_roi_from_path(cls, path: str) -> Optional[BaseGeometry]:
+        return cls.get_roi(get_image_name_from_path(path))
+
+    @classmethod
+    def get_prepared_roi(cls, name: str) -> Optional[PreparedGeometry]:
+        """
+        Get the ROI of an image prepared for fast repeated predicates, such as containment queries of many points.
+        """
+        if name not in cls.PREPARED:
+            roi = cls.get_roi(name)
+            if roi is None:
+                return None
+            cls.PREPARED[name] = prep(roi)
+        return cls.PREPARED[name]
+
+    @classmethod
+    def get_prepared_roi_from_path(cls, path: str) -> Optional[PreparedGeometry]:
+        return cls.get_prepared_roi(get_image_name_from_path(path))
+
+    @classmethod
+    def load(cls) -> dict[str, BaseGeometry]:
+        mtime = get_project_mtime(Project.PROJECT_PATH)
+        if os.path.exists(cls.CACHE_PATH):
+            with h5py.File(cls.CACHE_PATH, 'r') as file:
+                if mtime is None or file.attrs.get(MTIME_ATTR) == mtime:
+                    return {name: wkb.loads(file[name][()].tobytes()) for name in file}
+        return cls.build(mtime)
+
+    @classmethod
+    def build(cls, mtime: Optional[float]) -> dict[str, BaseGeometry]:
+        rois = {}
+        for name, entry in Project.get_index().items():
+            annotations = entry.hierarchy.annotations
+            if len(annotations) > 0:
+                rois[name] = annotations[0].roi
+        with h5py.File(cls.CACHE_PATH, 'w') as file:
+            for name, roi in rois.items():
+                file[name] = np.void(wkb.dumps(roi))
+            if mtime is not None:
+                file.attrs[MTIME_ATTR] = mtime
+        return rois
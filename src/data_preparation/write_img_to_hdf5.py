@@ -1,7 +1,9 @@
-import javabridge
-import bioformats
+import argparse
+
 import h5py
+import numpy as np
 
+from src.util.jvm import start_jvm
 from src.util.patch_coordinate_iterator import PatchCoordinateIterator
 
 FULL_INDEX = 13
@@ -9,40 +11,108 @@ DOWNSAMPLE_INDEX = 20
 DOWNSAMPLE_LEVEL = 128
 
 PATCH_SIZE = 1024
+CHUNK_SIZE = 128  # the stride of the patch iterators, so a patch at a stride position covers whole chunks
+CODEC = 'lzf'
+
+
+def get_compression(codec: str) -> dict:
+    """
+    Get the h5py create_dataset keywords of a compression codec.
+    :param codec: 'lzf', 'gzip' or 'blosc'. Blosc (LZ4) needs the hdf5plugin package, both to write and to read.
+    """
+    if codec == 'lzf':
+        return {'compression': 'lzf'}
+    elif codec == 'gzip':
+        return {'compression': 'gzip', 'compression_opts': 6}
+    elif codec == 'blosc':
+        try:
+            import hdf5plugin
+        except ImportError as e:
+            raise ImportError("The blosc codec requires the hdf5plugin package") from e
+        return dict(hdf5plugin.Blosc(cname='lz4', clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def replace_dataset(group: h5py.Group, name: str, **kwargs) -> h5py.Dataset:
+    if name in group:
+        del group[name]
+    return group.create_dataset(name, **kwargs)
 
-def write_full_img(src: str, target: str):
+
+def write_full_img(
+        src: str,
+        target: str,
+        group_name: str = '/',
+        chunk_size: int = CHUNK_SIZE,
+        codec: str = CODEC,
+        verbose: bool = True,
+):
+    """
+    Write the full resolution series of a vsi image to the 'full' dataset of a group in an hdf5 file.
+    :param src: The path to the vsi image
+    :param target: The path to the hdf5 file, it is created if it does not exist
+    :param group_name: The group to write the dataset to, such as the image group in the data file
+    :param chunk_size: The width and height of a chunk. Use the stride or a divisor of it, so patches read whole chunks.
+    :param codec: The compression codec, see get_compression
+    :param verbose: Print the progress per tile
+    """
+    import bioformats
+
+    start_jvm()
     with bioformats.ImageReader(src) as reader:
-        with h5py.File(target, 'w') as file:
+        with h5py.File(target, 'a') as file:
             reader.rdr.setSeries(FULL_INDEX)
             img_width = reader.rdr.getSizeX()
             img_height = reader.rdr.getSizeY()
-            full = file.create_dataset('full', shape=(img_height, img_width, 3), chunks=True, dtype=np.uint8, compression="gzip", compression_opts=6)
+            full = replace_dataset(
+                file.require_group(group_name),
+                'full',
+                shape=(img_height, img_width, 3),
+                chunks=(chunk_size, chunk_size, 3),
+                dtype=np.uint8,
+                **get_compression(codec),
+            )
             s = PATCH_SIZE
             it = PatchCoordinateIterator(img_width, img_height, s, s)
             for n, m in it:
-                print('row', it.row, 'of', it.num_height, ', col', it.column, 'of', it.num_width)
+                if verbose:
+                    print('row', it.row, 'of', it.num_height, ', col', it.column, 'of', it.num_width)
                 patch = reader.rdr.openBytesXYWH(0, m, n, s, s)
                 patch = patch.reshape((s, s, 3))
                 full[n:n+s, m:m+s, :] = patch
 
-def write_downsample_img(src: str, target: str):
+
+def write_downsample_img(src: str, target: str, group_name: str = '/'):
+    import bioformats
+
+    start_jvm()
     with bioformats.ImageReader(src) as reader:
-        with h5py.File(target, 'w') as file:
+        with h5py.File(target, 'a') as file:
             reader.rdr.setSeries(DOWNSAMPLE_INDEX)
             img_width = reader.rdr.getSizeX()
             img_height = reader.rdr.getSizeY()
-            downsample = file.create_dataset('downsample', shape=(img_height, img_width, 3), chunks=True, dtype=np.uint8)
-            downsample[:, :, :] = reader.read()
+            downsample = replace_dataset(
+                file.require_group(group_name),
+                'downsample',
+                shape=(img_height, img_width, 3),
+                chunks=True,
+                dtype=np.uint8,
+            )
+            downsample[:, :, :] = reader.read(rescale=False)
+
 
-VSI_PATH = 'F:/Abeta images 100+/Image_2013-095_F2_BA4.vsi'
-HDF5_PATH = 'F:/hdf5/test.hdf5'
+def main():
+    parser = argparse.ArgumentParser(description='Write the full resolution and downsampled series of a vsi to hdf5.')
+    parser.add_argument('vsi_path', help='The vsi image, such as F:/Abeta images 100+/Image_2013-095_F2_BA4.vsi')
+    parser.add_argument('hdf5_path', help='The hdf5 file to write to, such as F:/hdf5/test.hdf5')
+    parser.add_argument('--group', default='/', help='The group of the hdf5 file to write the datasets to')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='The chunk width and height in pixels')
+    parser.add_argument('--codec', default=CODEC, choices=['lzf', 'gzip', 'blosc'], help='The compression codec')
+    args = parser.parse_args()
 
-javabridge.start_vm(class_path=bioformats.JARS)
-logback = javabridge.JClassWrapper("loci.common.LogbackTools")
-logback.enableLogging()
-logback.setRootLevel("ERROR")
+    write_full_img(args.vsi_path, args.hdf5_path, args.group, args.chunk_size, args.codec)
+    write_downsample_img(args.vsi_path, args.hdf5_path, args.group)
 
-write_full_img(VSI_PATH, HDF5_PATH)
-write_downsample_img(VSI_PATH, HDF5_PATH)
 
-javabridge.kill_vm()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,64 @@
+import argparse
+from typing import TYPE_CHECKING
+
 import numpy as np
 import h5py
-from paquo.images import QuPathProjectImageEntry
-from shapely.geometry import Polygon
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import prep, PreparedGeometry
 from rasterio.features import rasterize
 from rasterio.transform import Affine
 
+from src.data_access.integral_labels import write_integral_labels, has_integral_labels, touch_labels
 from src.data_preparation.project import Project
 from src.util import PatchCoordinateIterator, from_qupath
 
+if TYPE_CHECKING:
+    from paquo.images import QuPathProjectImageEntry
+
 HDF5_PATH = 'F:/entry_point.hdf5'
+GROUP_NAME = 'init'
 
 PATCH_SIZE = 1024
 
+OUTSIDE = 0
+INSIDE = 1
+BOUNDARY = 2
+
+def classify_tile(prepared_roi: PreparedGeometry, left: int, top: int, size: int) -> int:
+    """
+    Find out whether a square tile lies fully inside, fully outside or on the boundary of a region of interest.
+    :param prepared_roi: The prepared region of interest, see shapely.prepared.prep
+    :param left: Left edge of the tile
+    :param top: Top edge of the tile
+    :param size: Width and height of the tile
+    :return: INSIDE, OUTSIDE or BOUNDARY
+    """
+    square = box(left, top, left + size, top + size)
+    if prepared_roi.contains(square):
+        return INSIDE
+    elif not prepared_roi.intersects(square):
+        return OUTSIDE
+    return BOUNDARY
+
+
+def rasterize_tile(roi: BaseGeometry, left: int, top: int, size: int) -> np.ndarray:
+    """
+    Rasterize the part of a region of interest that lies in a square tile.
+    :return: a size x size boolean numpy array that is true on pixels whose centre lies in the region of interest
+    """
+    # a full intersection rather than clip_by_rect: where the tile only touches the roi, the intersection is a line or
+    # point that rasterize burns into the edge pixels, and clip_by_rect drops it, which would change the labels
+    intersection = box(left, top, left + size, top + size).intersection(roi)
+    labels = np.zeros((size, size), dtype=np.uint8)
+    if not intersection.is_empty:
+        transform = Affine(1, 0, left, 0, 1, top)
+        rasterize([intersection], out=labels, transform=transform, default_value=1)
+    return labels.astype(bool)
+
+
 def get_patch_pixel_labels(
-        image_entry: QuPathProjectImageEntry,
+        image_entry: 'QuPathProjectImageEntry',
         left: int,
         top: int,
         size: int,
@@ -27,24 +72,20 @@ def get_patch_pixel_labels(
     :return: a size x size numpy array where a cell is true if that pixel is annotated as grey matter and false
     otherwise.
     """
-    square = Polygon([(left, top), (left+size, top), (left+size, top+size), (left, top+size), (left, top)])
     roi = image_entry.hierarchy.annotations[0].roi
+    return rasterize_tile(roi, left, top, size)
 
-    intersection = square.intersection(roi)
-    labels = np.zeros((size, size), dtype=np.uint8)
-    if not intersection.is_empty:
-        transform = Affine(1, 0, left, 0, 1, top)
-        rasterize([intersection], out=labels, transform=transform, default_value=1)
-    return labels.astype(bool)
 
-
-def write_ground_truth(image_entry: QuPathProjectImageEntry, target_group: h5py.Group):
+def write_ground_truth(image_entry: 'QuPathProjectImageEntry', target_group: h5py.Group):
     image_name = from_qupath(image_entry.image_name).base
     if image_name not in target_group:
         print(image_name, 'created')
         image_group = target_group.create_group(image_name)
     else:
         print(image_name, 'skipped')
+        labels = target_group[image_name].get('grey matter labels')
+        if labels is not None and not has_integral_labels(labels):
+            write_integral_labels(labels)
         return
     data = image_group.create_dataset(
         'grey matter labels',
@@ -53,20 +94,43 @@ def write_ground_truth(image_entry: QuPathProjectImageEntry, target_group: h5py.
         compression='lzf',
         chunks=True,
     )
+    roi = image_entry.hierarchy.annotations[0].roi
+    prepared_roi = prep(roi)
+    counts = [0, 0, 0]
     s = PATCH_SIZE
     it = PatchCoordinateIterator(image_entry.width, image_entry.height, s, s)
     for n, m in it:
         # print('row', it.row, 'of', it.num_height, ' column', it.column, 'of', it.num_width)
-        ground_truth = get_patch_pixel_labels(image_entry, m, n, s)
-        data[n:n+s, m:m+s] = ground_truth
+        tile_class = classify_tile(prepared_roi, m, n, s)
+        counts[tile_class] += 1
+        # tiles outside the roi are not written, they keep the fill value False of the dataset
+        if tile_class == INSIDE:
+            data[n:n+s, m:m+s] = True
+        elif tile_class == BOUNDARY:
+            data[n:n+s, m:m+s] = rasterize_tile(roi, m, n, s)
+    print(image_name, 'tiles inside', counts[INSIDE], 'outside', counts[OUTSIDE], 'boundary', counts[BOUNDARY])
+    touch_labels(data)
+    write_integral_labels(data)
+
 
-def main(file: h5py.File):
-    group = file['init']
+def write_all(file: h5py.File, group_name: str = GROUP_NAME):
+    group = file.require_group(group_name)
     project = Project.get_project()
     for entry in project.images:
         write_ground_truth(entry, group)
 
 
-data_file = h5py.File(HDF5_PATH, 'a')
-main(data_file)
-data_file.close()
+def main():
+    parser = argparse.ArgumentParser(description='Rasterize the grey matter annotations of a QuPath project to hdf5.')
+    parser.add_argument('--hdf5-path', default=HDF5_PATH, help='The hdf5 file to write the labels to')
+    parser.add_argument('--project', default=Project.PROJECT_PATH, help='The project.qpproj file of the QuPath project')
+    parser.add_argument('--group', default=GROUP_NAME, help='The group of the hdf5 file to write the images to')
+    args = parser.parse_args()
+
+    Project.PROJECT_PATH = args.project
+    with h5py.File(args.hdf5_path, 'a') as file:
+        write_all(file, args.group)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
 from .get_patch import *
 from .patch_iterator import PatchIterator, RandomPatchIterator
+from .image_cache import ImageIndex, get_image_index, get_image, get_rng
+from .region_reader import RegionReader, iter_row_bands
 from .util import *
@@ -1,16 +1,17 @@
-import os
-import random
-from typing import Union
+from typing import Optional, Union
 
 import pyvips as pv
 import numpy as np
 from shapely.geometry import Point, Polygon
+from shapely import vectorized
 from rasterio.features import rasterize
 from rasterio.transform import Affine
 
 from .util import *
+from .image_cache import get_image, get_image_index
 from src.util.label_enum import LabelEnum
 from src.data_preparation.project import Project
+from src.data_preparation.roi_cache import RoiCache
 
 def get_patch_from_path(
         file_path: str,
@@ -61,23 +62,41 @@ def get_patch_from_image(
     return patch, label
 
 
+def get_random_location(
+        data_path: str = DATA_ROOT,
+        size: int = SIZE,
+        rng: Optional[np.random.Generator] = None,
+) -> tuple[pv.Image, int, int]:
+    """
+    A function that picks a random patch location in a random image in the dataset
+    :param data_path: The path to the dataset
+    :param size: Width and height of the extract area
+    :param rng: The random generator to use, see get_rng. The global numpy generator is used if None.
+    :return: The image and the left and top edge of the patch
+    """
+    index = get_image_index(data_path)
+    randint = np.random.randint if rng is None else rng.integers
+    i = randint(0, len(index))
+    left = int(randint(0, index.widths[i] - size))
+    top = int(randint(0, index.heights[i] - size))
+    return get_image(index.files[i]), left, top
+
+
 def get_random_patch(
         data_path: str = DATA_ROOT,
         size: int = SIZE,
         label_type: LabelEnum = LabelEnum.NO,
+        rng: Optional[np.random.Generator] = None,
 ) -> tuple[np.ndarray, Union[None, bool, np.ndarray]]:
     """
     A function that returns a random patch from a random image in the dataset
     :param data_path:
     :param size: Width and height of the extract area
     :param label_type: The type of label that should be attached to the patch
+    :param rng: The random generator to use, see get_rng. The global numpy generator is used if None.
     :return: a random patch from a random image in the dataset
     """
-    files = [f for f in os.listdir(data_path) if os.path.isfile(os.path.join(data_path, f))]
-    file = os.path.join(data_path, random.choice(files))
-    image = pv.Image.new_from_file(file, access='random')
-    left = np.random.randint(0, image.width - size)
-    top = np.random.randint(0, image.height - size)
+    image, left, top = get_random_location(data_path, size, rng)
     patch, label_type = get_patch_from_image(image, left, top, size, label_type)
     return patch, label_type
 
@@ -96,14 +115,33 @@ def get_patch_class(
     :param size: Width and height of the extract area
     :return: True if the centre pixel is annotated as gray matter, false otherwise.
     """
-    image_entry = Project.get_image_from_path(image.filename)
-    roi = image_entry.hierarchy.annotations[0].roi
+    roi = RoiCache.get_roi_from_path(image.filename)
     x = (2 * left + size) / 2
     y = (2 * top + size) / 2
     mid = Point(x, y)
     return not mid.intersection(roi).is_empty
 
 
+def get_batch_class(
+        image: pv.Image,
+        coords: np.ndarray,
+        size: int = SIZE,
+) -> np.ndarray:
+    """
+    A function that returns the classes of a batch of patches of one image in a single vectorized containment query.
+    The class of a patch is the same as the one of get_patch_class.
+    :param image: The pyvips image that the patches are taken from
+    :param coords: An (N, 2) array of the (left, top) edges of the patches
+    :param size: Width and height of the patches
+    :return: An (N,) boolean array that is True where the centre pixel of a patch is annotated as grey matter
+    """
+    roi = RoiCache.get_prepared_roi_from_path(image.filename)
+    x = coords[:, 0] + size / 2
+    y = coords[:, 1] + size / 2
+    # contains excludes the boundary of the roi, get_patch_class includes it
+    return vectorized.contains(roi, x, y) | vectorized.touches(roi, x, y)
+
+
 def get_patch_pixel_labels(
         image: pv.Image,
         left: int,
@@ -125,8 +163,7 @@ def get_patch_pixel_labels(
 
     square = Polygon([(left, top), (left+size, top), (left+size, top+size), (left, top+size), (left, top)])
 
-    image_entry = Project.get_image_from_path(image.filename)
-    roi = image_entry.hierarchy.annotations[0].roi
+    roi = RoiCache.get_roi_from_path(image.filename)
 
     intersection = square.intersection(roi)
     labels = np.zeros((size, size), dtype=np.uint8)
@@ -0,0 +1,65 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+import pyvips as pv
+import numpy as np
+
+from src.util.lru import LruCache
+
+IMAGE_CACHE_SIZE = 16
+
+
+class ImageIndex:
+    """
+    An index of the images in a dataset directory and their dimensions, built once per directory.
+    """
+    def __init__(self, data_path: str):
+        """
+        Constructor for the ImageIndex, it only reads the image headers.
+        :param data_path: The path to the dataset
+        """
+        self.data_path = data_path
+        self.files = sorted(
+            os.path.join(data_path, f) for f in os.listdir(data_path) if os.path.isfile(os.path.join(data_path, f))
+        )
+        headers = [pv.Image.new_from_file(file) for file in self.files]
+        self.widths = np.array([image.width for image in headers], dtype=np.int64)
+        self.heights = np.array([image.height for image in headers], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.files)
+
+
+@lru_cache(maxsize=None)
+def get_image_index(data_path: str) -> ImageIndex:
+    return ImageIndex(data_path)
+
+
+def close_image(image: pv.Image):
+    """
+    Release an image that was evicted from the cache. Dropping it from the libvips operation cache, which would keep it
+    alive, lets libvips close the file once the last reference to the image is gone.
+    """
+    image.invalidate()
+
+
+IMAGE_CACHE = LruCache(IMAGE_CACHE_SIZE, close_image)
+
+
+def get_image(file_path: str) -> pv.Image:
+    """
+    Open an image for random access. The IMAGE_CACHE_SIZE most recently used images are kept open, older ones are
+    released with close_image.
+    """
+    return IMAGE_CACHE.get(file_path, lambda: pv.Image.new_from_file(file_path, access='random'))
+
+
+def get_rng(seed: Optional[int] = None, worker_id: int = 0) -> np.random.Generator:
+    """
+    Get a random generator for one worker. Generators with the same seed and different worker ids produce independent
+    streams, so parallel sampling is reproducible.
+    :param seed: The seed shared by all workers, a random seed if None
+    :param worker_id: The id of the worker, such as torch.utils.data.get_worker_info().id
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(worker_id,)))
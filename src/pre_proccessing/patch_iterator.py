@@ -1,11 +1,45 @@
-from typing import Union
+from typing import Optional, Union
 
 import pyvips as pv
 import numpy as np
 
 from .util import *
-from .get_patch import get_patch_from_image, get_random_patch
+from .get_patch import get_patch_from_image, get_batch_class, get_patch_pixel_labels, get_random_location
+from .image_cache import get_rng
+from .region_reader import RegionReader
 from src.util.label_enum import LabelEnum
+from src.util.patch_coordinate_iterator import PatchCoordinateIterator
+
+
+def get_label_batch(
+        images: list[pv.Image],
+        coords: np.ndarray,
+        size: int,
+        label_type: LabelEnum,
+) -> Union[None, np.ndarray]:
+    """
+    A function that returns the labels of a batch of patches.
+    :param images: The image of every patch
+    :param coords: An (N, 2) array of the (left, top) edges of the patches
+    :param size: Width and height of the patches
+    :param label_type: The type of label
+    :return: None, an (N,) boolean array of classes or an (N, size, size) boolean array of pixel labels
+    """
+    if label_type == LabelEnum.CLASS:
+        label_batch = np.zeros(len(coords), dtype=bool)
+        filenames = np.array([image.filename for image in images])
+        for filename in np.unique(filenames):
+            # one vectorized query per image in the batch
+            in_image = filenames == filename
+            image = images[int(np.argmax(in_image))]
+            label_batch[in_image] = get_batch_class(image, coords[in_image], size)
+        return label_batch
+    elif label_type == LabelEnum.PIXEL:
+        label_batch = np.zeros((len(coords), size, size), dtype=bool)
+        for i, (image, (left, top)) in enumerate(zip(images, coords)):
+            label_batch[i] = get_patch_pixel_labels(image, left, top, size)
+        return label_batch
+    return None
 
 
 class PatchIterator:
@@ -21,68 +55,60 @@ class PatchIterator:
         :param stride: The stride of the sliding window (default 128)
         """
         self._image = pv.Image.new_from_file(image_path)
-        self.row = 0
-        self.column = 0
         self.patch_size = size
         self.stride = stride
         self.max_column, self.max_row = calc_num_patches(self._image.width, self._image.height, size, stride)
         self.label_type = label_type
+        self.patch_it = PatchCoordinateIterator(self._image.width, self._image.height, size, stride)
+        self.region_reader = RegionReader(self._image)
+
+    @property
+    def row(self) -> int:
+        return self.patch_it.row
+
+    @row.setter
+    def row(self, row: int):
+        self.patch_it.row = row
+
+    @property
+    def column(self) -> int:
+        return self.patch_it.column
+
+    @column.setter
+    def column(self, column: int):
+        self.patch_it.column = column
 
     def __iter__(self):
-        self.row = 0
-        self.column = 0
+        self.patch_it = self.patch_it.__iter__()
         return self
 
     def __next__(self) -> tuple[np.ndarray, Union[None, bool, np.ndarray]]:
-        if self.row == self.max_row:
-            raise NotImplementedError
-        elif self.row > self.max_row:
-            raise StopIteration
-        patch, label = get_patch_from_image(
-            self._image,
-            self.column * self.stride,
-            self.row * self.stride,
-            self.patch_size,
-            self.label_type,
-        )
-        self.column += 1
-        if self.column == self.max_column:
-            return self.get_last_patch_in_row(self.row)
-        elif self.column > self.max_column:
-            self.row += 1
-            self.column = 0
-        return patch, label
+        top, left = self.patch_it.__next__()
+        return get_patch_from_image(self._image, left, top, self.patch_size, self.label_type)
 
     def next_with_coords(self):
-        x = self.column * self.patch_size
-        y = self.row * self.patch_size
-        patch, label = self.__next__()
-        return patch, label, x, y
+        top, left = self.patch_it.__next__()
+        patch, label = get_patch_from_image(self._image, left, top, self.patch_size, self.label_type)
+        return patch, label, left, top
 
     def has_next(self):
-        return self.row != self.max_row
-
-    def get_last_patch_in_row(self, row):
-        left = self._image.width - self.patch_size
-        top = row * self.patch_size
-        return get_patch_from_image(self._image, left, top, self.patch_size, self.label_type)
+        return self.patch_it.index < len(self.patch_it)
 
-    def get_batch(self, batch_size: int) -> tuple[np.ndarray, Union[None, np.ndarray]]:
+    def get_batch(
+            self,
+            batch_size: int,
+            out: Optional[np.ndarray] = None,
+    ) -> tuple[np.ndarray, Union[None, np.ndarray]]:
         """
-        A method that returns a batch of patches from the image.
+        A method that returns a batch of patches from the image. The last batch of the image may be smaller.
         :param batch_size: The size of the batch
+        :param out: A preallocated array of shape (batch_size, patch_size, patch_size, bands) that the patches are read
+        into, so one buffer can be reused for every batch. A new array is allocated if None.
         :return: a ndarray of shape (batch_size, patch_size, patch_size, 3) and optional labels.
         """
-        batch = np.zeros((batch_size, self.patch_size, self.patch_size, 3), dtype=np.uint8) # TODO: remove magic number
-        label_batch = None
-        if self.label_type == LabelEnum.CLASS:
-            label_batch = np.zeros(batch_size, dtype=bool)
-        elif self.label_type == LabelEnum.PIXEL:
-            label_batch = np.zeros((batch_size, self.patch_size, self.patch_size), dtype=bool)
-        for i in range(batch_size):
-            batch[i], labels = self.__next__()
-            if self.label_type != LabelEnum.NO:
-                label_batch[i] = labels
+        coords = self.patch_it.next_batch(batch_size)[:, ::-1]
+        batch = self.region_reader.get_batch(coords, self.patch_size, out)
+        label_batch = get_label_batch([self._image] * len(coords), coords, self.patch_size, self.label_type)
         return batch, label_batch
 
 
@@ -90,22 +116,32 @@ class RandomPatchIterator:
     """
     An iterator that returns random patches from an image dataset.
     """
-    def __init__(self, data_path: str = DATA_ROOT, size: int = SIZE, label_type: LabelEnum = LabelEnum.NO):
+    def __init__(
+            self,
+            data_path: str = DATA_ROOT,
+            size: int = SIZE,
+            label_type: LabelEnum = LabelEnum.NO,
+            seed: Optional[int] = None,
+            worker_id: int = 0,
+    ):
         """
         Constructor for the PatchIterator
         :param data_path: the path to the dataset you want to iterate over
         :param size: The size of the patches you want to extract (default 256). Patches are always square.
-        :param stride: The stride of the sliding window (default 128)
+        :param seed: The seed of the random patches, shared by all workers. Random if None.
+        :param worker_id: The id of the worker in multi-process sampling, every worker gets its own random stream
         """
         self.data_path = data_path
         self.patch_size = size
         self.label_type = label_type
+        self.rng = get_rng(seed, worker_id)
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        return get_random_patch(self.data_path, self.patch_size, self.label_type)
+        image, left, top = get_random_location(self.data_path, self.patch_size, self.rng)
+        return get_patch_from_image(image, left, top, self.patch_size, self.label_type)
 
     def get_batch(self, batch_size: int) -> tuple[np.ndarray, Union[None, np.ndarray]]:
         """
@@ -114,14 +150,12 @@ class RandomPatchIterator:
         :return: a ndarray of shape (batch_size, patch_size, patch_size, 3).
         """
         batch = np.zeros((batch_size, self.patch_size, self.patch_size, 3), dtype=np.uint8)  # TODO: remove magic number
-        label_batch = None
-        if self.label_type == LabelEnum.CLASS:
-            label_batch = np.zeros(batch_size, dtype=bool)
-        elif self.label_type == LabelEnum.PIXEL:
-            label_batch = np.zeros((batch_size, self.patch_size, self.patch_size), dtype=bool)
+        images = []
+        coords = np.zeros((batch_size, 2), dtype=np.int64)
         for i in range(batch_size):
-            batch[i], labels = self.__next__()
-            if self.label_type != LabelEnum.NO:
-                label_batch[i] = labels
+            image, left, top = get_random_location(self.data_path, self.patch_size, self.rng)
+            batch[i], _ = get_patch_from_image(image, left, top, self.patch_size)
+            images.append(image)
+            coords[i] = left, top
+        label_batch = get_label_batch(images, coords, self.patch_size, self.label_type)
         return batch, label_batch
-
@@ -0,0 +1,75 @@
+from typing import Iterator, Optional
+
+import pyvips as pv
+import numpy as np
+from pyvips.vimage import FORMAT_TO_TYPESTR
+
+from src.util import PatchGrid
+
+
+def get_dtype(image: pv.Image) -> np.dtype:
+    return np.dtype(FORMAT_TO_TYPESTR[image.format])
+
+
+class RegionReader:
+    """
+    Reads batches of patches from an image through one reusable pyvips Region. The pixels are copied once, from the
+    libvips buffer straight into a preallocated output array, instead of building a crop pipeline and an intermediate
+    array per patch.
+    """
+    def __init__(self, image: pv.Image):
+        self.image = image
+        self.region = pv.Region.new(image)
+        self.dtype = get_dtype(image)
+
+    def fetch(self, left: int, top: int, width: int, height: int, out: np.ndarray):
+        """
+        Copy a region of the image into out, an array of shape (height, width, bands).
+        """
+        data = self.region.fetch(int(left), int(top), width, height)
+        out[...] = np.frombuffer(data, dtype=self.dtype).reshape((height, width, self.image.bands))
+
+    def get_batch(self, coords: np.ndarray, size: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Read a batch of patches.
+        :param coords: An (N, 2) array of the (left, top) edges of the patches
+        :param size: Width and height of the patches
+        :param out: A preallocated array of at least N patches of shape (size, size, bands) to read into, a new array
+        is allocated if None
+        :return: The first N patches of out
+        """
+        if out is None:
+            out = np.empty((len(coords), size, size, self.image.bands), dtype=self.dtype)
+        for i, (left, top) in enumerate(coords):
+            self.fetch(left, top, size, size, out[i])
+        return out[:len(coords)]
+
+
+def iter_row_bands(image_path: str, size: int, stride: int) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Stream the row bands of all patch rows of an image from top to bottom. The image is opened for sequential access
+    and every pixel row is decoded once, overlapping bands share the rows they have in common.
+    :param image_path: The path to the image
+    :param size: The height of a band, the patch size
+    :param stride: The vertical stride of the patches
+    :return: An iterator over (top, band) tuples, band is a (size, width, bands) array that is reused for the next band
+    """
+    image = pv.Image.new_from_file(image_path, access='sequential')
+    grid = PatchGrid(image.width, image.height, size, stride)
+    buffer = np.empty((size, image.width, image.bands), dtype=get_dtype(image))
+    buffer_top, buffer_end = 0, 0  # the rows [buffer_top, buffer_end) of the image are at the start of the buffer
+    previous = None
+    for top in grid.row_pixels:
+        top = int(top)
+        if top == previous:
+            continue
+        # keep the rows that overlap the previous band and read the rest in order
+        keep = max(buffer_end - top, 0)
+        buffer[:keep] = buffer[buffer_end - buffer_top - keep:buffer_end - buffer_top]
+        start = max(buffer_end, top)
+        if start < top + size:
+            rows = image.crop(0, start, image.width, top + size - start).numpy()
+            buffer[keep:] = rows.reshape((-1, image.width, image.bands))
+        buffer_top, buffer_end = top, top + size
+        previous = top
+        yield top, buffer
@@ -0,0 +1,122 @@
+"""
+Coarse-to-fine segmentation of whole slides.
+
+CascadeSegmenter first segments the downsampled series of a slide. Full resolution patches whose area is confidently
+predicted at the coarse level, such as background or deep grey matter, are filled with the coarse prediction. Only the
+uncertain patches, typically along tissue and grey matter boundaries, are read and segmented at full resolution.
+"""
+from typing import Optional, Union
+
+import h5py
+import numpy as np
+import torch
+
+from src.data_access import SlideIterator
+from src.data_access.read_hdf5 import Hdf5Reader
+from .inference import SlideSegmenter, BATCH_SIZE, PREDICTION_NAME, CHUNK_SIZE, TILE_WIDTH
+
+COARSE_SIZE = 64
+LOW = 0.05
+HIGH = 0.95
+
+
+class CascadeSegmenter(SlideSegmenter):
+    def __init__(
+            self,
+            model: torch.nn.Module,
+            size: int,
+            stride: int,
+            batch_size: int = BATCH_SIZE,
+            device: Union[str, torch.device] = 'cpu',
+            window: Optional[np.ndarray] = None,
+            coarse_model: Optional[torch.nn.Module] = None,
+            coarse_size: int = COARSE_SIZE,
+            low: float = LOW,
+            high: float = HIGH,
+            tile_width: Optional[int] = TILE_WIDTH,
+    ):
+        """
+        Sliding window segmentation that only visits the uncertain regions of a slide at full resolution.
+        :param coarse_model: The model that segments the downsampled series, model if None. A model trained on the
+        downsampled series gives the most reliable coarse predictions.
+        :param coarse_size: The patch size on the downsampled series
+        :param low: Patches whose coarse probabilities are all below low are predicted as 0 without refinement
+        :param high: Patches whose coarse probabilities are all above high are predicted as 1 without refinement
+        """
+        super().__init__(model, size, stride, batch_size, device, window, tile_width)
+        self.coarse_model = self.model if coarse_model is None else coarse_model.to(device).eval()
+        self.coarse_size = coarse_size
+        self.low = low
+        self.high = high
+
+        self.coarse = None
+        self.scale = None
+        self.num_refined = 0
+        self.num_skipped = 0
+
+    def get_coarse_map(self, thumbnail: np.ndarray) -> np.ndarray:
+        """
+        Segment the downsampled series of a slide.
+        :param thumbnail: An (H, W, 3) RGB image, uint8 or float in [0, 1]
+        :return: An (H, W) float32 probability map
+        """
+        if thumbnail.dtype != np.uint8:
+            thumbnail = np.round(thumbnail * 255).astype(np.uint8)
+        height, width, _ = thumbnail.shape
+        padded = np.zeros((max(height, self.coarse_size), max(width, self.coarse_size), 3), dtype=np.uint8)
+        padded[:height, :width] = thumbnail
+        segmenter = SlideSegmenter(self.coarse_model, self.coarse_size, self.coarse_size // 2, self.batch_size,
+                                   self.device)
+        slide_it = SlideIterator(Hdf5Reader(padded), self.coarse_size, self.coarse_size // 2, self.batch_size)
+        slide_it.open()
+        try:
+            coarse = segmenter.segment(slide_it, None)[:height, :width]
+        finally:
+            slide_it.close()
+        if coarse.ndim != 2:
+            raise ValueError("The cascade needs a model with a single output channel")
+        return coarse
+
+    def segment(
+            self,
+            slide_it: SlideIterator,
+            group: h5py.Group,
+            name: str = PREDICTION_NAME,
+            chunk_size: int = CHUNK_SIZE,
+    ) -> h5py.Dataset:
+        """
+        Segment an opened slide, see SlideSegmenter.segment. The number of patches that were refined at full
+        resolution and that were skipped are stored in num_refined and num_skipped and in the attributes of the output.
+        """
+        grid = slide_it.patch_it.grid
+        self.coarse = self.get_coarse_map(slide_it.get_thumbnail())
+        self.scale = (self.coarse.shape[0] / grid.height, self.coarse.shape[1] / grid.width)
+        self.num_refined = 0
+        self.num_skipped = 0
+        output = super().segment(slide_it, group, name, chunk_size)
+        output.attrs['refined_patches'] = self.num_refined
+        output.attrs['skipped_patches'] = self.num_skipped
+        return output
+
+    def get_coarse_region(self, top: int, left: int) -> np.ndarray:
+        """
+        Get the part of the coarse map that a full resolution patch covers, including every partially covered pixel.
+        """
+        scale_y, scale_x = self.scale
+        bottom = max(int(np.ceil((top + self.size) * scale_y)), int(top * scale_y) + 1)
+        right = max(int(np.ceil((left + self.size) * scale_x)), int(left * scale_x) + 1)
+        return self.coarse[int(top * scale_y):bottom, int(left * scale_x):right]
+
+    def predict_patches(self, slide_it: SlideIterator, coords: np.ndarray) -> np.ndarray:
+        predictions = np.zeros((len(coords), 1, self.size, self.size), dtype=np.float32)
+        refine = np.ones(len(coords), dtype=bool)
+        for i, (top, left) in enumerate(coords):
+            region = self.get_coarse_region(top, left)
+            if region.max() < self.low or region.min() > self.high:
+                predictions[i] = region.mean()
+                refine[i] = False
+        if refine.any():
+            predictions[refine] = super().predict_patches(slide_it, coords[refine])
+        self.num_refined += int(refine.sum())
+        self.num_skipped += int((~refine).sum())
+        return predictions
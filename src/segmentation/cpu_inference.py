@@ -0,0 +1,263 @@
+"""
+Prepare Unet and brainsec_resnet18 for inference on CPU-only machines and measure their throughput.
+
+The BatchNorm layers are folded into the convolutions where this is exact. For brainsec_resnet18 that is every
+convolution, since each is followed by a BatchNorm. Unet applies its BatchNorms after an ELU, so they cannot be folded
+into the convolution before them. Only the last one can be folded, into the 1x1 segment convolution after it. The
+model can then use channels_last, an explicit number of threads, int8 quantization and TorchScript.
+
+    python -m src.segmentation.cpu_inference unet --checkpoint unet.pt --threads 8 --quantize static --json cpu.json
+"""
+import argparse
+import copy
+import json
+import time
+from typing import Optional
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torchvision.models import ResNet
+
+from .models import Unet, brainsec_resnet18
+
+SIZE = 256
+BATCH_SIZE = 16
+ITERATIONS = 10
+WARMUP = 2
+TOLERANCE = 0.05
+# the int8 backends in order of preference, 'x86' was only added in torch 2.0
+QUANTIZED_BACKENDS = ['x86', 'fbgemm', 'qnnpack']
+
+
+def fold_bn_into_next_conv(batch_norm: nn.BatchNorm2d, conv: nn.Conv2d) -> nn.Conv2d:
+    """
+    Fold a BatchNorm into the 1x1 convolution that directly follows it. This is exact because a 1x1 convolution
+    without padding sees every input pixel, and so every normalized pixel, exactly once.
+    """
+    if conv.kernel_size != (1, 1) or conv.padding != (0, 0):
+        raise ValueError("Only a 1x1 convolution without padding can absorb the BatchNorm before it")
+    scale = batch_norm.weight / torch.sqrt(batch_norm.running_var + batch_norm.eps)
+    shift = batch_norm.bias - batch_norm.running_mean * scale
+    folded = copy.deepcopy(conv)
+    with torch.no_grad():
+        weight = conv.weight[:, :, 0, 0]
+        bias = conv.bias if conv.bias is not None else torch.zeros(conv.out_channels, device=weight.device)
+        folded.weight.copy_(conv.weight * scale[None, :, None, None])
+        if folded.bias is None:
+            folded.bias = nn.Parameter(torch.zeros_like(bias))
+        folded.bias.copy_(bias + weight @ shift)
+    return folded
+
+
+def fold_resnet(model: ResNet) -> ResNet:
+    model.conv1 = fuse_conv_bn_eval(model.conv1, model.bn1)
+    model.bn1 = nn.Identity()
+    for layer in [model.layer1, model.layer2, model.layer3, model.layer4]:
+        for block in layer:
+            block.conv1 = fuse_conv_bn_eval(block.conv1, block.bn1)
+            block.bn1 = nn.Identity()
+            block.conv2 = fuse_conv_bn_eval(block.conv2, block.bn2)
+            block.bn2 = nn.Identity()
+            if block.downsample is not None:
+                block.downsample = nn.Sequential(fuse_conv_bn_eval(block.downsample[0], block.downsample[1]))
+    return model
+
+
+def fold_unet(model: Unet) -> Unet:
+    model.segment[0] = fold_bn_into_next_conv(model.expand_1.batch_norm_2, model.segment[0])
+    model.expand_1.batch_norm_2 = nn.Identity()
+    return model
+
+
+def fold_batch_norm(model: nn.Module) -> nn.Module:
+    """
+    Fold the BatchNorm layers of an evaluation mode Unet or brainsec_resnet18 into their convolutions in place.
+    """
+    if model.training:
+        raise ValueError("BatchNorm can only be folded in evaluation mode")
+    if isinstance(model, ResNet):
+        return fold_resnet(model)
+    elif isinstance(model, Unet):
+        return fold_unet(model)
+    raise TypeError(f"Cannot fold the BatchNorm layers of {type(model).__name__}")
+
+
+def prepare_cpu_model(
+        model: nn.Module,
+        threads: Optional[int] = None,
+        fold: bool = True,
+        channels_last: bool = True,
+) -> nn.Module:
+    """
+    Get an evaluation mode copy of a model on the CPU.
+    :param threads: The number of intra-op threads of torch, unchanged if None
+    :param fold: Fold the BatchNorm layers, see fold_batch_norm
+    :param channels_last: Use the channels_last memory format, the inputs should use it as well
+    """
+    if threads is not None:
+        torch.set_num_threads(threads)
+    model = copy.deepcopy(model).to('cpu').eval()
+    if fold:
+        model = fold_batch_norm(model)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def quantize_dynamic(model: nn.Module) -> nn.Module:
+    """
+    Quantize the weights of the linear layers to int8, the activations are quantized on the fly. Only the classifier
+    head of brainsec_resnet18 is linear, so this barely changes the convolutional models.
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def get_quantized_backend() -> str:
+    """
+    Get the preferred int8 backend that this build of torch supports.
+    """
+    for backend in QUANTIZED_BACKENDS:
+        if backend in torch.backends.quantized.supported_engines:
+            return backend
+    raise RuntimeError("This build of torch does not support quantization")
+
+
+def quantize_static(model: nn.Module, calibration: torch.Tensor, backend: Optional[str] = None) -> nn.Module:
+    """
+    Quantize the weights and activations of a model to int8 with FX graph mode quantization.
+    :param calibration: A batch of representative patches that the activation ranges are observed on
+    :param backend: The quantized engine, such as 'fbgemm', see get_quantized_backend if None
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    if backend is None:
+        backend = get_quantized_backend()
+
+    torch.backends.quantized.engine = backend
+    prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(backend), (calibration,))
+    with torch.inference_mode():
+        prepared(calibration)
+    return convert_fx(prepared)
+
+
+def get_probabilities(model: nn.Module, patches: torch.Tensor) -> torch.Tensor:
+    with torch.inference_mode():
+        out = model(patches)
+    # brainsec_resnet18 returns logits, Unet probabilities
+    return torch.sigmoid(out) if out.dim() == 2 else out
+
+
+def check_accuracy(
+        reference: nn.Module,
+        model: nn.Module,
+        patches: torch.Tensor,
+        tolerance: float = TOLERANCE,
+) -> dict:
+    """
+    Compare the probabilities of an optimized model with those of the reference model.
+    :return: The maximum absolute difference and the fraction of equal decisions at 0.5
+    :raises ValueError: If the maximum difference exceeds tolerance
+    """
+    expected = get_probabilities(reference, patches)
+    actual = get_probabilities(model, patches)
+    result = {
+        'max_error': float((expected - actual).abs().max()),
+        'agreement': float(((expected >= 0.5) == (actual >= 0.5)).float().mean()),
+    }
+    if result['max_error'] > tolerance:
+        raise ValueError(f"The optimized model deviates by {result['max_error']:.4f}, more than {tolerance}")
+    return result
+
+
+def export_torchscript(model: nn.Module, example: torch.Tensor, path: str) -> torch.jit.ScriptModule:
+    """
+    Trace a model on an example batch and save it, so it can be loaded with torch.jit.load without this code.
+    """
+    with torch.inference_mode():
+        scripted = torch.jit.freeze(torch.jit.trace(model, example))
+    scripted.save(path)
+    return scripted
+
+
+def benchmark(
+        model: nn.Module,
+        patches: torch.Tensor,
+        iterations: int = ITERATIONS,
+        warmup: int = WARMUP,
+) -> float:
+    """
+    Measure the throughput of a model on the CPU.
+    :return: The number of patches per second
+    """
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(patches)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(patches)
+    return iterations * len(patches) / (time.perf_counter() - start)
+
+
+def get_model(name: str, checkpoint: Optional[str] = None) -> nn.Module:
+    model = Unet(3, 1, device='cpu') if name == 'unet' else brainsec_resnet18(weights=None)
+    if checkpoint is not None:
+        model.load_state_dict(torch.load(checkpoint, map_location='cpu'))
+    return model.eval()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Optimize a model for CPU inference and measure patches per second.')
+    parser.add_argument('model', choices=['unet', 'resnet'], help='The model architecture')
+    parser.add_argument('--checkpoint', help='A state dict of the model, random weights if not given')
+    parser.add_argument('--size', type=int, default=SIZE, help='The patch size')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='The number of patches per forward pass')
+    parser.add_argument('--threads', type=int, help='The number of torch threads, the torch default if not given')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS, help='The number of timed forward passes')
+    parser.add_argument('--quantize', choices=['none', 'dynamic', 'static'], default='none', help='int8 quantization')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='The allowed probability error')
+    parser.add_argument('--torchscript', help='Save the fastest configuration as TorchScript to this path')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    reference = get_model(args.model, args.checkpoint)
+    patches = torch.rand(args.batch_size, 3, args.size, args.size)
+    channels_last_patches = patches.contiguous(memory_format=torch.channels_last)
+    configurations = {
+        'baseline': (prepare_cpu_model(reference, args.threads, fold=False, channels_last=False), patches),
+        'folded': (prepare_cpu_model(reference, args.threads, channels_last=False), patches),
+        'folded_channels_last': (prepare_cpu_model(reference, args.threads), channels_last_patches),
+    }
+    if args.quantize == 'dynamic':
+        configurations['dynamic_int8'] = (quantize_dynamic(prepare_cpu_model(reference, args.threads)),
+                                          channels_last_patches)
+    elif args.quantize == 'static':
+        configurations['static_int8'] = (quantize_static(prepare_cpu_model(reference, args.threads), patches),
+                                         channels_last_patches)
+
+    results = []
+    for name, (model, inputs) in configurations.items():
+        result = {'configuration': name, 'threads': torch.get_num_threads(), 'batch_size': args.batch_size}
+        try:
+            result.update(check_accuracy(reference, model, inputs, args.tolerance))
+        except ValueError as e:
+            print(name, e)
+            result['rejected'] = True
+        result['patches_per_second'] = benchmark(model, inputs, args.iterations)
+        print(name, f"{result['patches_per_second']:.1f} patches/s")
+        results.append(result)
+
+    if args.torchscript:
+        accepted = [r for r in results if not r.get('rejected')]
+        best = max(accepted, key=lambda r: r['patches_per_second'])
+        model, inputs = configurations[best['configuration']]
+        export_torchscript(model, inputs, args.torchscript)
+        print('saved', best['configuration'], 'to', args.torchscript)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
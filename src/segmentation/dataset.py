@@ -0,0 +1,270 @@
+import math
+import os
+from typing import Optional
+
+import h5py
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, Dataset, Sampler, DataLoader, default_collate, get_worker_info
+
+from src.data_access import ImageIterator, PatchIndex, PatchReader
+from src.data_access.patch_index import MAX_OPEN_SLIDES
+from src.util import LabelEnum
+
+
+class SlideDataset(IterableDataset):
+    """
+    A torch IterableDataset over the batches of all images in a partition of the hdf5 data file. The images are
+    shuffled per epoch and divided over the DataLoader workers, so every worker reads its own slides with its own JVM.
+    The dataset yields complete (patches, labels) batches, so the DataLoader should not batch again.
+    """
+    def __init__(
+            self,
+            data_path: str,
+            partition: str,
+            size: int,
+            stride: int,
+            batch_size: int,
+            label_type: LabelEnum,
+            buffered: bool = True,
+            seed: int = 0,
+            raw: bool = False,
+    ):
+        """
+        Constructor for the SlideDataset
+        :param data_path: The path to the hdf5 data file
+        :param partition: The group in the data file that contains the images, such as 'train'
+        :param seed: The seed of the image order. The order of an epoch only depends on the seed and the epoch.
+        :param raw: Yield uint8 patches and labels, see ImageIterator and Uint8Normalize
+        """
+        super().__init__()
+        self.data_path = data_path
+        self.partition = partition
+        self.size = size
+        self.stride = stride
+        self.batch_size = batch_size
+        self.label_type = label_type
+        self.buffered = buffered
+        self.seed = seed
+        self.raw = raw
+        self.epoch = 0
+
+        with h5py.File(data_path, 'r') as file:
+            self.image_list = sorted(file[partition].keys())
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def get_worker_images(self, worker_id: int, num_workers: int) -> list[str]:
+        """
+        Get the images that a worker reads in the current epoch. Every image is assigned to exactly one worker.
+        """
+        order = np.random.default_rng([self.seed, self.epoch]).permutation(len(self.image_list))
+        return [self.image_list[i] for i in order[worker_id::num_workers]]
+
+    def __iter__(self):
+        info = get_worker_info()
+        if info is None:
+            worker_id, num_workers = 0, 1
+        else:
+            worker_id, num_workers = info.id, info.num_workers
+        with h5py.File(self.data_path, 'r') as file:
+            for image_name in self.get_worker_images(worker_id, num_workers):
+                image_it = ImageIterator(
+                    file[self.partition][image_name],
+                    self.size,
+                    self.stride,
+                    self.batch_size,
+                    self.label_type,
+                    buffered=self.buffered,
+                    raw=self.raw,
+                )
+                with image_it:
+                    for patches, labels in image_it:
+                        yield torch.from_numpy(patches), torch.from_numpy(labels)
+
+
+def get_data_loader(dataset: SlideDataset, num_workers: int, prefetch_factor: int = 2, **kwargs) -> DataLoader:
+    """
+    Create a DataLoader that reads a SlideDataset with num_workers processes. Every worker starts its own JVM when it
+    opens its first vsi image.
+    """
+    if num_workers == 0:
+        return DataLoader(dataset, batch_size=None, **kwargs)
+    return DataLoader(
+        dataset,
+        batch_size=None,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        **kwargs,
+    )
+
+
+class PatchDataset(Dataset):
+    """
+    A torch map-style Dataset over the patches of all images in a partition of the hdf5 data file, see PatchIndex. Any
+    patch can be read by its index, so batches can be shuffled across slides. Every process, such as a DataLoader
+    worker, opens the data file itself and keeps the most recently used slides open.
+    """
+    def __init__(
+            self,
+            data_path: str,
+            partition: str,
+            size: int,
+            stride: int,
+            label_type: LabelEnum,
+            tissue_threshold: Optional[float] = None,
+            backend: Optional[str] = None,
+            max_open: int = MAX_OPEN_SLIDES,
+            raw: bool = False,
+    ):
+        """
+        Constructor for the PatchDataset
+        :param data_path: The path to the hdf5 data file
+        :param partition: The group in the data file that contains the images, such as 'train'
+        :param tissue_threshold: Leave out patches whose fraction of tissue is below this threshold, see PatchIndex
+        :param backend: The slide backend of all images, see get_slide_reader
+        :param max_open: The maximum number of slides that every process keeps open
+        :param raw: Return uint8 patches and labels, see PatchReader and Uint8Normalize
+        """
+        super().__init__()
+        self.data_path = data_path
+        self.partition = partition
+        self.label_type = label_type
+        self.backend = backend
+        self.max_open = max_open
+        self.raw = raw
+
+        with h5py.File(data_path, 'r') as file:
+            self.index = PatchIndex(file[partition], size, stride, tissue_threshold)
+
+        self.file = None
+        self.reader = None
+        self.pid = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_reader(self) -> PatchReader:
+        # a forked worker must not use the file handle of its parent
+        if self.reader is None or self.pid != os.getpid():
+            self.file = h5py.File(self.data_path, 'r')
+            self.reader = PatchReader(self.file[self.partition], self.index, self.label_type, self.backend,
+                                      self.max_open, self.raw)
+            self.pid = os.getpid()
+        return self.reader
+
+    def __getitem__(self, item: int) -> tuple[torch.Tensor, torch.Tensor]:
+        patches, labels = self.get_reader().read(np.array([item]))
+        return torch.from_numpy(patches)[0], torch.from_numpy(labels)[0]
+
+    def __getitems__(self, items: list[int]) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Read a batch of patches at once, which the DataLoader uses instead of calling __getitem__ per patch. The batch
+        is returned as it is read, see collate_batch. Torch 1.13 ignores __getitems__ and reads one patch at a time.
+        """
+        patches, labels = self.get_reader().read(np.array(items))
+        return torch.from_numpy(patches), torch.from_numpy(labels)
+
+    def close(self):
+        if self.reader is not None and self.pid == os.getpid():
+            self.reader.close()
+            self.file.close()
+        self.reader = None
+        self.file = None
+
+    def __getstate__(self):
+        # open readers and files cannot be sent to spawned workers, they open their own
+        state = self.__dict__.copy()
+        state['file'] = None
+        state['reader'] = None
+        return state
+
+
+class ShuffledBatchSampler(Sampler):
+    """
+    A batch sampler that shuffles the patches of a PatchDataset across all slides. The order of an epoch only depends on
+    the seed and the epoch.
+    """
+    def __init__(
+            self,
+            num_patches: int,
+            batch_size: int,
+            seed: int = 0,
+            drop_last: bool = False,
+            block_size: int = 1,
+    ):
+        """
+        Constructor for the ShuffledBatchSampler
+        :param num_patches: The length of the dataset
+        :param drop_last: Leave out the last batch if it is smaller than batch_size
+        :param block_size: Shuffle blocks of block_size consecutive patches instead of single patches. Consecutive
+        patches lie next to each other on the same slide, so larger blocks read fewer slide regions and tiles per batch
+        at the cost of less random batches.
+        """
+        super().__init__()
+        self.num_patches = num_patches
+        self.batch_size = batch_size
+        self.seed = seed
+        self.drop_last = drop_last
+        self.block_size = block_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def get_order(self) -> np.ndarray:
+        rng = np.random.default_rng([self.seed, self.epoch])
+        if self.block_size == 1:
+            return rng.permutation(self.num_patches)
+        blocks = rng.permutation(math.ceil(self.num_patches / self.block_size))
+        order = (blocks[:, None] * self.block_size + np.arange(self.block_size)).reshape(-1)
+        return order[order < self.num_patches]
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_patches // self.batch_size
+        return math.ceil(self.num_patches / self.batch_size)
+
+    def __iter__(self):
+        order = self.get_order()
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            yield order[start:start + self.batch_size].tolist()
+
+
+def collate_batch(batch):
+    """
+    The collate_fn of get_patch_loader. A batch from PatchDataset.__getitems__ is returned without a copy, the single
+    patches of DataLoaders that do not use __getitems__ are stacked.
+    """
+    if isinstance(batch, tuple):
+        return batch
+    return default_collate(batch)
+
+
+def get_patch_loader(
+        dataset: PatchDataset,
+        batch_size: int,
+        num_workers: int,
+        seed: int = 0,
+        drop_last: bool = False,
+        block_size: int = 1,
+        prefetch_factor: int = 2,
+        **kwargs,
+) -> DataLoader:
+    """
+    Create a DataLoader over shuffled batches of a PatchDataset. Call loader.batch_sampler.set_epoch before every epoch
+    for a new order. The workers are kept alive between epochs, so they keep their JVM and open slides.
+    """
+    sampler = ShuffledBatchSampler(len(dataset), batch_size, seed, drop_last, block_size)
+    kwargs.setdefault('collate_fn', collate_batch)
+    if num_workers == 0:
+        return DataLoader(dataset, batch_sampler=sampler, **kwargs)
+    return DataLoader(
+        dataset,
+        batch_sampler=sampler,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        persistent_workers=True,
+        **kwargs,
+    )
@@ -0,0 +1,213 @@
+"""
+Run a model over a whole slide.
+
+SlideSegmenter walks the patch grid of a slide one patch row at a time. It blends the overlapping Unet outputs of a row
+with a weighting window into a band of patch size rows. Once the next row starts, the rows above it are final and are
+written to an hdf5 dataset, so the full resolution probability map is never held in memory.
+
+The band is split into column tiles of tile_width pixels, which are segmented one after the other, so peak memory is
+one band of (size, tile_width) pixels plus batch_size patches, however wide the slide is. The patches that overlap two
+tiles are predicted once per tile.
+"""
+from typing import Optional, Union
+
+import h5py
+import numpy as np
+import torch
+
+from src.data_access import SlideIterator
+from src.data_access.read_data import get_slide_iterator
+
+PREDICTION_NAME = 'prediction'
+BATCH_SIZE = 16
+CHUNK_SIZE = 128
+# a multiple of the chunk size, so every tile writes whole chunks
+TILE_WIDTH = 64 * CHUNK_SIZE
+MIN_WEIGHT = 1e-3
+
+
+def get_window(size: int, min_weight: float = MIN_WEIGHT) -> np.ndarray:
+    """
+    Get a separable Hann window that weighs the centre of a patch over its edges, where the Unet has less context. The
+    weights never drop below min_weight, so pixels that only lie on the edge of a patch, such as at the edge of the
+    slide, still get a prediction.
+    :return: A (size, size) float32 array
+    """
+    window = np.hanning(size + 2)[1:-1]
+    return np.maximum(np.outer(window, window), min_weight).astype(np.float32)
+
+
+def predict(model: torch.nn.Module, patches: np.ndarray, device: Union[str, torch.device]) -> np.ndarray:
+    with torch.inference_mode():
+        out = model(torch.from_numpy(patches).to(device))
+    return out.float().cpu().numpy()
+
+
+class SlideSegmenter:
+    def __init__(
+            self,
+            model: torch.nn.Module,
+            size: int,
+            stride: int,
+            batch_size: int = BATCH_SIZE,
+            device: Union[str, torch.device] = 'cpu',
+            window: Optional[np.ndarray] = None,
+            tile_width: Optional[int] = TILE_WIDTH,
+    ):
+        """
+        Sliding window segmentation of whole slides with a pixel-wise model such as Unet.
+        :param model: A model that maps (N, 3, size, size) patches to (N, C, size, size) probabilities
+        :param batch_size: The number of patches per forward pass, this bounds the memory of the model
+        :param device: The device that the model runs on
+        :param window: The (size, size) weights of a patch when blending, see get_window
+        :param tile_width: The width of the column tiles that the band is split into. This bounds the band to
+        size * tile_width * (C + 1) float32 values. A multiple of the chunk size of the output avoids rewriting chunks.
+        If None, the band spans the full slide width and its memory is not bounded.
+        """
+        self.model = model.to(device).eval()
+        self.size = size
+        self.stride = stride
+        self.batch_size = batch_size
+        self.device = device
+        self.window = get_window(size) if window is None else window
+        if tile_width is not None and tile_width < 1:
+            raise ValueError(f"The tile width must be positive, got {tile_width}")
+        self.tile_width = tile_width
+        self.num_patches = 0
+
+    def segment(
+            self,
+            slide_it: SlideIterator,
+            group: Optional[h5py.Group],
+            name: str = PREDICTION_NAME,
+            chunk_size: int = CHUNK_SIZE,
+    ) -> Union[h5py.Dataset, np.ndarray]:
+        """
+        Segment an opened slide and write the blended probabilities to a dataset.
+        :param slide_it: An opened SlideIterator, such as a VsiIterator or Hdf5Iterator, with the same size and stride
+        :param group: The group to write the dataset to, such as the image group of the slide. The probabilities are
+        returned as an array if None, which is only suitable for small images such as thumbnails.
+        :param name: The name of the dataset, it is replaced if it exists
+        :return: A (height, width) float32 dataset, or (height, width, C) for models with C > 1 output channels
+        """
+        grid = slide_it.patch_it.grid
+        width, height, size = grid.width, grid.height, self.size
+        columns = np.unique(grid.column_pixels)
+        rows = np.unique(grid.row_pixels)
+        tile_width = width if self.tile_width is None else self.tile_width
+
+        output = None
+        for tile_left in range(0, width, tile_width):
+            tile_right = min(tile_left + tile_width, width)
+            # every patch that overlaps the tile, patches on the edge of a tile are predicted for both tiles
+            tile_columns = columns[(columns < tile_right) & (columns + size > tile_left)]
+            weighted = weights = None
+            band_top = int(rows[0])
+            for top in rows:
+                top = int(top)
+                if weighted is not None and top != band_top:
+                    self.flush(output, weighted, weights, band_top, top - band_top, tile_left)
+                    shift = min(top - band_top, size)
+                    weighted[:size - shift] = weighted[shift:]
+                    weighted[size - shift:] = 0
+                    weights[:size - shift] = weights[shift:]
+                    weights[size - shift:] = 0
+                    band_top = top
+                for first in range(0, len(tile_columns), self.batch_size):
+                    lefts = tile_columns[first:first + self.batch_size]
+                    coords = np.stack([np.full(len(lefts), top), lefts], axis=1)
+                    predictions = self.predict_patches(slide_it, coords)
+                    if predictions.ndim != 4:
+                        raise ValueError(
+                            f"Expected pixel-wise predictions of shape (N, C, H, W), got {predictions.shape}"
+                        )
+                    # (N, C, size, size) to (N, size, size, C)
+                    predictions = np.moveaxis(predictions, 1, -1)
+                    self.num_patches += len(coords)
+                    channels = predictions.shape[-1]
+                    if output is None:
+                        shape = (height, width) if channels == 1 else (height, width, channels)
+                        output = self.create_output(group, name, shape, chunk_size)
+                    if weighted is None:
+                        weighted = np.zeros((size, tile_right - tile_left, channels), dtype=np.float32)
+                        weights = np.zeros((size, tile_right - tile_left, 1), dtype=np.float32)
+                    for left, prediction in zip(lefts, predictions):
+                        # the columns of the patch that lie in the tile
+                        start, stop = max(left, tile_left), min(left + size, tile_right)
+                        window = self.window[:, start - left:stop - left]
+                        weighted[:, start - tile_left:stop - tile_left] += (
+                            prediction[:, start - left:stop - left] * window[:, :, None]
+                        )
+                        weights[:, start - tile_left:stop - tile_left, 0] += window
+            if weighted is not None:
+                self.flush(output, weighted, weights, band_top, size, tile_left)
+        return output
+
+    @staticmethod
+    def create_output(
+            group: Optional[h5py.Group],
+            name: str,
+            shape: tuple[int, ...],
+            chunk_size: int,
+    ) -> Union[h5py.Dataset, np.ndarray]:
+        if group is None:
+            return np.zeros(shape, dtype=np.float32)
+        if name in group:
+            del group[name]
+        height, width = shape[:2]
+        return group.create_dataset(
+            name,
+            shape,
+            dtype=np.float32,
+            chunks=(min(chunk_size, height), min(chunk_size, width)) + shape[2:],
+            compression='lzf',
+        )
+
+    def predict_patches(self, slide_it: SlideIterator, coords: np.ndarray) -> np.ndarray:
+        """
+        Get the predictions of the patches at an (N, 2) array of (top, left) coordinates.
+        :return: An (N, C, size, size) array
+        """
+        return predict(self.model, slide_it.read_patches(coords), self.device)
+
+    @staticmethod
+    def flush(
+            output: Union[h5py.Dataset, np.ndarray],
+            weighted: np.ndarray,
+            weights: np.ndarray,
+            band_top: int,
+            num_rows: int,
+            band_left: int = 0,
+    ):
+        """
+        Write the first num_rows rows of the band, which no later patch row overlaps, to the output.
+        :param band_left: The left column of the band in the output, for bands that cover one column tile
+        """
+        num_rows = min(num_rows, len(weights))
+        blended = weighted[:num_rows] / np.maximum(weights[:num_rows], MIN_WEIGHT)
+        if output.ndim == 2:
+            blended = blended[:, :, 0]
+        output[band_top:band_top + num_rows, band_left:band_left + blended.shape[1]] = blended
+
+
+def segment_slide(
+        model: torch.nn.Module,
+        image_group: h5py.Group,
+        size: int,
+        stride: int,
+        batch_size: int = BATCH_SIZE,
+        device: Union[str, torch.device] = 'cpu',
+        buffered: bool = True,
+        tile_width: Optional[int] = TILE_WIDTH,
+) -> h5py.Dataset:
+    """
+    Segment the slide of an image group and store the probability map in its 'prediction' dataset. The hdf5 file must
+    be writable.
+    """
+    segmenter = SlideSegmenter(model, size, stride, batch_size, device, tile_width=tile_width)
+    slide_it = get_slide_iterator(image_group, size, stride, batch_size, buffered)
+    slide_it.open()
+    try:
+        return segmenter.segment(slide_it, image_group)
+    finally:
+        slide_it.close()
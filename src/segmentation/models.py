@@ -1,3 +1,5 @@
+from typing import Optional
+
 import torch
 import torch.nn as nn
 from torchvision.models import resnet18, ResNet18_Weights
@@ -8,7 +10,7 @@ class ConvBlock(nn.Module):
     FILTER_SIZE = (5, 5)
     PADDING = (2, 2)
 
-    def __init__(self, in_channels: int, out_channels: int, device='cuda'):
+    def __init__(self, in_channels: int, out_channels: int, device=None):
         super().__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
@@ -49,7 +51,7 @@ class Unet(nn.Module):
     T_CONV_STRIDE = (2, 2)
     T_CONV_KERNEL = (2, 2)
 
-    def __init__(self, in_channels: int, out_channels: int, device='cuda'):
+    def __init__(self, in_channels: int, out_channels: int, device=None):
         super().__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
@@ -70,21 +72,22 @@ class Unet(nn.Module):
         self.bottom = ConvBlock(self.NUM_CHANNELS_4, self.NUM_CHANNELS_5, device=device)
 
         self.t_conv_4 = nn.ConvTranspose2d(self.NUM_CHANNELS_5, self.NUM_CHANNELS_4, self.T_CONV_KERNEL, self.T_CONV_STRIDE, device=device)
-        self.expand_4 = ConvBlock(self.NUM_CHANNELS_5, self.NUM_CHANNELS_4)
+        self.expand_4 = ConvBlock(self.NUM_CHANNELS_5, self.NUM_CHANNELS_4, device=device)
 
         self.t_conv_3 = nn.ConvTranspose2d(self.NUM_CHANNELS_4, self.NUM_CHANNELS_3, self.T_CONV_KERNEL, self.T_CONV_STRIDE, device=device)
-        self.expand_3 = ConvBlock(self.NUM_CHANNELS_4, self.NUM_CHANNELS_3)
+        self.expand_3 = ConvBlock(self.NUM_CHANNELS_4, self.NUM_CHANNELS_3, device=device)
 
         self.t_conv_2 = nn.ConvTranspose2d(self.NUM_CHANNELS_3, self.NUM_CHANNELS_2, self.T_CONV_KERNEL, self.T_CONV_STRIDE, device=device)
-        self.expand_2 = ConvBlock(self.NUM_CHANNELS_3, self.NUM_CHANNELS_2)
+        self.expand_2 = ConvBlock(self.NUM_CHANNELS_3, self.NUM_CHANNELS_2, device=device)
 
         self.t_conv_1 = nn.ConvTranspose2d(self.NUM_CHANNELS_2, self.NUM_CHANNELS_1, self.T_CONV_KERNEL, self.T_CONV_STRIDE, device=device)
-        self.expand_1 = ConvBlock(self.NUM_CHANNELS_2, self.NUM_CHANNELS_1)
+        self.expand_1 = ConvBlock(self.NUM_CHANNELS_2, self.NUM_CHANNELS_1, device=device)
 
         self.segment = nn.Sequential(nn.Conv2d(self.NUM_CHANNELS_1, out_channels, (1, 1), device=device), nn.Sigmoid())
 
     def forward(self, x):
-        cat_dim = 1 if len(x.shape) == 4 else 0
+        # the channel dimension of both (C, H, W) and (N, C, H, W) inputs, without a shape check that breaks tracing
+        cat_dim = -3
 
         down_1 = self.contract_1(x)
         down_2 = self.contract_2(self.pool_1(down_1))
@@ -99,8 +102,11 @@ class Unet(nn.Module):
         up_1 = self.expand_1(torch.cat((down_1, self.t_conv_1(up_2)), cat_dim))
         return self.segment(up_1)
 
-def brainsec_resnet18():
-    model = resnet18(ResNet18_Weights)
+def brainsec_resnet18(weights: Optional[ResNet18_Weights] = ResNet18_Weights.DEFAULT):
+    """
+    :param weights: The pretrained weights of the backbone, None for random weights such as before loading a checkpoint
+    """
+    model = resnet18(weights=weights)
     fc_in_features = model.fc.in_features
     model.fc = nn.Linear(fc_in_features, 1)
     return model
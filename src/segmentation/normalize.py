@@ -0,0 +1,54 @@
+"""
+Normalization of raw uint8 batches on the torch side.
+
+With raw batches the data pipeline only moves uint8 pixels, a quarter of the bytes of float32, and the conversion to
+float and the normalization run once per batch on the training device:
+
+    normalize = Uint8Normalize().to(device)
+    patches, labels = to_device(patches, labels, device, normalize)
+"""
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import torch
+
+
+class Uint8Normalize(torch.nn.Module):
+    def __init__(self, mean: Optional[Sequence[float]] = None, std: Optional[Sequence[float]] = None):
+        """
+        Convert (N, 3, H, W) uint8 patches to float32 (x / 255 - mean) / std with a single multiply-add. Without mean
+        and std the result equals the float32 batches of the data iterators.
+        :param mean: The mean of every channel in [0, 1], 0 if None
+        :param std: The standard deviation of every channel in [0, 1], 1 if None
+        """
+        super().__init__()
+        self.plain = mean is None and std is None
+        mean = torch.zeros(3) if mean is None else torch.as_tensor(mean, dtype=torch.float32)
+        std = torch.ones(3) if std is None else torch.as_tensor(std, dtype=torch.float32)
+        self.register_buffer('scale', (1 / (255 * std)).view(1, 3, 1, 1))
+        self.register_buffer('shift', (-mean / std).view(1, 3, 1, 1))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        # both ops cast the uint8 input inside the kernel, so no intermediate float batch is written
+        if self.plain:
+            # a true division, so the values are identical to those of the float32 data pipeline
+            return torch.div(x, 255)
+        return torch.addcmul(self.shift, x, self.scale)
+
+
+def to_device(
+        patches: Union[np.ndarray, torch.Tensor],
+        labels: Union[np.ndarray, torch.Tensor],
+        device: Union[str, torch.device],
+        normalize: Optional[Uint8Normalize] = None,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Move a batch to the device and convert it to float32 there. Batches in pinned memory, see BatchRing, are copied
+    asynchronously.
+    :param normalize: Converts uint8 patches, float patches are moved as they are if None
+    """
+    patches = torch.as_tensor(patches).to(device, non_blocking=True)
+    labels = torch.as_tensor(labels).to(device, non_blocking=True)
+    if normalize is not None and patches.dtype == torch.uint8:
+        patches = normalize(patches)
+    return patches, labels.to(torch.float32)
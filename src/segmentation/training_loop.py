@@ -1,76 +1,251 @@
+"""
+Train a model on the patches of a data partition.
+
+    python -m src.segmentation.training_loop F:/sample_46.hdf5 --partition validation --workers 4 --plot
+"""
+import argparse
+import os
 import time
+import warnings
+from typing import Optional
 
-import matplotlib.pyplot as plt
-import bioformats
-import javabridge
 import h5py
 import torch
-import numpy as np
 
 from src.segmentation import Unet, brainsec_resnet18
-from src.data_access import DataIterator
-from src.util import LabelEnum
+from src.segmentation.dataset import SlideDataset, PatchDataset, get_data_loader, get_patch_loader
+from src.segmentation.normalize import Uint8Normalize, to_device
+from src.data_access import DataIterator, PrefetchIterator
+from src.util import LabelEnum, profiling
 
 ############
 # SETTINGS #
 ############
-data_file = 'F:/sample_46.hdf5'
-data_partition = 'validation'
-batch_size = 8
-patch_size = 256
-stride = 128
-epochs = 1
-
-###############
-# PREPARATION #
-###############
-javabridge.start_vm(class_path=bioformats.JARS)
-logback = javabridge.JClassWrapper("loci.common.LogbackTools")
-logback.enableLogging()
-logback.setRootLevel("ERROR")
-
-file = h5py.File(data_file, 'r')
-it = DataIterator(file[data_partition], patch_size, stride, batch_size, LabelEnum.CLASS_MIDDLE)
-it.open()
-
-model = brainsec_resnet18().to('cuda')
-# model = Unet(3, 1)
-optim = torch.optim.Adam(model.parameters())
-criterion = torch.nn.CrossEntropyLoss()  # include weighting per class
-batch_loss = []
+DATA_FILE = 'F:/sample_46.hdf5'
+DATA_PARTITION = 'validation'
+BATCH_SIZE = 8
+PATCH_SIZE = 256
+STRIDE = 128
+EPOCHS = 1
+BUFFERED = True
+PREFETCH_DEPTH = 2  # 0 disables prefetching
+NUM_WORKERS = 0  # > 0 reads the slides in worker processes with one JVM each
+SEED = 0  # the seed of the image order of every epoch
+CHECKPOINT_EVERY = 500  # batches
 
-############
-# TRAINING #
-############
-for e in range(epochs):
-    epoch_start = time.time()
-    print('epoch', e)
-    for i, data in enumerate(it):
-        batch_start = time.time()
-        patches, labels = data
-        patches = torch.from_numpy(patches).to('cuda')
-        labels = torch.from_numpy(labels).unsqueeze(1).to('cuda')
-        optim.zero_grad()
-        out = model(patches)
-        loss = criterion(out, labels)
-        loss.backward()
-        optim.step()
-        batch_loss.append(loss.item())
-        print('batch time', time.time() - batch_start)
-        if i % 100 == 99:
-            print(i)
-    print('epoch time', time.time() - epoch_start)
-
-#################
-# VISUALISATION #
-#################
-plt.figure()
-plt.plot(batch_loss)
-plt.show()
-
-###########
-# CLOSING #
-###########
-it.close()
-file.close()
-javabridge.kill_vm()
+
+def plot_loss(batch_loss: list[float]):
+    # imported here, so training without a plot does not need a display or matplotlib
+    import matplotlib.pyplot as plt
+
+    plt.figure()
+    plt.plot(batch_loss)
+    plt.show()
+
+
+def save_checkpoint(path: str, model: torch.nn.Module, optim: torch.optim.Optimizer, epoch: int, data_state: dict,
+                    batch_loss: list[float]):
+    """
+    Save the model, the optimizer and the position of the data iterator. The file is replaced atomically, so an
+    interrupted save leaves the previous checkpoint intact.
+    """
+    checkpoint = {
+        'model': model.state_dict(),
+        'optim': optim.state_dict(),
+        'epoch': epoch,
+        'data': data_state,
+        'batch_loss': batch_loss,
+    }
+    torch.save(checkpoint, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def train(
+        data_file: str = DATA_FILE,
+        data_partition: str = DATA_PARTITION,
+        batch_size: int = BATCH_SIZE,
+        patch_size: int = PATCH_SIZE,
+        stride: int = STRIDE,
+        epochs: int = EPOCHS,
+        buffered: bool = BUFFERED,
+        prefetch_depth: int = PREFETCH_DEPTH,
+        num_workers: int = NUM_WORKERS,
+        model_name: str = 'resnet',
+        seed: int = SEED,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_every: int = CHECKPOINT_EVERY,
+        shuffle_patches: bool = False,
+        raw: bool = False,
+) -> list[float]:
+    """
+    Train a model and return the loss of every batch. The JVM is started by the first vsi image that is read, in the
+    worker processes when num_workers > 0.
+    :param checkpoint_path: Save a checkpoint every checkpoint_every batches and at the end of every epoch, and resume
+    from it if it exists. Resuming continues with the batch after the last saved one without reading the images
+    before it. Only supported with num_workers = 0 and without shuffle_patches.
+    :param shuffle_patches: Draw every batch from shuffled patches of all slides with a PatchDataset, instead of reading
+    the slides one after another
+    :param raw: Read uint8 patches and labels into reused, pinned buffers and convert them to float on the device, see
+    Uint8Normalize
+    """
+    if checkpoint_path is not None and (num_workers or shuffle_patches):
+        raise ValueError("Checkpoints store the position of the DataIterator, which needs num_workers = 0 and no "
+                         "shuffle_patches")
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    pin_memory = raw and device == 'cuda'
+
+    ###############
+    # PREPARATION #
+    ###############
+    file = None
+    if shuffle_patches:
+        dataset = PatchDataset(data_file, data_partition, patch_size, stride, LabelEnum.CLASS_MIDDLE, raw=raw)
+        it = get_patch_loader(dataset, batch_size, num_workers, seed, prefetch_factor=max(prefetch_depth, 1),
+                              pin_memory=pin_memory)
+    elif num_workers:
+        dataset = SlideDataset(data_file, data_partition, patch_size, stride, batch_size, LabelEnum.CLASS_MIDDLE,
+                               buffered, seed, raw)
+        it = get_data_loader(dataset, num_workers, prefetch_factor=max(prefetch_depth, 1), pin_memory=pin_memory)
+    else:
+        file = h5py.File(data_file, 'r')
+        # the ring holds the prefetched batches, the batch being read, the batch being trained on and the previous
+        # batch, whose asynchronous copy to the device may still be running
+        ring_size = prefetch_depth + 3 if raw else 0
+        it = DataIterator(file[data_partition], patch_size, stride, batch_size, LabelEnum.CLASS_MIDDLE,
+                          buffered=buffered, seed=seed, raw=raw, ring_size=ring_size, pin_memory=pin_memory)
+        if prefetch_depth:
+            it = PrefetchIterator(it, prefetch_depth)
+        it.open()
+
+    model = brainsec_resnet18().to(device) if model_name == 'resnet' else Unet(3, 1, device=device)
+    optim = torch.optim.Adam(model.parameters())
+    criterion = torch.nn.CrossEntropyLoss()  # include weighting per class
+    normalize = Uint8Normalize().to(device)
+    batch_loss = []
+
+    start_epoch = 0
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=True)
+        model.load_state_dict(checkpoint['model'])
+        optim.load_state_dict(checkpoint['optim'])
+        start_epoch = checkpoint['epoch']
+        it.load_state_dict(checkpoint['data'])
+        batch_loss = checkpoint['batch_loss']
+        print('resumed epoch', start_epoch, 'after', len(batch_loss), 'batches')
+
+    ############
+    # TRAINING #
+    ############
+    try:
+        for e in range(start_epoch, epochs):
+            epoch_start = time.time()
+            print('epoch', e)
+            if shuffle_patches:
+                it.batch_sampler.set_epoch(e)
+            elif num_workers:
+                dataset.set_epoch(e)
+            elif e > start_epoch:
+                it.set_epoch(e)
+            batches = iter(it)
+            i = 0
+            while True:
+                with profiling.stage('train.wait_for_data'):
+                    data = next(batches, None)
+                if data is None:
+                    break
+                batch_start = time.time()
+                patches, labels = data
+                with profiling.stage('train.to_device') as stage:
+                    stage.add_bytes(patches.nbytes + labels.nbytes)
+                    patches, labels = to_device(patches, labels, device, normalize)
+                    labels = labels.unsqueeze(1)
+                optim.zero_grad()
+                with profiling.stage('train.forward'):
+                    out = model(patches)
+                    loss = criterion(out, labels)
+                with profiling.stage('train.backward'):
+                    loss.backward()
+                    optim.step()
+                    # reading the loss waits for the device, so the stages above include the device time
+                    batch_loss.append(loss.item())
+                print('batch time', time.time() - batch_start)
+                if i % 100 == 99:
+                    print(i)
+                i += 1
+                if checkpoint_path is not None and i % checkpoint_every == 0:
+                    save_checkpoint(checkpoint_path, model, optim, e, it.state_dict(), batch_loss)
+            if checkpoint_path is not None:
+                save_checkpoint(checkpoint_path, model, optim, e, it.state_dict(), batch_loss)
+            print('epoch time', time.time() - epoch_start)
+
+    ###########
+    # CLOSING #
+    ###########
+    finally:
+        if shuffle_patches:
+            dataset.close()
+        elif not num_workers:
+            it.close()
+            file.close()
+    return batch_loss
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train a model on the patches of a data partition.')
+    parser.add_argument('data_file', nargs='?', default=DATA_FILE, help='The hdf5 data file')
+    parser.add_argument('--partition', default=DATA_PARTITION, help='The partition group of the data file')
+    parser.add_argument('--model', choices=['resnet', 'unet'], default='resnet', help='The model to train')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--patch-size', type=int, default=PATCH_SIZE)
+    parser.add_argument('--stride', type=int, default=STRIDE)
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--unbuffered', action='store_true', help='Read every patch separately')
+    parser.add_argument('--prefetch-depth', type=int, default=PREFETCH_DEPTH, help='0 disables prefetching')
+    parser.add_argument('--workers', type=int, default=NUM_WORKERS, help='The number of DataLoader workers')
+    parser.add_argument('--seed', type=int, default=SEED, help='The seed of the image or patch order')
+    parser.add_argument('--shuffle-patches', action='store_true', help='Shuffle the patches of all slides')
+    parser.add_argument('--raw', action='store_true', help='Read uint8 batches and convert them on the device')
+    parser.add_argument('--checkpoint', help='Save checkpoints to this file and resume from it if it exists')
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY, help='Batches between checkpoints')
+    parser.add_argument('--plot', action='store_true', help='Plot the loss per batch when done')
+    parser.add_argument('--profile', help='Write per-stage timings to PROFILE.json and a Chrome trace to '
+                                          'PROFILE.trace.json, the data stages are only recorded with --workers 0')
+    args = parser.parse_args()
+
+    if args.profile:
+        profiling.enable()
+        if args.workers:
+            warnings.warn("The data stages run in the DataLoader workers and are not profiled, use --workers 0 to "
+                          "profile them")
+
+    batch_loss = train(
+        args.data_file,
+        args.partition,
+        args.batch_size,
+        args.patch_size,
+        args.stride,
+        args.epochs,
+        not args.unbuffered,
+        args.prefetch_depth,
+        args.workers,
+        args.model,
+        args.seed,
+        args.checkpoint,
+        args.checkpoint_every,
+        args.shuffle_patches,
+        args.raw,
+    )
+
+    if args.profile:
+        profiling.write_json(args.profile + '.json')
+        profiling.write_chrome_trace(args.profile + '.trace.json')
+
+    #################
+    # VISUALISATION #
+    #################
+    if args.plot:
+        plot_loss(batch_loss)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
 from .patch_coordinate_iterator import PatchCoordinateIterator
+from .patch_grid import PatchGrid
+from .band_cache import BandCache
+from .lru import LruCache
 from .names import from_vsi, from_vsi_path, from_qupath, is_qupath, Name
 from .label_enum import LabelEnum
@@ -0,0 +1,76 @@
+from typing import Callable, Iterator
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class BandCache:
+    """
+    A cache that holds one horizontal band of a matrix-like structure that is patch_size rows high. Overlapping patches
+    in that band are cut out as views of the band, so every pixel is read only once instead of once per patch that
+    covers it.
+    """
+    def __init__(
+            self,
+            read_band: Callable[[int, int, int], np.ndarray],
+            width: int,
+            patch_size: int,
+            band_width: int,
+    ):
+        """
+        Constructor for the cache
+        :param read_band: A function (top, left, width) -> array of shape (patch_size, width, ...) that reads a band
+        :param width: Width of the matrix in pixels
+        :param patch_size: Width and height of the patch
+        :param band_width: The maximum width of a band in pixels, at least patch_size
+        """
+        self.read_band = read_band
+        self.width = width
+        self.patch_size = patch_size
+        self.band_width = max(band_width, patch_size)
+
+        self.band = None
+        self.top = None
+        self.left = None
+        self.num_reads = 0
+
+    def covers(self, top: int, left: int) -> bool:
+        return (
+            self.band is not None
+            and top == self.top
+            and self.left <= left
+            and left + self.patch_size <= self.left + self.band.shape[1]
+        )
+
+    def load(self, top: int, left: int):
+        width = min(self.band_width, self.width - left)
+        self.band = self.read_band(top, left, width)
+        self.top = top
+        self.left = left
+        self.num_reads += 1
+
+    def clear(self):
+        self.band = None
+        self.top = None
+        self.left = None
+
+    def patches(self, coords: np.ndarray) -> Iterator[tuple[slice, np.ndarray]]:
+        """
+        Cut the patches at the given coordinates out of the cached band, loading new bands when needed.
+        :param coords: An (N, 2) array of (top, left) coordinates
+        :return: An iterator of (part, windows) pairs, where part is the slice of coords that windows belongs to and
+        windows is a view of shape (len(part), patch_size, ..., patch_size), so the width axis is always last.
+        """
+        start = 0
+        while start < len(coords):
+            top, left = (int(c) for c in coords[start])
+            if not self.covers(top, left):
+                self.load(top, left)
+            end = start + 1
+            band_right = self.left + self.band.shape[1] - self.patch_size
+            while end < len(coords) and coords[end, 0] == top and self.left <= coords[end, 1] <= band_right:
+                end += 1
+            offsets = coords[start:end, 1] - self.left
+            windows = sliding_window_view(self.band, self.patch_size, axis=1)[:, offsets]
+            yield slice(start, end), np.moveaxis(windows, 1, 0)
+            start = end
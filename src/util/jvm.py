@@ -0,0 +1,63 @@
+"""
+The javabridge VM of this process.
+
+Bio-Formats needs a running JVM, but booting one takes seconds, and javabridge cannot start a second VM in a process
+once the first has been killed. start_jvm starts the VM once, the first time a vsi image is opened, and shuts it down
+when the process exits. Code that never reads a vsi image never starts it.
+"""
+import atexit
+import multiprocessing
+import multiprocessing.util
+from typing import Optional
+
+_jvm_started = False
+_jvm_killed = False
+
+
+def is_jvm_started() -> bool:
+    return _jvm_started and not _jvm_killed
+
+
+def start_jvm(in_worker: Optional[bool] = None):
+    """
+    Start the javabridge VM of this process if it is not running yet, and shut it down when the process exits.
+    :param in_worker: Whether this process is a worker of a multiprocessing pool or DataLoader, detected from the
+    parent process if None. Workers do not run atexit handlers, so the VM is shut down by a multiprocessing finalizer
+    instead.
+    """
+    global _jvm_started
+    if _jvm_killed:
+        raise RuntimeError("The JVM of this process was shut down and cannot be started again")
+    if _jvm_started:
+        return
+    import javabridge
+    import bioformats
+    javabridge.start_vm(class_path=bioformats.JARS)
+    logback = javabridge.JClassWrapper("loci.common.LogbackTools")
+    logback.enableLogging()
+    logback.setRootLevel("ERROR")
+    _jvm_started = True
+    if in_worker is None:
+        in_worker = multiprocessing.parent_process() is not None
+    if in_worker:
+        multiprocessing.util.Finalize(None, kill_jvm, exitpriority=10)
+    else:
+        atexit.register(kill_jvm)
+
+
+def kill_jvm():
+    """
+    Shut the VM down, if it was started. It cannot be started again in this process.
+    """
+    global _jvm_killed
+    if _jvm_started and not _jvm_killed:
+        import javabridge
+        javabridge.kill_vm()
+        _jvm_killed = True
+
+
+def start_worker_jvm(*args):
+    """
+    Initializer for pool and DataLoader workers that starts a JVM in every worker.
+    """
+    start_jvm(in_worker=True)
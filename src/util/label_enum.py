@@ -4,4 +4,6 @@ class LabelEnum(Enum):
     NO = 0
     CLASS_AVG = 1
     CLASS_MIDDLE = 2
-    PIXEL = 3
\ No newline at end of file
+    PIXEL = 3
+    # the class of the centre pixel, as used by the pyvips patch functions in pre_proccessing
+    CLASS = 2
@@ -0,0 +1,45 @@
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+
+class LruCache:
+    """
+    A bounded cache that keeps the most recently used values and closes the least recently used one when it is full.
+    It is meant for open file handles and readers.
+    """
+    def __init__(self, max_size: int, close: Optional[Callable] = None):
+        """
+        Constructor for the LruCache
+        :param max_size: The maximum number of values in the cache
+        :param close: A function that is called with every value that is evicted or cleared
+        """
+        self.max_size = max_size
+        self.close = close
+        self.values = OrderedDict()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key: Hashable):
+        return key in self.values
+
+    def get(self, key: Hashable, create: Callable):
+        """
+        Get the value of a key, creating it with create() if it is not in the cache.
+        """
+        if key in self.values:
+            self.values.move_to_end(key)
+            return self.values[key]
+        value = create()
+        self.values[key] = value
+        while len(self.values) > self.max_size:
+            _, evicted = self.values.popitem(last=False)
+            if self.close is not None:
+                self.close(evicted)
+        return value
+
+    def clear(self):
+        while self.values:
+            _, value = self.values.popitem(last=False)
+            if self.close is not None:
+                self.close(value)
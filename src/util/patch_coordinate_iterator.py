@@ -1,4 +1,8 @@
-import math
+from typing import Optional
+
+import numpy as np
+
+from .patch_grid import PatchGrid
 
 
 class PatchCoordinateIterator:
@@ -25,41 +29,84 @@ class PatchCoordinateIterator:
         self.patch_size = patch_size
         self.stride = stride
 
-        self.num_width = math.floor((width - patch_size) / stride) + 1
-        self.num_height = math.floor((height - patch_size) / stride) + 1
+        self.grid = PatchGrid(width, height, patch_size, stride)
+        self.num_width = self.grid.num_width
+        self.num_height = self.grid.num_height
 
-        self.row = 0
-        self.column = 0
+        self.indices = None
+        self.index = 0
 
-    def __iter__(self):
-        self.row = 0
-        self.column = 0
-        return self
+    def select(self, keep: Optional[np.ndarray]):
+        """
+        Only visit a subset of the patches. The position is reset to the start.
+        :param keep: A boolean array with one entry per patch of the grid, or None to visit all patches again
+        """
+        self.indices = None if keep is None else np.flatnonzero(keep)
+        self.index = 0
 
-    def __next__(self):
+    def grid_index(self) -> int:
         """
-        Get the next coordinates on the grid in a left-to-right then top-to-bottom order
-        :return: The top left coordinates of the next patch.
+        Get the flat grid index of the next patch, or len(grid) when the iterator is exhausted.
         """
-        if self.column < self.num_width:
-            column_pixel = self.column * self.stride
-        else:
-            column_pixel = self.width - self.patch_size
-        if self.row < self.num_height:
-            row_pixel = self.row * self.stride
+        if self.indices is None:
+            return min(self.index, len(self.grid))
+        if self.index < len(self.indices):
+            return int(self.indices[self.index])
+        return len(self.grid)
+
+    def seek(self, row: int, column: int):
+        """
+        Move to the patch at grid position (row, column), or to the first selected patch after it.
+        """
+        grid_index = row * self.grid.shape[1] + column
+        if self.indices is None:
+            self.index = grid_index
         else:
-            row_pixel = self.height - self.patch_size
+            self.index = int(np.searchsorted(self.indices, grid_index))
 
-        self.column += 1
-        if self.column > self.num_width:
-            self.row += 1
-            self.column = 0
-        if self.row > self.num_height:
-            raise StopIteration
+    @property
+    def row(self) -> int:
+        return self.grid_index() // self.grid.shape[1]
 
-        return row_pixel, column_pixel
+    @row.setter
+    def row(self, row: int):
+        self.seek(row, self.column)
 
+    @property
+    def column(self) -> int:
+        return self.grid_index() % self.grid.shape[1]
 
+    @column.setter
+    def column(self, column: int):
+        self.seek(self.row, column)
 
+    def __len__(self):
+        return len(self.grid) if self.indices is None else len(self.indices)
 
+    def __iter__(self):
+        self.index = 0
+        return self
 
+    def __next__(self):
+        """
+        Get the next coordinates on the grid in a left-to-right then top-to-bottom order
+        :return: The top left coordinates of the next patch.
+        """
+        if self.index >= len(self):
+            raise StopIteration
+        coords = self.grid[self.grid_index()]
+        self.index += 1
+        return coords
+
+    def next_batch(self, batch_size: int) -> np.ndarray:
+        """
+        Get the coordinates of the next batch_size patches at once
+        :param batch_size: The maximum number of coordinates to return
+        :return: An (N, 2) array of top left coordinates with N <= batch_size, empty when the grid is exhausted.
+        """
+        if self.indices is None:
+            batch = self.grid[self.index:self.index + batch_size]
+        else:
+            batch = self.grid[self.indices[self.index:self.index + batch_size]]
+        self.index += len(batch)
+        return batch
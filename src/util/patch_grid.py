@@ -0,0 +1,105 @@
+import math
+from typing import Union
+
+import numpy as np
+
+
+class PatchGrid:
+    """
+    A random-access grid of the top left coordinates of all patches in a matrix-like structure. The grid has one extra
+    row and column at the bottom and right edge that contain the patches clamped to the edge of the matrix, so every
+    pixel is covered. Coordinates are stored as one (N, 2) array of (row_pixel, column_pixel) pairs in a left-to-right
+    then top-to-bottom order.
+    """
+    def __init__(
+            self,
+            width: int,
+            height: int,
+            patch_size: int,
+            stride: int,
+    ):
+        """
+        Constructor for the grid
+        :param width: Width of the matrix in pixels
+        :param height: height of the matrix in pixels
+        :param patch_size: Width and height of the patch
+        :param stride: The stride of the sliding window
+        """
+        self.width = width
+        self.height = height
+        self.patch_size = patch_size
+        self.stride = stride
+
+        self.num_width = math.floor((width - patch_size) / stride) + 1
+        self.num_height = math.floor((height - patch_size) / stride) + 1
+
+        self.column_pixels = np.append(np.arange(self.num_width) * stride, width - patch_size)
+        self.row_pixels = np.append(np.arange(self.num_height) * stride, height - patch_size)
+        self.shape = (len(self.row_pixels), len(self.column_pixels))
+
+        self.coords = np.empty((self.shape[0] * self.shape[1], 2), dtype=np.int64)
+        self.coords[:, 0] = np.repeat(self.row_pixels, self.shape[1])
+        self.coords[:, 1] = np.tile(self.column_pixels, self.shape[0])
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __getitem__(self, item: Union[int, slice, np.ndarray, tuple]) -> Union[tuple[int, int], np.ndarray]:
+        """
+        Get coordinates from the grid.
+        :param item: A flat index, a (row, column) tuple, a slice or an array of flat indices
+        :return: A (row_pixel, column_pixel) tuple for a single index, an (N, 2) array otherwise
+        """
+        if isinstance(item, tuple):
+            item = self.flat_index(*item)
+        if isinstance(item, (int, np.integer)):
+            row_pixel, column_pixel = self.coords[item]
+            return int(row_pixel), int(column_pixel)
+        return self.coords[item]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def flat_index(self, row: int, column: int) -> int:
+        """
+        Convert a (row, column) grid position to a flat index.
+        """
+        if not (0 <= row < self.shape[0] and 0 <= column < self.shape[1]):
+            raise IndexError(f"Grid position ({row}, {column}) out of range for grid of shape {self.shape}")
+        return row * self.shape[1] + column
+
+    def grid_index(self, index: int) -> tuple[int, int]:
+        """
+        Convert a flat index to a (row, column) grid position.
+        """
+        row, column = divmod(index, self.shape[1])
+        return row, column
+
+    def batches(self, batch_size: int):
+        """
+        Iterate over the grid in batches of coordinate arrays. The last batch may be smaller than batch_size.
+        """
+        for start in range(0, len(self), batch_size):
+            yield self.coords[start:start + batch_size]
+
+    def shard_indices(self, rank: int, world: int) -> np.ndarray:
+        """
+        Get the flat indices of a contiguous, deterministic partition of the grid.
+        :param rank: The index of the partition, 0 <= rank < world
+        :param world: The total number of partitions
+        :return: The flat indices that belong to partition rank
+        """
+        if not 0 <= rank < world:
+            raise ValueError(f"rank must be in [0, {world}), got {rank}")
+        bounds = np.linspace(0, len(self), world + 1).astype(np.int64)
+        return np.arange(bounds[rank], bounds[rank + 1])
+
+    def shard(self, rank: int, world: int) -> np.ndarray:
+        """
+        Get the coordinates of a contiguous, deterministic partition of the grid. Every coordinate is in exactly one
+        partition and partition sizes differ by at most one.
+        :param rank: The index of the partition, 0 <= rank < world
+        :param world: The total number of partitions
+        :return: An (N, 2) array of coordinates that belong to partition rank
+        """
+        return self.coords[self.shard_indices(rank, world)]
@@ -0,0 +1,175 @@
+"""
+Opt-in per-stage timers and byte counters for the data and training pipeline.
+
+    from src.util import profiling
+
+    profiling.enable()
+    with profiling.stage('slide.read') as s:
+        band = read()
+        s.add_bytes(band.nbytes)
+    profiling.write_json('profile.json')
+    profiling.write_chrome_trace('profile.trace.json')  # open in chrome://tracing or ui.perfetto.dev
+
+While profiling is disabled, stage returns a shared context manager that does nothing, so an instrumented stage costs
+one attribute check.
+
+The summary is aggregated as the stages finish, so it covers the whole run. Only the last max_events events are kept
+for the trace. Stages are only recorded in the process that runs them: the stages of DataLoader worker processes, such
+as slide.read with --workers > 0, are not part of the summary or the trace.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+MAX_EVENTS = 100_000
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def add_bytes(self, num_bytes: int):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+        self.num_bytes = 0
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter_ns()
+        self.profiler.record(self.name, self.start, end - self.start, self.num_bytes)
+
+    def add_bytes(self, num_bytes: int):
+        self.num_bytes += num_bytes
+
+
+class Profiler:
+    """
+    Collects one event per executed stage: its name, start, duration, thread and the number of bytes it produced.
+    Stages may be nested and may run on several threads, such as the thread of a PrefetchIterator.
+    """
+    def __init__(self, max_events: int = MAX_EVENTS):
+        """
+        :param max_events: The number of most recent events that are kept for the trace, the summary counts all events
+        """
+        self.enabled = False
+        self.max_events = max_events
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=max_events)
+        # name: [count, total nanoseconds, bytes]
+        self.totals = {}
+        self.origin = time.perf_counter_ns()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name: str, start: int, duration: int, num_bytes: int):
+        with self.lock:
+            self.events.append((name, start, duration, threading.get_ident(), num_bytes))
+            totals = self.totals.setdefault(name, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += duration
+            totals[2] += num_bytes
+
+    def reset(self):
+        with self.lock:
+            self.events = deque(maxlen=self.max_events)
+            self.totals = {}
+            self.origin = time.perf_counter_ns()
+
+    def summary(self) -> dict:
+        """
+        Get the count, total and mean time and the throughput of every stage.
+        """
+        with self.lock:
+            totals = {name: list(values) for name, values in self.totals.items()}
+        summary = {}
+        for name in sorted(totals):
+            count, duration, num_bytes = totals[name]
+            seconds = duration / 1e9
+            summary[name] = {
+                'count': count,
+                'total_seconds': seconds,
+                'mean_seconds': seconds / count,
+                'bytes': num_bytes,
+                'mb_per_second': num_bytes / seconds / 1e6 if seconds else 0.0,
+            }
+        return summary
+
+    def write_json(self, path: str):
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def write_chrome_trace(self, path: str):
+        """
+        Write the last max_events events in the Chrome trace event format, with one track per thread.
+        """
+        pid = os.getpid()
+        with self.lock:
+            recorded = list(self.events)
+        events = [
+            {
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self.origin) / 1e3,
+                'dur': duration / 1e3,
+                'pid': pid,
+                'tid': tid,
+                'args': {'bytes': size},
+            }
+            for name, start, duration, tid, size in recorded
+        ]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+PROFILER = Profiler()
+
+
+def enable():
+    PROFILER.enabled = True
+
+
+def disable():
+    PROFILER.enabled = False
+
+
+def stage(name: str):
+    """
+    Time a stage of the pipeline, see the module docstring.
+    """
+    return PROFILER.stage(name)
+
+
+def summary() -> dict:
+    return PROFILER.summary()
+
+
+def reset():
+    PROFILER.reset()
+
+
+def write_json(path: str):
+    PROFILER.write_json(path)
+
+
+def write_chrome_trace(path: str):
+    PROFILER.write_chrome_trace(path)
@@ -0,0 +1,33 @@
+import unittest
+
+import numpy as np
+
+from src.util.band_cache import BandCache
+from src.util.patch_grid import PatchGrid
+
+
+class TestBandCache(unittest.TestCase):
+    def setUp(self):
+        self.image = np.random.default_rng(0).integers(0, 256, (300, 500, 3), dtype=np.uint8)
+
+    def read_band(self, top, left, width):
+        return self.image[top:top + 64, left:left + width]
+
+    def test_patches_match_slices(self):
+        grid = PatchGrid(500, 300, 64, 32)
+        cache = BandCache(self.read_band, 500, 64, 160)
+        for part, windows in cache.patches(grid.coords):
+            for (top, left), window in zip(grid.coords[part], windows):
+                expected = np.moveaxis(self.image[top:top + 64, left:left + 64], 1, 2)
+                self.assertTrue(np.array_equal(expected, window))
+
+    def test_reads_each_band_once(self):
+        grid = PatchGrid(500, 300, 64, 32)
+        cache = BandCache(self.read_band, 500, 64, 500)
+        for _ in cache.patches(grid.coords):
+            pass
+        self.assertEqual(grid.shape[0], cache.num_reads)
+
+
+if __name__ == '__main__':
+    unittest.main()
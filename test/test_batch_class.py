@@ -0,0 +1,69 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from shapely.geometry import Polygon
+
+from src.data_preparation.roi_cache import RoiCache
+from src.pre_proccessing.get_patch import get_patch_class, get_batch_class
+from src.util import LabelEnum
+
+
+class TestBatchClass(unittest.TestCase):
+    def setUp(self):
+        # a non-convex roi with a hole and a diagonal edge, whose vertices and edges lie on integer coordinates, so
+        # many patch centres land exactly on the boundary
+        shell = [(10, 10), (90, 10), (90, 90), (60, 90), (60, 40), (40, 40), (40, 90), (10, 90), (10, 10)]
+        hole = [(20, 20), (30, 20), (30, 30), (20, 30), (20, 20)]
+        roi = Polygon(shell, [hole]).union(Polygon([(90, 10), (110, 30), (90, 30)]))
+        self.image = SimpleNamespace(filename='F:/tiff/slide.ome.tif')
+        self.patches = [
+            mock.patch.object(RoiCache, 'ROIS', {'slide': roi}),
+            mock.patch.object(RoiCache, 'PREPARED', {}),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def assert_parity(self, coords: np.ndarray, size: int) -> np.ndarray:
+        classes = get_batch_class(self.image, coords, size)
+        expected = [get_patch_class(self.image, int(left), int(top), size) for left, top in coords]
+        self.assertEqual(expected, classes.tolist())
+        return classes
+
+    def test_grid(self):
+        # with an even size the centres are integers and hit edges and vertices of the roi, with an odd size they
+        # lie half a pixel off them
+        for size in [10, 20, 11]:
+            with self.subTest(size=size):
+                left, top = np.meshgrid(np.arange(-10, 110), np.arange(-10, 100))
+                coords = np.stack([left.ravel(), top.ravel()], axis=1)
+                classes = self.assert_parity(coords, size)
+                self.assertTrue(classes.any())
+                self.assertFalse(classes.all())
+
+    def test_boundary(self):
+        # centres exactly on a vertex, an edge, a hole edge and the diagonal edge
+        centres = np.array([[10, 10], [50, 10], [60, 65], [25, 20], [20, 25], [100, 20], [95, 15], [110, 30]])
+        self.assert_parity(centres - 5, 10)
+
+    def test_random(self):
+        rng = np.random.default_rng(0)
+        coords = rng.integers(-20, 120, (2000, 2))
+        self.assert_parity(coords, 16)
+
+
+class TestLabelEnum(unittest.TestCase):
+    def test_class_alias(self):
+        # CLASS is the name that the pre_proccessing functions use for the centre pixel class, it must stay the
+        # same member as CLASS_MIDDLE so both names select the same labels
+        self.assertIs(LabelEnum.CLASS_MIDDLE, LabelEnum.CLASS)
+        self.assertEqual(['NO', 'CLASS_AVG', 'CLASS_MIDDLE', 'PIXEL'], [label.name for label in LabelEnum])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import h5py
+import numpy as np
+
+from src.data_access.class_index import BalancedSampler, get_class_index, CLASS_INDEX_NAME
+from src.data_access.integral_labels import touch_labels
+from src.data_access.read_labels import LabelIterator
+from src.util import LabelEnum
+
+
+class TestClassIndex(unittest.TestCase):
+    def setUp(self):
+        self.file = h5py.File('class_index.hdf5', 'w', driver='core', backing_store=False)
+        rng = np.random.default_rng(0)
+        for name, fraction in [('a', 0.1), ('b', 0.3)]:
+            group = self.file.create_group(name)
+            group.create_dataset('labels', data=rng.random((600, 900)) < fraction)
+            group.create_dataset('full', data=rng.integers(0, 256, (600, 900, 3), dtype=np.uint8))
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_index_matches_labels(self):
+        group = self.file['a']
+        index = get_class_index(group, 256, 128, LabelEnum.CLASS_MIDDLE)
+        self.assertIn(CLASS_INDEX_NAME, group)
+        labels = np.concatenate(list(LabelIterator(group['labels'], 256, 128, 16, LabelEnum.CLASS_MIDDLE)))
+        self.assertTrue(np.array_equal(index[1], np.flatnonzero(labels)))
+        self.assertTrue(np.array_equal(index[0], np.flatnonzero(labels == 0)))
+        cached = get_class_index(group, 256, 128, LabelEnum.CLASS_MIDDLE)
+        self.assertTrue(all(np.array_equal(a, b) for a, b in zip(index, cached)))
+
+    def test_index_after_new_labels(self):
+        group = self.file['a']
+        index = get_class_index(group, 256, 128, LabelEnum.CLASS_MIDDLE)
+        group['labels'][...] = ~group['labels'][()]
+        touch_labels(group['labels'])
+        rewritten = get_class_index(group, 256, 128, LabelEnum.CLASS_MIDDLE)
+        self.assertTrue(np.array_equal(index[0], rewritten[1]))
+        self.assertTrue(np.array_equal(index[1], rewritten[0]))
+        # labels of another shape
+        del group['labels']
+        group.create_dataset('labels', data=np.ones((300, 400), dtype=bool))
+        index = get_class_index(group, 256, 128, LabelEnum.CLASS_MIDDLE)
+        self.assertEqual(0, len(index[0]))
+        self.assertEqual(6, len(index[1]))
+
+    def test_sampler_ratio(self):
+        with BalancedSampler(self.file, 256, 128, 8, ratio=0.25, seed=0, max_open=1) as sampler:
+            image_ids, coords, labels = sampler.sample()
+            self.assertEqual(labels.sum(), 2)
+            for image_id, (top, left), label in zip(image_ids, coords, labels):
+                group = self.file[sampler.image_list[image_id]]
+                self.assertEqual(group['labels'][top + 128, left + 128], label)
+            patches, labels = next(sampler)
+            self.assertEqual(patches.shape, (8, 3, 256, 256))
+            self.assertEqual(labels.sum(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.data_preparation import convert_vsi
+from src.data_preparation.convert_vsi import convert_slide, get_target_path, get_todo, PART_SUFFIX
+
+
+def write_stub(vsi_path: str, hdf5_path: str, **kwargs):
+    with open(hdf5_path, 'ab') as file:
+        file.write(b'full')
+
+
+def write_partial_and_fail(vsi_path: str, hdf5_path: str, **kwargs):
+    with open(hdf5_path, 'ab') as file:
+        file.write(b'half')
+    raise KeyboardInterrupt
+
+
+class TestConvertVsi(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.output_dir = self.dir.name
+        self.vsi_paths = [f'/slides/slide_{i}.vsi' for i in range(3)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def convert(self, vsi_path: str, write_full=write_stub):
+        # the stubs replace the Bio-Formats readers, so no JVM is needed
+        with mock.patch.object(convert_vsi, 'write_full_img', write_full), \
+                mock.patch.object(convert_vsi, 'write_downsample_img', write_stub):
+            convert_slide(vsi_path, self.output_dir)
+
+    def test_interrupted_conversion_leaves_no_file(self):
+        vsi_path = self.vsi_paths[0]
+        target = get_target_path(vsi_path, self.output_dir)
+        with self.assertRaises(KeyboardInterrupt):
+            self.convert(vsi_path, write_partial_and_fail)
+        self.assertFalse(os.path.exists(target))
+        self.assertTrue(os.path.exists(target + PART_SUFFIX))
+        self.assertEqual(self.vsi_paths, get_todo(self.vsi_paths, self.output_dir))
+
+    def test_rerun_replaces_part_file(self):
+        vsi_path = self.vsi_paths[0]
+        target = get_target_path(vsi_path, self.output_dir)
+        with self.assertRaises(KeyboardInterrupt):
+            self.convert(vsi_path, write_partial_and_fail)
+        self.convert(vsi_path)
+        self.assertFalse(os.path.exists(target + PART_SUFFIX))
+        with open(target, 'rb') as file:
+            # the partial data of the failed run is not part of the result
+            self.assertEqual(b'fullfull', file.read())
+
+    def test_rerun_skips_converted(self):
+        self.convert(self.vsi_paths[1])
+        self.assertEqual([self.vsi_paths[0], self.vsi_paths[2]], get_todo(self.vsi_paths, self.output_dir))
+        for vsi_path in self.vsi_paths:
+            self.convert(vsi_path)
+        self.assertEqual([], get_todo(self.vsi_paths, self.output_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+
+from src.segmentation.cpu_inference import (
+    check_accuracy, export_torchscript, get_model, get_probabilities, get_quantized_backend, prepare_cpu_model,
+    quantize_static,
+)
+
+
+def randomize_batch_norms(model: nn.Module) -> nn.Module:
+    """
+    Give the BatchNorm layers trained-like statistics, folding the default identity statistics would prove nothing.
+    """
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, nn.BatchNorm2d):
+                size = module.num_features
+                module.running_mean.copy_(torch.rand(size, generator=generator) - 0.5)
+                module.running_var.copy_(torch.rand(size, generator=generator) + 0.5)
+                module.weight.copy_(torch.rand(size, generator=generator) + 0.5)
+                module.bias.copy_(torch.rand(size, generator=generator) - 0.5)
+    return model.eval()
+
+
+class Invert(nn.Module):
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return 1 - x
+
+
+class TestCpuInference(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.patches = {'unet': torch.rand(2, 3, 32, 32), 'resnet': torch.rand(2, 3, 64, 64)}
+        self.models = {name: randomize_batch_norms(get_model(name)) for name in self.patches}
+
+    def test_folding_is_exact(self):
+        for name, model in self.models.items():
+            with self.subTest(model=name):
+                patches = self.patches[name]
+                folded = prepare_cpu_model(model, channels_last=False)
+                if name == 'resnet':
+                    # every BatchNorm of brainsec_resnet18 follows a convolution
+                    self.assertFalse(any(isinstance(m, nn.BatchNorm2d) for m in folded.modules()))
+                result = check_accuracy(model, folded, patches, tolerance=1e-5)
+                self.assertLessEqual(result['max_error'], 1e-5)
+                self.assertEqual(1.0, result['agreement'])
+                # the reference model is not changed
+                self.assertTrue(any(isinstance(m, nn.BatchNorm2d) for m in model.modules()))
+
+    def test_torchscript_round_trip(self):
+        model = prepare_cpu_model(self.models['unet'])
+        patches = self.patches['unet'].contiguous(memory_format=torch.channels_last)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'unet.pt')
+            export_torchscript(model, patches, path)
+            loaded = torch.jit.load(path)
+        self.assertTrue(torch.allclose(get_probabilities(model, patches), get_probabilities(loaded, patches)))
+
+    def test_accuracy_check(self):
+        model = self.models['unet']
+        patches = self.patches['unet']
+        self.assertEqual({'max_error': 0.0, 'agreement': 1.0}, check_accuracy(model, model, patches))
+        inverted = nn.Sequential(model, Invert())
+        with self.assertRaises(ValueError):
+            check_accuracy(model, inverted, patches)
+
+    def test_quantized_backend(self):
+        backend = get_quantized_backend()
+        self.assertIn(backend, torch.backends.quantized.supported_engines)
+        model = prepare_cpu_model(self.models['resnet'], channels_last=False)
+        quantized = quantize_static(model, self.patches['resnet'])
+        self.assertEqual(backend, torch.backends.quantized.engine)
+        self.assertEqual((2, 1), quantized(self.patches['resnet']).shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from src.data_access import DataIterator, PrefetchIterator
+from src.data_access.tissue_mask import TISSUE_MASK_NAME
+from src.util import LabelEnum
+
+
+class TestDataIteratorState(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = h5py.File(os.path.join(self.dir.name, 'data.hdf5'), 'w')
+        rng = np.random.default_rng(0)
+        self.group = self.file.create_group('train')
+        for i in range(4):
+            image_group = self.group.create_group(f'slide_{i}')
+            image_group.create_dataset('full', data=rng.integers(0, 256, (200, 300, 3), dtype=np.uint8))
+            image_group.create_dataset('labels', data=rng.random((200, 300)) > 0.5)
+            image_group.create_dataset(TISSUE_MASK_NAME, data=rng.random((20, 30)) > 0.3)
+
+    def tearDown(self):
+        self.file.close()
+        self.dir.cleanup()
+
+    def get_iterator(self, **kwargs) -> DataIterator:
+        return DataIterator(self.group, 64, 32, 7, LabelEnum.CLASS_MIDDLE, tissue_threshold=0.5, seed=3, **kwargs)
+
+    def assert_batches_equal(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for (patches_a, labels_a), (patches_b, labels_b) in zip(expected, actual):
+            self.assertTrue(np.array_equal(patches_a, patches_b))
+            self.assertTrue(np.array_equal(labels_a, labels_b))
+
+    def test_resume(self):
+        for buffered in [False, True]:
+            with self.subTest(buffered=buffered):
+                with self.get_iterator(buffered=buffered) as it:
+                    it.set_epoch(1)
+                    expected = list(it)
+                for stop in [0, 5, len(expected) - 1, len(expected)]:
+                    with self.get_iterator(buffered=buffered) as it:
+                        it.set_epoch(1)
+                        for _ in range(stop):
+                            next(it)
+                        state = it.state_dict()
+                    with self.get_iterator(buffered=buffered) as it:
+                        it.load_state_dict(state)
+                        self.assertEqual(1, it.epoch)
+                        self.assert_batches_equal(expected[stop:], list(it))
+
+    def test_epoch_order(self):
+        it = self.get_iterator()
+        orders = []
+        for epoch in range(3):
+            it.set_epoch(epoch)
+            orders.append([it.get_image_name(i) for i in range(it.num_images)])
+            self.assertEqual(sorted(self.group.keys()), sorted(orders[-1]))
+        self.assertNotEqual(orders[0], orders[1])
+        it.set_epoch(0)
+        self.assertEqual(orders[0], [it.get_image_name(i) for i in range(it.num_images)])
+
+    def test_prefetch_state(self):
+        with self.get_iterator() as it:
+            expected = list(it)
+        with PrefetchIterator(self.get_iterator(), depth=3) as it:
+            batches = iter(it)
+            for _ in range(4):
+                next(batches)
+            state = it.state_dict()
+        with self.get_iterator() as it:
+            it.load_state_dict(state)
+            self.assert_batches_equal(expected[4:], list(it))
+
+    def test_state_without_open(self):
+        with self.get_iterator() as it:
+            expected = list(it)
+        # a new iterator, and one that only loaded a state, can be saved before they are opened
+        it = self.get_iterator()
+        state = it.state_dict()
+        self.assertIsNone(state['image']['skip_mask'])
+        loaded = self.get_iterator()
+        loaded.load_state_dict(state)
+        self.assertEqual(state, loaded.state_dict())
+        with self.get_iterator() as it:
+            it.load_state_dict(state)
+            self.assert_batches_equal(expected, list(it))
+
+        with self.get_iterator() as it:
+            for _ in range(3):
+                next(it)
+            state = it.state_dict()
+        loaded = self.get_iterator()
+        loaded.load_state_dict(state)
+        self.assertEqual(state, loaded.state_dict())
+        with loaded:
+            self.assert_batches_equal(expected[3:], list(loaded))
+
+    def test_mismatched_state(self):
+        with self.get_iterator() as it:
+            state = it.state_dict()
+        state['image_name'] = 'other'
+        with self.assertRaises(ValueError):
+            self.get_iterator().load_state_dict(state)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pyvips as pv
+
+from src.pre_proccessing.image_cache import get_image, get_image_index, get_rng, IMAGE_CACHE, IMAGE_CACHE_SIZE
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i in range(IMAGE_CACHE_SIZE + 4):
+            path = os.path.join(self.dir.name, f'image_{i:02d}.png')
+            pv.Image.new_from_array(np.full((4 + i, 8, 3), i, dtype=np.uint8)).write_to_file(path)
+            self.paths.append(path)
+        IMAGE_CACHE.clear()
+        get_image_index.cache_clear()
+
+    def tearDown(self):
+        IMAGE_CACHE.clear()
+        get_image_index.cache_clear()
+        self.dir.cleanup()
+
+    def test_handle_reuse(self):
+        image = get_image(self.paths[0])
+        self.assertIs(image, get_image(self.paths[0]))
+        self.assertEqual(1, len(IMAGE_CACHE))
+        self.assertIs(get_image_index(self.dir.name), get_image_index(self.dir.name))
+
+    def test_size_bound(self):
+        first = get_image(self.paths[0])
+        with mock.patch.object(pv.Image, 'invalidate', autospec=True) as invalidate:
+            for path in self.paths:
+                get_image(path)
+                self.assertLessEqual(len(IMAGE_CACHE), IMAGE_CACHE_SIZE)
+        self.assertEqual(IMAGE_CACHE_SIZE, len(IMAGE_CACHE))
+        # the least recently used images were released, the first one before any other
+        self.assertEqual(len(self.paths) - IMAGE_CACHE_SIZE, invalidate.call_count)
+        self.assertIs(first, invalidate.call_args_list[0].args[0])
+        self.assertIsNot(first, get_image(self.paths[0]))
+        # the most recently used images are still open
+        last = IMAGE_CACHE.values[self.paths[-1]]
+        self.assertIs(last, get_image(self.paths[-1]))
+
+    def test_image_index(self):
+        index = get_image_index(self.dir.name)
+        self.assertEqual(self.paths, index.files)
+        self.assertEqual([8] * len(self.paths), index.widths.tolist())
+        self.assertEqual([4 + i for i in range(len(self.paths))], index.heights.tolist())
+
+
+class TestRng(unittest.TestCase):
+    def test_reproducible_per_worker(self):
+        runs = [[get_rng(42, worker_id).integers(0, 1 << 30, 16).tolist() for worker_id in range(2)] for _ in range(2)]
+        # the same seed and worker give the same stream in every run
+        self.assertEqual(runs[0], runs[1])
+        # the workers draw different streams
+        self.assertNotEqual(runs[0][0], runs[0][1])
+        self.assertNotEqual(runs[0][0], get_rng(43, 0).integers(0, 1 << 30, 16).tolist())
+
+    def test_random_seed(self):
+        self.assertNotEqual(get_rng().integers(0, 1 << 30, 16).tolist(), get_rng().integers(0, 1 << 30, 16).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import tracemalloc
+import unittest
+
+import h5py
+import numpy as np
+import torch
+
+from src.data_access.read_hdf5 import Hdf5Iterator
+from src.segmentation.cascade import CascadeSegmenter
+from src.segmentation.inference import SlideSegmenter, TILE_WIDTH
+
+
+class TestSlideSegmenter(unittest.TestCase):
+    def setUp(self):
+        self.file = h5py.File('inference.hdf5', 'w', driver='core', backing_store=False)
+        image = np.random.default_rng(0).integers(0, 256, (700, 500, 3), dtype=np.uint8)
+        self.data = self.file.create_dataset('full', data=image)
+        torch.manual_seed(0)
+        # a pixel-wise model, so the blended map must equal the model applied to the whole image
+        self.model = torch.nn.Sequential(torch.nn.Conv2d(3, 1, 1), torch.nn.Sigmoid())
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_blended_map_matches_full_image(self):
+        expected = self.model(torch.from_numpy(self.data[()].transpose(2, 0, 1)[None] / 255.0).float())
+        expected = expected[0, 0].detach().numpy()
+        for buffered in [False, True]:
+            with self.subTest(buffered=buffered):
+                slide_it = Hdf5Iterator(self.data, 256, 128, 4, buffered=buffered)
+                slide_it.open()
+                output = SlideSegmenter(self.model, 256, 128, batch_size=3).segment(slide_it, self.file)
+                slide_it.close()
+                self.assertEqual(output.shape, (700, 500))
+                self.assertTrue(np.allclose(output[()], expected, atol=1e-5))
+
+    def test_column_tiles_match_full_band(self):
+        slide_it = Hdf5Iterator(self.data, 256, 128, 4)
+        slide_it.open()
+        expected = SlideSegmenter(self.model, 256, 128, batch_size=3).segment(slide_it, self.file, 'full_band')[()]
+        # tiles narrower than a patch, unaligned and aligned with the stride, and wider than the slide
+        for tile_width in [37, 100, 128, 1000]:
+            with self.subTest(tile_width=tile_width):
+                segmenter = SlideSegmenter(self.model, 256, 128, batch_size=3, tile_width=tile_width)
+                output = segmenter.segment(slide_it, self.file)
+                self.assertTrue(np.allclose(output[()], expected, atol=1e-6))
+        slide_it.close()
+
+    def test_column_tiles_bound_memory(self):
+        # a wide slide, where the band dominates the memory of the segmentation
+        size, width = 32, 8192
+        data = self.file.create_dataset('wide', data=np.zeros((64, width, 3), dtype=np.uint8))
+        band_bytes = size * width * 2 * 4
+        peaks = {}
+        for tile_width in [None, 512]:
+            slide_it = Hdf5Iterator(data, size, size // 2, 4, buffered=False)
+            slide_it.open()
+            segmenter = SlideSegmenter(self.model, size, size // 2, batch_size=4, tile_width=tile_width)
+            tracemalloc.start()
+            segmenter.segment(slide_it, self.file, f'wide_{tile_width}')
+            peaks[tile_width] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            slide_it.close()
+        self.assertGreater(peaks[None], band_bytes)
+        self.assertLess(peaks[512], band_bytes / 4)
+
+    def test_default_tiles_bound_memory(self):
+        size, width = 32, 4 * TILE_WIDTH
+        data = self.file.create_dataset('wider', data=np.zeros((48, width, 3), dtype=np.uint8))
+        self.assertEqual(TILE_WIDTH, SlideSegmenter(self.model, size, size).tile_width)
+        peaks = {}
+        for name, kwargs in [('default', {}), ('full', {'tile_width': None})]:
+            slide_it = Hdf5Iterator(data, size, size, 64, buffered=False)
+            slide_it.open()
+            segmenter = SlideSegmenter(self.model, size, size, batch_size=64, **kwargs)
+            tracemalloc.start()
+            segmenter.segment(slide_it, self.file, f'wider_{name}')
+            peaks[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            slide_it.close()
+        # the default band covers a quarter of the slide
+        self.assertLess(peaks['default'], peaks['full'] / 3)
+
+    def test_cascade_skips_confident_patches(self):
+        image = np.zeros((1024, 1024, 3), dtype=np.uint8)
+        image[:, 600:] = 255
+        data = self.file.create_dataset('halves', data=image)
+        self.file.create_dataset('downsample', data=image[::16, ::16])
+        model = torch.nn.Sequential(torch.nn.Conv2d(3, 1, 1), torch.nn.Sigmoid())
+        with torch.no_grad():
+            model[0].weight.fill_(10)
+            model[0].bias.fill_(-15)
+        expected = model(torch.from_numpy(image.transpose(2, 0, 1)[None] / 255.0).float())[0, 0].detach().numpy()
+
+        slide_it = Hdf5Iterator(data, 256, 128, 4)
+        slide_it.open()
+        cascade = CascadeSegmenter(model, 256, 128)
+        output = cascade.segment(slide_it, self.file)
+        slide_it.close()
+        self.assertEqual(cascade.num_refined + cascade.num_skipped, 49)
+        self.assertGreater(cascade.num_skipped, cascade.num_refined)
+        self.assertEqual(output.attrs['skipped_patches'], cascade.num_skipped)
+        self.assertTrue(np.allclose(output[()], expected, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+import numpy as np
+from rasterio.features import rasterize
+from rasterio.transform import Affine
+from shapely.geometry import Polygon
+from shapely.prepared import prep
+
+from src.data_preparation.write_labels_to_hdf5 import classify_tile, rasterize_tile, INSIDE, OUTSIDE, BOUNDARY
+
+SIZE = 32
+
+
+def get_reference_labels(roi, left: int, top: int, size: int) -> np.ndarray:
+    """
+    The labels of a tile as they were computed before tiles were classified: a full polygon intersection.
+    """
+    square = Polygon([(left, top), (left + size, top), (left + size, top + size), (left, top + size), (left, top)])
+    intersection = square.intersection(roi)
+    labels = np.zeros((size, size), dtype=np.uint8)
+    if not intersection.is_empty:
+        transform = Affine(1, 0, left, 0, 1, top)
+        rasterize([intersection], out=labels, transform=transform, default_value=1)
+    return labels.astype(bool)
+
+
+def get_tile_labels(roi, prepared_roi, left: int, top: int, size: int) -> tuple[int, np.ndarray]:
+    """
+    The labels of a tile as write_ground_truth writes them.
+    """
+    tile_class = classify_tile(prepared_roi, left, top, size)
+    if tile_class == INSIDE:
+        return tile_class, np.ones((size, size), dtype=bool)
+    elif tile_class == OUTSIDE:
+        return tile_class, np.zeros((size, size), dtype=bool)
+    return tile_class, rasterize_tile(roi, left, top, size)
+
+
+class TestLabelTiles(unittest.TestCase):
+    def setUp(self):
+        # a non-convex ROI with a notch and a hole. Several edges lie exactly on tile edges, so some tiles only touch
+        # the ROI, and others have the ROI boundary on their own edge.
+        shell = [(32, 32), (256, 32), (256, 256), (160, 256), (160, 128), (96, 128), (96, 256), (32, 256), (32, 32)]
+        hole = [(64, 64), (128, 64), (128, 96), (64, 96), (64, 64)]
+        self.roi = Polygon(shell, [hole])
+        self.prepared_roi = prep(self.roi)
+
+    def assert_tiles_match(self, lefts, tops) -> list[int]:
+        counts = [0, 0, 0]
+        for top in tops:
+            for left in lefts:
+                tile_class, labels = get_tile_labels(self.roi, self.prepared_roi, left, top, SIZE)
+                counts[tile_class] += 1
+                expected = get_reference_labels(self.roi, left, top, SIZE)
+                self.assertTrue(np.array_equal(expected, labels), f'tile ({left}, {top}), class {tile_class}')
+        return counts
+
+    def test_aligned_tiles(self):
+        positions = range(0, 320, SIZE)
+        counts = self.assert_tiles_match(positions, positions)
+        self.assertTrue(all(counts))
+
+    def test_unaligned_tiles(self):
+        positions = range(5, 320, 27)
+        counts = self.assert_tiles_match(positions, positions)
+        self.assertTrue(all(counts))
+
+    def test_touching_tiles(self):
+        # tiles that only share an edge or a corner with the ROI
+        touching = [(0, 32), (32, 0), (0, 0), (256, 32), (32, 256), (256, 256), (128, 224)]
+        for left, top in touching:
+            tile_class, labels = get_tile_labels(self.roi, self.prepared_roi, left, top, SIZE)
+            self.assertIn(tile_class, [OUTSIDE, BOUNDARY])
+            self.assertTrue(np.array_equal(get_reference_labels(self.roi, left, top, SIZE), labels))
+
+    def test_hole(self):
+        # a tile inside the hole is outside the roi
+        tile_class, labels = get_tile_labels(self.roi, self.prepared_roi, 70, 70, 16)
+        self.assertEqual(OUTSIDE, tile_class)
+        self.assertTrue(np.array_equal(get_reference_labels(self.roi, 70, 70, 16), labels))
+        # a tile around the hole is on the boundary
+        tile_class, labels = get_tile_labels(self.roi, self.prepared_roi, 56, 56, 80)
+        self.assertEqual(BOUNDARY, tile_class)
+        self.assertFalse(labels[16:32, 16:64].any())
+        self.assertTrue(np.array_equal(get_reference_labels(self.roi, 56, 56, 80), labels))
+
+
+if __name__ == '__main__':
+    unittest.main()
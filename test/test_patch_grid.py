@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+
+from src.util.patch_grid import PatchGrid
+from src.util.patch_coordinate_iterator import PatchCoordinateIterator
+
+
+class TestPatchGrid(unittest.TestCase):
+    def test_covers_edges(self):
+        w, h, s, t = 1000, 700, 256, 128
+        grid = PatchGrid(w, h, s, t)
+        covered = np.zeros((h, w), dtype=bool)
+        for n, m in grid.coords:
+            self.assertLessEqual(n + s, h)
+            self.assertLessEqual(m + s, w)
+            covered[n:n + s, m:m + s] = True
+        self.assertTrue(covered.all())
+
+    def test_matches_iterator(self):
+        it = PatchCoordinateIterator(11, 9, 3, 2)
+        self.assertEqual([tuple(c) for c in it.grid.coords], [c for c in it])
+
+    def test_indexing(self):
+        grid = PatchGrid(1000, 700, 256, 128)
+        row, column = 2, 3
+        index = grid.flat_index(row, column)
+        self.assertEqual((row * 128, column * 128), grid[row, column])
+        self.assertEqual(grid[row, column], grid[index])
+        self.assertEqual((row, column), grid.grid_index(index))
+        self.assertEqual((5, 2), grid[2:7].shape)
+
+    def test_shard(self):
+        grid = PatchGrid(1000, 700, 256, 128)
+        shards = [grid.shard_indices(rank, 3) for rank in range(3)]
+        self.assertTrue(np.array_equal(np.arange(len(grid)), np.concatenate(shards)))
+        self.assertLessEqual(max(map(len, shards)) - min(map(len, shards)), 1)
+
+    def test_next_batch(self):
+        it = PatchCoordinateIterator(1000, 700, 256, 128)
+        batches = []
+        batch = it.next_batch(8)
+        while len(batch):
+            batches.append(batch)
+            batch = it.next_batch(8)
+        self.assertTrue(np.array_equal(it.grid.coords, np.concatenate(batches)))
+
+
+if __name__ == '__main__':
+    unittest.main()
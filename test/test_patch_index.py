@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+import torch
+
+from src.data_access import DataIterator, PatchIndex, PatchReader
+from src.data_access.tissue_mask import TISSUE_MASK_NAME
+from src.segmentation.dataset import PatchDataset, ShuffledBatchSampler, collate_batch, get_patch_loader
+from src.util import LabelEnum
+
+
+class TestPatchIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'data.hdf5')
+        rng = np.random.default_rng(0)
+        with h5py.File(self.path, 'w') as file:
+            group = file.create_group('train')
+            for i, (height, width) in enumerate([(200, 300), (150, 150), (260, 180)]):
+                image_group = group.create_group(f'slide_{i}')
+                image_group.create_dataset('full', data=rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+                image_group.create_dataset('labels', data=rng.random((height, width)) > 0.5)
+                image_group.create_dataset(TISSUE_MASK_NAME, data=rng.random((height // 10, width // 10)) > 0.3)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read_all(self, tissue_threshold):
+        with h5py.File(self.path, 'r') as file:
+            with DataIterator(file['train'], 64, 32, 1000, LabelEnum.CLASS_AVG,
+                              tissue_threshold=tissue_threshold) as it:
+                batches = list(it)
+        return np.concatenate([b[0] for b in batches]), np.concatenate([b[1] for b in batches])
+
+    def test_index_matches_data_iterator(self):
+        for tissue_threshold in [None, 0.5]:
+            with self.subTest(tissue_threshold=tissue_threshold):
+                patches, labels = self.read_all(tissue_threshold)
+                with h5py.File(self.path, 'r') as file:
+                    index = PatchIndex(file['train'], 64, 32, tissue_threshold)
+                    self.assertEqual(len(patches), len(index))
+                    order = np.random.default_rng(1).permutation(len(index))
+                    with PatchReader(file['train'], index, LabelEnum.CLASS_AVG, max_open=2) as reader:
+                        read_patches, read_labels = reader.read(order)
+                        self.assertLessEqual(len(reader.slides), 2)
+                self.assertTrue(np.array_equal(patches[order], read_patches))
+                self.assertTrue(np.allclose(labels[order], read_labels))
+
+    def test_sampler_covers_every_patch_once(self):
+        for block_size in [1, 4]:
+            with self.subTest(block_size=block_size):
+                sampler = ShuffledBatchSampler(103, 10, seed=2, block_size=block_size)
+                batches = list(sampler)
+                self.assertEqual(len(sampler), len(batches))
+                self.assertEqual(list(range(103)), sorted(i for batch in batches for i in batch))
+                sampler.set_epoch(1)
+                self.assertNotEqual(batches, list(sampler))
+        sampler = ShuffledBatchSampler(103, 10, drop_last=True)
+        self.assertTrue(all(len(batch) == 10 for batch in sampler))
+        self.assertEqual(10, len(sampler))
+
+    def test_loader(self):
+        dataset = PatchDataset(self.path, 'train', 64, 32, LabelEnum.CLASS_MIDDLE)
+        loader = get_patch_loader(dataset, 16, 0, seed=3)
+        num_patches = 0
+        for patches, labels in loader:
+            self.assertEqual((3, 64, 64), patches.shape[1:])
+            self.assertEqual(len(patches), len(labels))
+            num_patches += len(patches)
+        dataset.close()
+        self.assertEqual(len(dataset), num_patches)
+
+    def test_batches_without_copy(self):
+        dataset = PatchDataset(self.path, 'train', 64, 32, LabelEnum.CLASS_MIDDLE)
+        items = list(range(0, len(dataset), 3))
+        batch = dataset.__getitems__(items)
+        self.assertIs(batch, collate_batch(batch))
+        # the batches of a DataLoader that reads one patch at a time are the same
+        patches, labels = collate_batch([dataset[item] for item in items])
+        self.assertTrue(torch.equal(batch[0], patches))
+        self.assertTrue(torch.equal(batch[1], labels))
+        loader = get_patch_loader(dataset, 16, 0, seed=3)
+        for indices, (patches, labels) in zip(loader.batch_sampler, loader):
+            expected = dataset.__getitems__(indices)
+            self.assertTrue(torch.equal(expected[0], patches))
+            self.assertTrue(torch.equal(expected[1], labels))
+        dataset.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+from typing import Optional
+
+from src.data_access import PrefetchIterator
+
+
+class Source:
+    """
+    A batch iterator over range(num_batches) that raises error after fail_at batches.
+    """
+    def __init__(self, num_batches: int, fail_at: Optional[int] = None, error: Optional[Exception] = None):
+        self.num_batches = num_batches
+        self.fail_at = fail_at
+        self.error = error
+        self.opened = False
+        self.produced = 0
+
+    def open(self):
+        self.opened = True
+
+    def close(self):
+        self.opened = False
+
+    def __iter__(self):
+        self.produced = 0
+        return self
+
+    def __next__(self):
+        if self.fail_at is not None and self.produced == self.fail_at:
+            raise self.error
+        if self.produced == self.num_batches:
+            raise StopIteration
+        self.produced += 1
+        return self.produced - 1
+
+
+class TestPrefetchIterator(unittest.TestCase):
+    def test_batches_in_order(self):
+        with PrefetchIterator(Source(10), depth=3, attach_jvm=False) as it:
+            self.assertEqual(list(range(10)), list(it))
+
+    def test_error_is_reraised(self):
+        error = ValueError('broken slide')
+        with PrefetchIterator(Source(10, fail_at=4, error=error), depth=2, attach_jvm=False) as it:
+            batches = iter(it)
+            self.assertEqual([0, 1, 2, 3], [next(batches) for _ in range(4)])
+            with self.assertRaises(ValueError) as context:
+                next(batches)
+            self.assertIs(error, context.exception)
+            self.assertIsNone(it.thread)
+
+    def test_stop_iteration_is_repeated(self):
+        with PrefetchIterator(Source(3), depth=2, attach_jvm=False) as it:
+            batches = iter(it)
+            self.assertEqual([0, 1, 2], [next(batches) for _ in range(3)])
+            for _ in range(3):
+                with self.assertRaises(StopIteration):
+                    next(batches)
+
+    def test_close_with_full_queue(self):
+        source = Source(1000)
+        it = PrefetchIterator(source, depth=2, attach_jvm=False, timeout=0.01)
+        it.open()
+        batches = iter(it)
+        next(batches)
+        # wait until the background thread blocks on the full queue
+        deadline = time.monotonic() + 5
+        while not it.queue.full() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(it.queue.full())
+        thread = it.thread
+        closer = threading.Thread(target=it.close)
+        closer.start()
+        closer.join(timeout=5)
+        self.assertFalse(closer.is_alive())
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(source.opened)
+        self.assertLess(source.produced, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
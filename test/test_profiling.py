@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.util import profiling
+from src.util.profiling import Profiler
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = Profiler()
+
+    def test_disabled_records_nothing(self):
+        with self.profiler.stage('read') as stage:
+            stage.add_bytes(10)
+        self.assertEqual([], list(self.profiler.events))
+        self.assertEqual({}, self.profiler.summary())
+
+    def test_summary(self):
+        self.profiler.enabled = True
+        for _ in range(3):
+            with self.profiler.stage('read') as stage:
+                stage.add_bytes(100)
+        with self.profiler.stage('forward'):
+            pass
+        summary = self.profiler.summary()
+        self.assertEqual(['forward', 'read'], list(summary))
+        self.assertEqual(3, summary['read']['count'])
+        self.assertEqual(300, summary['read']['bytes'])
+        self.assertEqual(0, summary['forward']['bytes'])
+
+    def test_bounded_events(self):
+        profiler = Profiler(max_events=5)
+        profiler.enabled = True
+        for i in range(20):
+            with profiler.stage('read') as stage:
+                stage.add_bytes(i)
+        self.assertEqual(5, len(profiler.events))
+        # the summary still counts every event
+        self.assertEqual(20, profiler.summary()['read']['count'])
+        self.assertEqual(sum(range(20)), profiler.summary()['read']['bytes'])
+        self.assertEqual(list(range(15, 20)), [event[4] for event in profiler.events])
+        profiler.reset()
+        self.assertEqual({}, profiler.summary())
+
+    def test_module_stage(self):
+        profiling.reset()
+        profiling.enable()
+        try:
+            with profiling.stage('read'):
+                pass
+        finally:
+            profiling.disable()
+        with profiling.stage('read'):
+            pass
+        self.assertEqual(1, profiling.summary()['read']['count'])
+        profiling.reset()
+
+    def test_chrome_trace(self):
+        self.profiler.enabled = True
+        with self.profiler.stage('outer'):
+            with self.profiler.stage('inner'):
+                pass
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            self.profiler.write_chrome_trace(path)
+            with open(path) as file:
+                events = json.load(file)['traceEvents']
+        self.assertEqual(['inner', 'outer'], [event['name'] for event in events])
+        inner, outer = events
+        self.assertEqual('X', inner['ph'])
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertGreaterEqual(outer['ts'] + outer['dur'], inner['ts'] + inner['dur'])
+
+
+if __name__ == '__main__':
+    unittest.main()
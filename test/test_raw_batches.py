@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+import torch
+
+from src.data_access import DataIterator, BatchRing
+from src.segmentation.normalize import Uint8Normalize, to_device
+from src.util import LabelEnum
+
+
+class TestRawBatches(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = h5py.File(os.path.join(self.dir.name, 'data.hdf5'), 'w')
+        rng = np.random.default_rng(0)
+        self.group = self.file.create_group('train')
+        for i in range(2):
+            image_group = self.group.create_group(f'slide_{i}')
+            image_group.create_dataset('full', data=rng.integers(0, 256, (200, 300, 3), dtype=np.uint8))
+            image_group.create_dataset('labels', data=rng.random((200, 300)) > 0.5)
+
+    def tearDown(self):
+        self.file.close()
+        self.dir.cleanup()
+
+    def read(self, label_type, **kwargs):
+        with DataIterator(self.group, 64, 32, 7, label_type, **kwargs) as it:
+            # copy, the batches of a ring are overwritten
+            return [(np.array(patches), np.array(labels)) for patches, labels in it]
+
+    def test_raw_matches_float(self):
+        normalize = Uint8Normalize()
+        for label_type in [LabelEnum.CLASS_MIDDLE, LabelEnum.CLASS_AVG, LabelEnum.PIXEL]:
+            for buffered in [False, True]:
+                with self.subTest(label_type=label_type, buffered=buffered):
+                    expected = self.read(label_type, buffered=buffered)
+                    raw = self.read(label_type, buffered=buffered, raw=True, ring_size=3)
+                    self.assertEqual(len(expected), len(raw))
+                    for (patches, labels), (raw_patches, raw_labels) in zip(expected, raw):
+                        self.assertEqual(np.uint8, raw_patches.dtype)
+                        if label_type != LabelEnum.CLASS_AVG:
+                            self.assertEqual(np.uint8, raw_labels.dtype)
+                        device_patches, device_labels = to_device(raw_patches, raw_labels, 'cpu', normalize)
+                        self.assertTrue(torch.equal(torch.from_numpy(patches), device_patches))
+                        self.assertTrue(torch.equal(torch.from_numpy(labels), device_labels))
+
+    def test_ring_reuses_buffers(self):
+        with DataIterator(self.group, 64, 32, 7, LabelEnum.CLASS_MIDDLE, raw=True, ring_size=3) as it:
+            batches = [patches for patches, _ in it]
+        self.assertTrue(np.shares_memory(batches[0], batches[3]))
+        self.assertFalse(np.shares_memory(batches[0], batches[1]))
+
+    def test_normalize(self):
+        ring = BatchRing((2, 3, 4, 4), np.uint8, 2)
+        batch = ring.next()
+        batch[:] = np.random.default_rng(1).integers(0, 256, batch.shape)
+        mean, std = [0.5, 0.4, 0.3], [0.2, 0.25, 0.3]
+        out = Uint8Normalize(mean, std)(torch.from_numpy(batch))
+        expected = (batch / 255.0 - np.reshape(mean, (1, 3, 1, 1))) / np.reshape(std, (1, 3, 1, 1))
+        self.assertTrue(np.allclose(expected, out.numpy(), atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
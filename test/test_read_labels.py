@@ -0,0 +1,43 @@
+import unittest
+
+import h5py
+import numpy as np
+
+from src.data_access.integral_labels import write_integral_labels
+from src.data_access.read_labels import LabelIterator
+from src.util import LabelEnum
+
+
+class TestLabelIterator(unittest.TestCase):
+    def setUp(self):
+        self.file = h5py.File('labels.hdf5', 'w', driver='core', backing_store=False)
+        labels = np.random.default_rng(0).random((700, 1000)) < 0.5
+        self.data = self.file.create_dataset('labels', data=labels, compression='lzf', chunks=True)
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_buffered_matches_unbuffered(self):
+        for label_type in [LabelEnum.PIXEL, LabelEnum.CLASS_MIDDLE, LabelEnum.CLASS_AVG]:
+            with self.subTest(label_type=label_type):
+                plain = LabelIterator(self.data, 256, 128, 8, label_type)
+                buffered = LabelIterator(self.data, 256, 128, 8, label_type, buffered=True, band_patches=4)
+                plain_batches = list(plain)
+                buffered_batches = list(buffered)
+                self.assertEqual(len(plain_batches), len(buffered_batches))
+                for a, b in zip(plain_batches, buffered_batches):
+                    self.assertTrue(np.array_equal(a, b))
+
+    def test_integral_matches_patches(self):
+        write_integral_labels(self.data, block=32)
+        for label_type in [LabelEnum.CLASS_MIDDLE, LabelEnum.CLASS_AVG]:
+            with self.subTest(label_type=label_type):
+                plain = LabelIterator(self.data, 256, 128, 8, label_type, use_integral=False)
+                integral = LabelIterator(self.data, 256, 128, 8, label_type)
+                self.assertIsNotNone(integral.integral)
+                for a, b in zip(plain, integral):
+                    self.assertTrue(np.array_equal(a, b))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pyvips as pv
+
+from src.pre_proccessing.region_reader import RegionReader, iter_row_bands
+
+
+class TestRegionReader(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'image.tif')
+        self.array = np.random.default_rng(0).integers(0, 256, (700, 500, 3), dtype=np.uint8)
+        pv.Image.new_from_array(self.array).tiffsave(self.path, tile=True)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_batch_matches_crop(self):
+        reader = RegionReader(pv.Image.new_from_file(self.path))
+        coords = np.array([[0, 0], [244, 444], [17, 301]])
+        out = np.zeros((4, 256, 256, 3), dtype=np.uint8)
+        batch = reader.get_batch(coords, 256, out)
+        self.assertEqual(len(batch), 3)
+        for patch, (left, top) in zip(out, coords):
+            self.assertTrue(np.array_equal(patch, self.array[top:top + 256, left:left + 256]))
+
+    def test_row_bands(self):
+        tops = []
+        for top, band in iter_row_bands(self.path, 256, 128):
+            self.assertTrue(np.array_equal(band, self.array[top:top + 256]))
+            tops.append(top)
+        self.assertEqual(tops, [0, 128, 256, 384, 444])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from shapely.geometry import Polygon, MultiPolygon
+
+from src.data_preparation.project import Project
+from src.data_preparation.roi_cache import RoiCache
+
+
+def make_entry(name: str, rois: list):
+    annotations = [SimpleNamespace(roi=roi) for roi in rois]
+    return SimpleNamespace(image_name=name, hierarchy=SimpleNamespace(annotations=annotations))
+
+
+class TestRoiCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.project_path = os.path.join(self.dir.name, 'project.qpproj')
+        with open(self.project_path, 'w') as file:
+            file.write('{}')
+        os.utime(self.project_path, (1000, 1000))
+        square = Polygon([(0, 0), (10, 0), (10, 10), (0, 10)], [[(2, 2), (4, 2), (4, 4), (2, 4)]])
+        self.rois = {
+            'slide_a': square,
+            'slide_b': MultiPolygon([square, Polygon([(20, 20), (30.5, 20), (30.5, 31.25)])]),
+        }
+        entries = [make_entry(name, [roi]) for name, roi in self.rois.items()] + [make_entry('slide_c', [])]
+        self.project = SimpleNamespace(images=entries)
+        self.patches = [
+            mock.patch.object(Project, 'PROJECT', self.project),
+            mock.patch.object(Project, 'PROJECT_PATH', self.project_path),
+            mock.patch.object(Project, 'INDEX', None),
+            mock.patch.object(RoiCache, 'CACHE_PATH', os.path.join(self.dir.name, 'roi_cache.hdf5')),
+            mock.patch.object(RoiCache, 'ROIS', None),
+            mock.patch.object(RoiCache, 'PREPARED', {}),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.dir.cleanup()
+
+    def test_project_index(self):
+        self.assertIs(self.project.images[0], Project.get_image('slide_a'))
+        self.assertIs(self.project.images[1], Project.get_image_from_path('F:/tiff/slide_b.ome.tif'))
+        self.assertIsNone(Project.get_image('missing'))
+
+    def test_wkb_round_trip(self):
+        RoiCache.build(1000.0)
+        loaded = RoiCache.load()
+        self.assertEqual(sorted(self.rois), sorted(loaded))
+        for name, roi in self.rois.items():
+            self.assertTrue(roi.equals_exact(loaded[name], 0))
+        self.assertTrue(RoiCache.get_prepared_roi('slide_a').contains(Polygon([(5, 5), (6, 5), (6, 6)])))
+        self.assertIsNone(RoiCache.get_prepared_roi('slide_c'))
+
+    def test_cache_hit(self):
+        RoiCache.load()
+        with mock.patch.object(Project, 'get_index', side_effect=AssertionError('the project was opened')):
+            loaded = RoiCache.load()
+        self.assertEqual(sorted(self.rois), sorted(loaded))
+
+    def test_rebuild_after_project_change(self):
+        RoiCache.load()
+        changed = Polygon([(0, 0), (5, 0), (5, 5)])
+        self.project.images[0] = make_entry('slide_a', [changed])
+        Project.INDEX = None
+        # unchanged project: the stale cache is used
+        self.assertFalse(RoiCache.load()['slide_a'].equals(changed))
+        os.utime(self.project_path, (2000, 2000))
+        self.assertTrue(RoiCache.load()['slide_a'].equals(changed))
+
+    def test_project_not_available(self):
+        RoiCache.load()
+        os.remove(self.project_path)
+        with mock.patch.object(Project, 'get_index', side_effect=AssertionError('the project was opened')):
+            self.assertEqual(sorted(self.rois), sorted(RoiCache.load()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+
+from src.segmentation.dataset import SlideDataset
+from src.util import LabelEnum
+
+
+class TestSlideDataset(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'data.hdf5')
+        with h5py.File(self.path, 'w') as file:
+            group = file.create_group('train')
+            for i in range(7):
+                group.create_group(f'slide_{i}')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def get_dataset(self, seed: int = 0) -> SlideDataset:
+        return SlideDataset(self.path, 'train', 64, 32, 4, LabelEnum.CLASS_MIDDLE, seed=seed)
+
+    def test_every_image_in_one_worker(self):
+        dataset = self.get_dataset()
+        for epoch in range(3):
+            dataset.set_epoch(epoch)
+            for num_workers in range(1, 10):
+                with self.subTest(epoch=epoch, num_workers=num_workers):
+                    shards = [dataset.get_worker_images(w, num_workers) for w in range(num_workers)]
+                    images = [image for shard in shards for image in shard]
+                    self.assertEqual(len(dataset.image_list), len(images))
+                    self.assertEqual(sorted(dataset.image_list), sorted(images))
+                    sizes = [len(shard) for shard in shards]
+                    self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_order_fixed_per_seed_and_epoch(self):
+        orders = {}
+        for seed in [0, 1]:
+            for epoch in [0, 1]:
+                dataset = self.get_dataset(seed)
+                dataset.set_epoch(epoch)
+                orders[seed, epoch] = dataset.get_worker_images(0, 1)
+                again = self.get_dataset(seed)
+                again.set_epoch(epoch)
+                self.assertEqual(orders[seed, epoch], again.get_worker_images(0, 1))
+        self.assertNotEqual(orders[0, 0], orders[0, 1])
+        self.assertNotEqual(orders[0, 0], orders[1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
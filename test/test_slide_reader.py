@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+import pyvips as pv
+
+from src.data_access import Hdf5Iterator, Hdf5Reader, SlideIterator, SlideReader, TiffIterator
+from src.data_access.read_data import get_backend, get_slide_iterator
+
+
+class TestSlideReaders(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.image = np.random.default_rng(0).integers(0, 256, (700, 900, 3), dtype=np.uint8)
+        self.tiff_path = os.path.join(self.dir.name, 'slide.tif')
+        pv.Image.new_from_array(self.image).tiffsave(self.tiff_path, tile=True, pyramid=True)
+        self.file = h5py.File(os.path.join(self.dir.name, 'data.hdf5'), 'w')
+        self.group = self.file.create_group('slide')
+        self.group['tiff_path'] = 'slide.tif'
+
+    def tearDown(self):
+        self.file.close()
+        self.dir.cleanup()
+
+    def test_backends_return_identical_batches(self):
+        full = self.group.create_dataset('full', data=self.image, chunks=(128, 128, 3))
+        for buffered in [False, True]:
+            with self.subTest(buffered=buffered):
+                iterators = [
+                    TiffIterator(self.tiff_path, 256, 128, 5, buffered=buffered, band_patches=3),
+                    Hdf5Iterator(full, 256, 128, 5, buffered=buffered, band_patches=3),
+                ]
+                batches = []
+                for slide_it in iterators:
+                    slide_it.open()
+                    batches.append(list(slide_it))
+                    slide_it.close()
+                self.assertEqual(len(batches[0]), len(batches[1]))
+                for a, b in zip(*batches):
+                    self.assertTrue(np.array_equal(a, b))
+
+    def test_array_reader(self):
+        full = self.group.create_dataset('full', data=self.image)
+        reader = Hdf5Reader(self.image)
+        self.assertEqual([(900, 700)], reader.get_level_sizes())
+        region = reader.read_region(10, 20, 30, 40)
+        self.assertTrue(np.array_equal(self.image[20:60, 10:40], region))
+        region[:] = 0
+        self.assertTrue(np.array_equal(full[()], self.image))
+        out = np.empty((40, 30, 3), dtype=np.uint8)
+        self.assertIs(out, reader.read_region(10, 20, 30, 40, out=out))
+        self.assertTrue(np.array_equal(self.image[20:60, 10:40], out))
+        for buffered in [False, True]:
+            with self.subTest(buffered=buffered):
+                iterators = [
+                    SlideIterator(reader, 256, 128, 5, buffered=buffered, band_patches=3),
+                    Hdf5Iterator(full, 256, 128, 5, buffered=buffered, band_patches=3),
+                ]
+                batches = []
+                for slide_it in iterators:
+                    slide_it.open()
+                    batches.append(list(slide_it))
+                    slide_it.close()
+                self.assertEqual(len(batches[0]), len(batches[1]))
+                for a, b in zip(*batches):
+                    self.assertTrue(np.array_equal(a, b))
+
+    def test_hdf5_thumbnail(self):
+        full = self.group.create_dataset('full', data=self.image)
+        with self.assertRaises(KeyError):
+            Hdf5Reader(full).read_thumbnail()
+        downsample = self.image[::16, ::16]
+        self.group.create_dataset('downsample', data=downsample)
+        self.assertTrue(np.array_equal(downsample, Hdf5Reader(full).read_thumbnail()))
+
+    def test_reader_interface(self):
+        class IncompleteReader(SlideReader):
+            def get_level_sizes(self) -> list[tuple[int, int]]:
+                return [(1, 1)]
+
+        with self.assertRaises(TypeError):
+            SlideReader()
+        with self.assertRaises(TypeError):
+            IncompleteReader()
+
+    def test_backend_selection(self):
+        self.assertEqual(get_backend(self.group), 'tiff')
+        slide_it = get_slide_iterator(self.group, 256, 128, 4)
+        slide_it.open()
+        self.assertEqual(slide_it.reader.get_level_sizes()[0], (900, 700))
+        self.assertEqual(slide_it.get_thumbnail().shape[2], 3)
+        slide_it.close()
+        self.group.create_dataset('full', data=self.image)
+        self.assertEqual(get_backend(self.group), 'hdf5')
+
+
+if __name__ == '__main__':
+    unittest.main()
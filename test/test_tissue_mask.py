@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from src.data_access.tissue_mask import (
+    TISSUE_MASK_NAME, compute_tissue_mask, get_tissue_fractions, get_tissue_mask, otsu_threshold,
+)
+from src.util import PatchCoordinateIterator, PatchGrid
+
+SCALE = 16
+
+
+def make_thumbnail(height: int = 60, width: int = 80) -> tuple[np.ndarray, np.ndarray]:
+    """
+    A grey glass background with a saturated, stained disk.
+    :return: The (height, width, 3) uint8 thumbnail and the boolean disk
+    """
+    rows, columns = np.mgrid[:height, :width]
+    disk = (rows - 30) ** 2 + (columns - 35) ** 2 < 18 ** 2
+    thumbnail = np.full((height, width, 3), 215, dtype=np.uint8)
+    thumbnail[disk] = (190, 70, 150)
+    return thumbnail, disk
+
+
+class TestTissueMask(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'data.hdf5')
+        self.thumbnail, self.disk = make_thumbnail()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_mask_and_fractions(self):
+        self.assertEqual(0, otsu_threshold(np.array([0, 0, 255, 255], dtype=np.uint8)))
+        mask = compute_tissue_mask(self.thumbnail)
+        self.assertTrue(np.array_equal(self.disk, mask))
+        # floats in [0, 1] give the same mask
+        self.assertTrue(np.array_equal(self.disk, compute_tissue_mask(self.thumbnail / 255)))
+
+        height, width = np.array(mask.shape) * SCALE
+        grid = PatchGrid(width, height, 128, 96)
+        fractions = get_tissue_fractions(mask, grid)
+        self.assertEqual((len(grid),), fractions.shape)
+        for (top, left), fraction in zip(grid.coords, fractions):
+            # the patch sizes and coordinates are multiples of the scale, so every patch covers whole mask pixels
+            expected = self.disk[top // SCALE:(top + 128) // SCALE, left // SCALE:(left + 128) // SCALE].mean()
+            self.assertAlmostEqual(expected, fraction)
+        self.assertEqual(0, fractions.min())
+        self.assertEqual(1, fractions.max())
+
+    def test_cache_only_when_writable(self):
+        calls = []
+
+        def get_thumbnail():
+            calls.append(1)
+            return self.thumbnail
+
+        with h5py.File(self.path, 'w') as file:
+            file.create_group('slide')
+        with h5py.File(self.path, 'r') as file:
+            self.assertTrue(np.array_equal(self.disk, get_tissue_mask(file['slide'], get_thumbnail)))
+            self.assertNotIn(TISSUE_MASK_NAME, file['slide'])
+        self.assertEqual(1, len(calls))
+        with h5py.File(self.path, 'r+') as file:
+            get_tissue_mask(file['slide'], get_thumbnail)
+            self.assertIn(TISSUE_MASK_NAME, file['slide'])
+        self.assertEqual(2, len(calls))
+        with h5py.File(self.path, 'r') as file:
+            # the cached mask is used without reading the thumbnail
+            self.assertTrue(np.array_equal(self.disk, get_tissue_mask(file['slide'], get_thumbnail)))
+        self.assertEqual(2, len(calls))
+
+
+class TestSelect(unittest.TestCase):
+    def test_select_skips_patches(self):
+        patch_it = PatchCoordinateIterator(500, 400, 64, 48)
+        keep = np.zeros(len(patch_it.grid), dtype=bool)
+        keep[[0, 3, 4, 10, len(keep) - 1]] = True
+        patch_it.select(keep)
+        expected = patch_it.grid.coords[keep].tolist()
+        self.assertEqual(5, len(patch_it))
+        self.assertEqual(expected, [list(coords) for coords in patch_it])
+
+        patch_it.select(keep)
+        batches = [patch_it.next_batch(2) for _ in range(4)]
+        self.assertEqual([2, 2, 1, 0], [len(batch) for batch in batches])
+        self.assertEqual(expected, np.concatenate(batches).tolist())
+
+        patch_it.select(None)
+        self.assertEqual(len(patch_it.grid), len(list(patch_it)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+import numpy as np
+
+from benchmark.synthetic import FakeVsiIterator, make_slide
+
+
+class TestVsiIterator(unittest.TestCase):
+    def setUp(self):
+        self.image = make_slide(700, 500)
+
+    def read_all(self, buffered: bool, band_patches: int = 4) -> list[np.ndarray]:
+        slide_it = FakeVsiIterator(self.image, 128, 96, 5, buffered=buffered, band_patches=band_patches)
+        slide_it.open()
+        try:
+            return list(slide_it)
+        finally:
+            slide_it.close()
+
+    def test_buffered_matches_unbuffered(self):
+        expected = self.read_all(False)
+        for band_patches in [1, 3, 64]:
+            with self.subTest(band_patches=band_patches):
+                batches = self.read_all(True, band_patches)
+                self.assertEqual(len(expected), len(batches))
+                for a, b in zip(expected, batches):
+                    self.assertTrue(np.array_equal(a, b))
+
+    def test_patches_match_image(self):
+        slide_it = FakeVsiIterator(self.image, 128, 96, 5, buffered=True)
+        slide_it.open()
+        coords = slide_it.patch_it.grid.coords
+        batch = np.concatenate(list(slide_it))
+        slide_it.close()
+        for (top, left), patch in zip(coords, batch):
+            expected = np.transpose(self.image[top:top + 128, left:left + 128], (2, 0, 1)) / 255.0
+            self.assertTrue(np.array_equal(expected.astype(np.float32), patch))
+
+
+if __name__ == '__main__':
+    unittest.main()